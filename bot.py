@@ -4,7 +4,7 @@ BOT DE ESCALA MILITAR - Cerebro Principal
 Bot do Telegram para ler PDFs de escalas militares e notificar policiais.
 
 Funcionalidades:
-- Ler PDFs de um canal do Telegram
+- Ler PDFs (ou fotos da escala) de um canal do Telegram
 - Extrair nomes de policiais
 - Enviar mensagem privada para cada policial
 - Sistema de confirmacao de ciencia
@@ -15,15 +15,22 @@ Versao: 1.0
 """
 
 import os
+import re
 import json
 import logging
 import asyncio
+import time
+import secrets
+import threading
+import weakref
+from collections import Counter
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
@@ -32,7 +39,11 @@ from telegram.ext import (
 )
 
 # Importa nosso parser de PDF
-from pdf_parser import PDFParser
+from pdf_parser import PDFParser, separar_posto
+from notificacoes import FilaNotificacoes
+from limitador import CacheRespostas, LimitadorComandos
+from registro_policiais import Policial, RegistroPoliciais
+from historico import Historico, dia_iso
 
 # Configuracao de logging (registra tudo que acontece)
 logging.basicConfig(
@@ -51,7 +62,43 @@ BOT_TOKEN = os.environ.get("BOT_TOKEN", "")
 CANAL_ESCALA_ID = os.environ.get("CANAL_ESCALA_ID", "")
 
 # Nome do arquivo do banco de dados
-ARQUIVO_DB = "database.json"
+ARQUIVO_DB = os.environ.get("ARQUIVO_DB", "database.json")
+
+# Segundos que as alteracoes do banco esperam para serem gravadas juntas no disco
+INTERVALO_GRAVACAO = float(os.environ.get("INTERVALO_GRAVACAO", "1"))
+
+# Pasta do historico de escalas e confirmacoes (lido pela exportacao do web_server.py)
+PASTA_HISTORICO = os.environ.get("PASTA_HISTORICO", os.path.join(os.path.dirname(ARQUIVO_DB), "historico"))
+
+# Meses de historico guardados alem do mes atual (0 = guarda para sempre)
+RETENCAO_HISTORICO_MESES = int(os.environ.get("RETENCAO_HISTORICO_MESES", "24"))
+
+# Chats dos administradores, separados por virgula (podem usar o /contagem)
+ADMINS = {int(chat) for chat in os.environ.get("ADMINS", "").replace(' ', '').split(',') if chat.lstrip('-').isdigit()}
+
+# Motor de OCR: "auto", "tesserocr" (em processo) ou "pytesseract"
+OCR_MOTOR = os.environ.get("OCR_MOTOR", "auto")
+
+# Segundos que as notificacoes de um mesmo policial esperam para serem agrupadas
+JANELA_AGRUPAMENTO = float(os.environ.get("JANELA_AGRUPAMENTO", "30"))
+
+# Lembretes para quem nao confirmou: tempo apos o envio e acao de cada passo
+# (ex: "2h,6h,8h:canal" = lembra em +2h e +6h, e avisa o canal em +8h)
+ESCALONAMENTO_LEMBRETES = os.environ.get("ESCALONAMENTO_LEMBRETES", "2h,6h,8h:canal")
+
+# Segundos esperando as outras fotos de um album (cada foto chega em um update)
+ESPERA_ALBUM = float(os.environ.get("ESPERA_ALBUM", "2"))
+
+# Dias que um botao de confirmacao continua valido
+VALIDADE_BOTOES_DIAS = float(os.environ.get("VALIDADE_BOTOES_DIAS", "7"))
+
+# Limites de comandos: por chat (por minuto, com rajada) e global (por segundo)
+COMANDOS_POR_MINUTO_CHAT = float(os.environ.get("COMANDOS_POR_MINUTO_CHAT", "10"))
+RAJADA_COMANDOS_CHAT = int(os.environ.get("RAJADA_COMANDOS_CHAT", "5"))
+COMANDOS_POR_SEGUNDO_GLOBAL = float(os.environ.get("COMANDOS_POR_SEGUNDO_GLOBAL", "20"))
+
+# Prefixo do callback_data dos botoes de confirmacao (seguido do token)
+PREFIXO_CONFIRMAR = "c:"
 
 # ============== BANCO DE DADOS ==============
 
@@ -61,31 +108,152 @@ class BancoDeDados:
     Armazena informacoes dos policiais cadastrados.
     """
     
-    def __init__(self, arquivo: str = ARQUIVO_DB):
+    def __init__(self, arquivo: str = ARQUIVO_DB, pasta_historico: str = PASTA_HISTORICO):
         self.arquivo = arquivo
+        self._trava_arquivo = threading.Lock()
+        
+        # Gravacao adiada: varias alteracoes seguidas viram uma gravacao so
+        self._alterado = False
+        self._gravacao: Optional[asyncio.Task] = None
+        self._trava_gravacao = asyncio.Lock()
+        
         self.dados = self.carregar()
+        
+        # Historico so de acrescimo (o banco guarda so o estado atual)
+        self.historico = Historico(pasta_historico)
+        self.historico.preparar()
+        if self.historico.vazio():
+            self._migrar_para_historico()
+        
+        # Os policiais ficam no registro compacto, fora da arvore JSON
+        self.policiais = RegistroPoliciais()
+        self.policiais.carregar(self.dados.pop("policiais", []))
+        
+        # Travas por chave (so existem enquanto alguem esta usando)
+        self._travas = weakref.WeakValueDictionary()
+    
+    def _migrar_para_historico(self):
+        """Copia para o historico as confirmacoes de um banco antigo."""
+        for mensagem_id, registros in self.dados["confirmacoes"].items():
+            for chat_id, registro in registros.items():
+                if registro.get("confirmou"):
+                    self.historico.acrescentar("confirmacoes", [{
+                        "dia": registro["data"][:10], "mensagem_id": mensagem_id, "chat_id": chat_id,
+                        "nome_completo": "", "confirmado_em": registro["data"]
+                    }])
+    
+    def trava(self, tipo: str, chave) -> asyncio.Lock:
+        """
+        Trava de uma chave do banco, para handlers concorrentes.
+        Use quando a leitura e a alteracao tem um await no meio.
+        
+        Tipos usados: "escala" (mensagem_id), "roster" (canal|data),
+        "nome" (nome sem posto), "chat" (chat_id) e "mensagem"
+        (chat|mensagem, edicao de uma mensagem enviada). Quem precisar
+        de mais de uma trava pega nesta ordem, para nao haver deadlock.
+        
+        Returns:
+            asyncio.Lock compartilhado por todos que pedem a mesma chave
+        """
+        chave = (tipo, str(chave))
+        trava = self._travas.get(chave)
+        if trava is None:
+            trava = asyncio.Lock()
+            self._travas[chave] = trava
+        return trava
     
     def carregar(self) -> dict:
         """Carrega os dados do arquivo JSON."""
         try:
             with open(self.arquivo, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                dados = json.load(f)
+            # Bancos antigos podem nao ter as chaves mais novas
+            dados.setdefault("rosters", {})
+            dados.setdefault("pendentes", {})
+            dados.setdefault("lembretes", {})
+            dados.setdefault("turnos", {})
+            dados.setdefault("tokens", {})
+            dados.setdefault("totais", {})
+            return dados
         except FileNotFoundError:
             # Se o arquivo nao existe, cria estrutura padrao
             dados_padrao = {
-                "policiais": {},  # nome -> {chat_id, data_cadastro}
+                "policiais": [],  # [posto, nome, chat_id, cadastro] por policial
                 "escalas_processadas": [],  # IDs das mensagens ja processadas
-                "confirmacoes": {}  # mensagem_id -> {policial: confirmou}
+                "confirmacoes": {},  # mensagem_id -> {policial: confirmou}
+                "rosters": {},  # "canal|data" -> ultimo roster publicado
+                "pendentes": {},  # mensagem_id -> {chat_id: nome} sem confirmacao
+                "lembretes": {},  # mensagem_id -> agenda de lembretes
+                "turnos": {},  # nome_completo -> proximos turnos do policial
+                "tokens": {},  # token do botao -> [mensagem_id, chat_id, nome, expira]
+                "totais": {}  # mensagem_id -> {notificados, confirmados}
             }
             self.salvar(dados_padrao)
             return dados_padrao
     
     def salvar(self, dados: dict = None):
-        """Salva os dados no arquivo JSON."""
+        """
+        Salva os dados no arquivo JSON.
+        
+        Dentro do event loop a gravacao eh adiada: as alteracoes dos
+        proximos INTERVALO_GRAVACAO segundos saem em uma gravacao so,
+        feita fora do loop (um clique nao reescreve o banco inteiro).
+        Fora do loop (scripts, testes) grava na hora.
+        """
+        if dados is not None:
+            self._escrever(self._serializar(dados))
+            return
+        
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._escrever(self._serializar())
+            return
+        
+        self._alterado = True
+        if self._gravacao is None:
+            self._gravacao = asyncio.create_task(self._gravar_depois())
+    
+    async def descarregar(self):
+        """Grava agora as alteracoes que ainda esperavam o intervalo (usado ao desligar)."""
+        if self._gravacao is not None:
+            self._gravacao.cancel()
+            self._gravacao = None
+        await self._gravar_alteracoes()
+    
+    async def _gravar_depois(self):
+        await asyncio.sleep(INTERVALO_GRAVACAO)
+        # Alteracoes feitas durante a escrita agendam a proxima gravacao
+        self._gravacao = None
+        await self._gravar_alteracoes()
+    
+    async def _gravar_alteracoes(self):
+        # Uma gravacao por vez, na ordem: a mais nova nunca eh sobrescrita
+        async with self._trava_gravacao:
+            if not self._alterado:
+                return
+            self._alterado = False
+            # Serializa no loop (os handlers nao mexem nos dados no meio)
+            # e deixa so a escrita no disco para a thread
+            conteudo = self._serializar()
+            await asyncio.to_thread(self._escrever, conteudo)
+    
+    def _serializar(self, dados: dict = None) -> str:
         if dados is None:
-            dados = self.dados
-        with open(self.arquivo, 'w', encoding='utf-8') as f:
-            json.dump(dados, f, ensure_ascii=False, indent=2)
+            dados = {**self.dados, "policiais": self.policiais.exportar()}
+        # Sem indentacao o json usa o codificador em C (varias vezes mais rapido)
+        return json.dumps(dados, ensure_ascii=False)
+    
+    def _escrever(self, conteudo: str):
+        """
+        Grava em um arquivo temporario e troca no fim: quem ler o banco
+        (ou um desligamento no meio) nunca ve o arquivo pela metade.
+        """
+        with self._trava_arquivo:
+            temporario = f"{self.arquivo}.tmp"
+            with open(temporario, 'w', encoding='utf-8') as f:
+                f.write(conteudo)
+            os.replace(temporario, self.arquivo)
     
     def cadastrar_policial(self, nome_completo: str, chat_id: int) -> bool:
         """
@@ -96,52 +264,48 @@ class BancoDeDados:
             chat_id: ID do chat do Telegram do policial
             
         Returns:
-            True se cadastrou, False se ja existia
+            True se cadastrou, False se o nome ja existia ou o chat ja tem cadastro
         """
-        nome_normalizado = nome_completo.upper().strip()
-        
-        if nome_normalizado in self.dados["policiais"]:
+        if self.policiais.adicionar(nome_completo, chat_id) is None:
             return False
+        self.salvar()
+        return True
+    
+    def buscar_policial_por_chat(self, chat_id: int) -> Optional[Policial]:
+        """
+        Busca o cadastro de um chat do Telegram.
         
-        self.dados["policiais"][nome_normalizado] = {
-            "chat_id": chat_id,
-            "data_cadastro": datetime.now().isoformat(),
-            "nome_completo": nome_completo
-        }
+        Returns:
+            Policial cadastrado ou None se o chat nao tem cadastro
+        """
+        return self.policiais.buscar_por_chat(chat_id)
+    
+    def remover_policial_por_chat(self, chat_id: int) -> bool:
+        """
+        Remove o cadastro de um chat.
+        
+        Returns:
+            True se havia cadastro
+        """
+        policial = self.policiais.buscar_por_chat(chat_id)
+        if policial is None:
+            return False
+        self.policiais.remover(policial)
         self.salvar()
         return True
     
-    def buscar_policial_por_nome(self, nome_escala: str) -> Optional[dict]:
+    def buscar_policial_por_nome(self, nome_escala: str) -> Optional[Policial]:
         """
         Busca um policial pelo nome como aparece na escala.
+        Se o posto nao bater, aceita o cadastro com o mesmo nome.
         
         Args:
             nome_escala: Nome extraido do PDF (ex: "SD JOAO VICTOR")
             
         Returns:
-            Dicionario com dados do policial ou None se nao encontrado
+            Policial cadastrado ou None se nao encontrado
         """
-        nome_normalizado = nome_escala.upper().strip()
-        
-        # Busca exata primeiro
-        if nome_normalizado in self.dados["policiais"]:
-            return self.dados["policiais"][nome_normalizado]
-        
-        # Se nao achou, tenta busca parcial (por exemplo, so pelo nome)
-        for nome_cadastrado, dados in self.dados["policiais"].items():
-            # Remove o posto e compara so o nome
-            partes_escala = nome_normalizado.split()
-            partes_cadastrado = nome_cadastrado.split()
-            
-            # Se o nome (sem posto) estiver contido
-            if len(partes_escala) > 1 and len(partes_cadastrado) > 1:
-                nome_sem_posto_escala = ' '.join(partes_escala[1:])
-                nome_sem_posto_cadastrado = ' '.join(partes_cadastrado[1:])
-                
-                if nome_sem_posto_escala == nome_sem_posto_cadastrado:
-                    return dados
-        
-        return None
+        return self.policiais.buscar(nome_escala)
     
     def ja_processou_escala(self, mensagem_id: int) -> bool:
         """Verifica se uma escala ja foi processada."""
@@ -153,26 +317,345 @@ class BancoDeDados:
             self.dados["escalas_processadas"].append(mensagem_id)
             # Mantem so as ultimas 100 escalas (para nao ficar muito grande)
             if len(self.dados["escalas_processadas"]) > 100:
+                for antiga in self.dados["escalas_processadas"][:-100]:
+                    self.dados["pendentes"].pop(str(antiga), None)
+                    self.dados["lembretes"].pop(str(antiga), None)
+                    self.dados["totais"].pop(str(antiga), None)
                 self.dados["escalas_processadas"] = self.dados["escalas_processadas"][-100:]
             self.salvar()
     
-    def registrar_confirmacao(self, mensagem_id: str, chat_id: int, confirmou: bool):
-        """Registra se o policial confirmou ciencia da escala."""
-        if mensagem_id not in self.dados["confirmacoes"]:
-            self.dados["confirmacoes"][mensagem_id] = {}
+    def _rosters_da_data(self, canal_id: int, data_escala: str) -> List[str]:
+        """Chaves dos rosters guardados do canal para a data ("canal|data" ou "canal|data|escala")."""
+        prefixo = f"{canal_id}|{data_escala}"
+        return [chave for chave in self.dados["rosters"] if chave == prefixo or chave.startswith(prefixo + "|")]
+    
+    def buscar_roster(self, canal_id: int, data_escala: str, turnos: Dict[str, List[dict]]) -> Optional[dict]:
+        """
+        Busca, entre os rosters publicados no canal para a data, o que a
+        nova escala retifica. Quem decide eh a data com os cabecalhos
+        (equipe, turno, setor...): uma escala da mesma data com algum
+        cabecalho em comum (ou as duas sem cabecalho) eh retificacao,
+        mesmo que a equipe inteira tenha sido trocada. Escalas da mesma
+        data com outros cabecalhos (ex: uma por equipe) sao separadas.
+        Os nomes em comum so escolhem qual roster ela retifica.
+        
+        Args:
+            canal_id: Canal da escala
+            data_escala: Data da escala (DD/MM/AAAA)
+            turnos: Turnos da nova escala (nome_completo -> turnos, de montar_turnos)
+        
+        Returns:
+            Dicionario com 'mensagem_id' e 'policiais'
+            (nome_completo -> [[data, equipe, local], ...])
+            ou None se for uma escala nova
+        """
+        cabecalhos = {turno['equipe'] for lista in turnos.values() for turno in lista if turno['equipe']}
+        # Pelo nome sem posto: quem foi promovido tambem conta
+        nomes = {separar_posto(nome_completo)[1] for nome_completo in turnos}
+        melhor, em_comum = None, -1
+        for chave in self._rosters_da_data(canal_id, data_escala):
+            roster = self.dados["rosters"][chave]
+            cabecalhos_roster = {
+                equipe for lista in roster["policiais"].values() for _, equipe, _ in lista if equipe
+            }
+            if (cabecalhos or cabecalhos_roster) and not cabecalhos & cabecalhos_roster:
+                continue
+            quantidade = len(nomes & {separar_posto(nome_completo)[1] for nome_completo in roster["policiais"]})
+            # Empate: o roster usado por ultimo (os rosters ficam em ordem de uso)
+            if quantidade >= em_comum:
+                melhor, em_comum = roster, quantidade
+        return melhor
+    
+    def salvar_roster(self, canal_id: int, data_escala: str, mensagem_id: int, turnos: Dict[str, List[dict]],
+                      substitui: Optional[int] = None):
+        """
+        Guarda o roster da escala (todos os turnos de cada policial)
+        para comparar com futuras retificacoes.
+        
+        Args:
+            turnos: nome_completo -> turnos (de montar_turnos)
+            substitui: mensagem_id do roster que esta escala retifica (None = escala nova)
+        """
+        rosters = self.dados["rosters"]
+        chaves = self._rosters_da_data(canal_id, data_escala)
+        chave = next((c for c in chaves if rosters[c]["mensagem_id"] == substitui), None)
+        if chave is None:
+            # Outra escala da mesma data (ex: de outra equipe) fica ao lado
+            chave = f"{canal_id}|{data_escala}" if not chaves else f"{canal_id}|{data_escala}|{mensagem_id}"
+        
+        # Reinsere no fim para manter a ordem de uso
+        rosters.pop(chave, None)
+        rosters[chave] = {
+            "mensagem_id": mensagem_id,
+            "policiais": {nome_completo: resumir_turnos(lista) for nome_completo, lista in turnos.items()}
+        }
+        
+        # Mantem so os ultimos 100 rosters (para nao ficar muito grande)
+        while len(rosters) > 100:
+            del rosters[next(iter(rosters))]
+        self.salvar()
+    
+    def registrar_escala_no_historico(self, canal_id: int, mensagem_id: int, arquivo: str,
+                                      data_escala: str, policiais: List[dict], substitui: Optional[int]):
+        """
+        Acrescenta a escala e o roster completo ao historico.
+        
+        Args:
+            substitui: mensagem_id da escala que esta retifica (None = escala nova)
+        """
+        self.historico.acrescentar("escalas", [{
+            "dia": dia_iso(data_escala), "mensagem_id": mensagem_id, "canal": canal_id, "data_escala": data_escala,
+            "arquivo": arquivo, "total": len(policiais), "retificacao": substitui is not None,
+            "registrado_em": datetime.now().isoformat(), "substitui": substitui
+        }])
+        self.historico.acrescentar("rosters", [
+            {"dia": dia_iso(p.get('data') or data_escala), "mensagem_id": mensagem_id,
+             "data_escala": p.get('data') or data_escala,
+             "nome_completo": p['nome_completo'], "equipe": p.get('equipe'), "local": p.get('local')}
+            for p in policiais
+        ])
+    
+    def registrar_turnos(self, mensagem_id: int, turnos: Dict[str, List[dict]],
+                         substituir: Optional[Tuple[int, List[str]]] = None):
+        """
+        Atualiza o indice de turnos por policial com uma nova escala.
         
-        self.dados["confirmacoes"][mensagem_id][str(chat_id)] = {
+        Args:
+            mensagem_id: ID da escala
+            turnos: nome_completo -> turnos ({'dia', 'data', 'equipe', 'local'})
+            substituir: (mensagem_id, nomes) de uma escala retificada, cujos
+                        turnos devem sair do indice
+        """
+        indice = self.dados["turnos"]
+        hoje = datetime.now().date().isoformat()
+        
+        if substituir:
+            escala_antiga, nomes = substituir
+            for nome in nomes:
+                if nome in indice:
+                    indice[nome] = [t for t in indice[nome] if t["escala"] != escala_antiga]
+        
+        for nome, novos in turnos.items():
+            lista = [t for t in indice.get(nome, []) if t["dia"] >= hoje]
+            for turno in novos:
+                lista.append(dict(turno, escala=mensagem_id))
+            # Mantem ordenado pela data (o proximo turno fica na frente)
+            lista.sort(key=lambda t: t["dia"])
+            indice[nome] = lista
+        
+        # Remove quem ficou sem turno
+        for nome in [nome for nome, lista in indice.items() if not lista]:
+            del indice[nome]
+        self.salvar()
+    
+    def proximos_turnos(self, policial: Policial) -> List[dict]:
+        """
+        Retorna os turnos de hoje em diante do policial.
+        Como na notificacao, o nome da escala com outro posto tambem
+        conta quando a busca so pelo nome cai neste cadastro (ex:
+        promovido que ainda nao refez o /configurar).
+        """
+        hoje = datetime.now().date().isoformat()
+        sufixo = " " + policial.nome
+        turnos = [
+            turno
+            for nome_completo, lista in self.dados["turnos"].items()
+            if (nome_completo == policial.nome or nome_completo.endswith(sufixo))
+            and self.policiais.buscar(nome_completo) is policial
+            for turno in lista if turno["dia"] >= hoje
+        ]
+        return sorted(turnos, key=lambda t: t["dia"])
+    
+    def registrar_confirmacao(self, mensagem_id: str, chat_id: int, confirmou: bool,
+                              nome_completo: str = "") -> bool:
+        """
+        Registra se o policial confirmou ciencia da escala.
+        A confirmacao tambem vai para o historico.
+        
+        Returns:
+            False se a confirmacao ja estava registrada (clique repetido)
+        """
+        mensagem_id = str(mensagem_id)
+        registros = self.dados["confirmacoes"].setdefault(mensagem_id, {})
+        anterior = registros.get(str(chat_id))
+        if confirmou and anterior and anterior["confirmou"]:
+            return False
+        
+        agora = datetime.now().isoformat()
+        registros[str(chat_id)] = {
             "confirmou": confirmou,
-            "data": datetime.now().isoformat()
+            "data": agora
         }
+        
+        # Quem confirmou sai da lista de pendentes (nao recebe mais lembretes)
+        if confirmou:
+            self.dados["pendentes"].get(mensagem_id, {}).pop(str(chat_id), None)
+            totais = self.dados["totais"].setdefault(mensagem_id, {"notificados": 0, "confirmados": 0})
+            totais["confirmados"] += 1
+        self.salvar()
+        
+        if confirmou:
+            self.historico.acrescentar("confirmacoes", [{
+                "dia": agora[:10], "mensagem_id": mensagem_id, "chat_id": chat_id,
+                "nome_completo": nome_completo, "confirmado_em": agora
+            }])
+        return True
+    
+    def emitir_token(self, mensagem_id: int, chat_id: int, nome_completo: str) -> str:
+        """
+        Cria o token curto do botao de confirmacao (cabe nos 64 bytes
+        do callback_data). Eh gravado junto com a proxima alteracao
+        do banco, para nao reescrever o arquivo a cada policial.
+        
+        Returns:
+            Token opaco que identifica (escala, destinatario)
+        """
+        tokens = self.dados["tokens"]
+        token = secrets.token_urlsafe(6)
+        while token in tokens:
+            token = secrets.token_urlsafe(6)
+        tokens[token] = [mensagem_id, chat_id, nome_completo, int(time.time() + VALIDADE_BOTOES_DIAS * 86400)]
+        return token
+    
+    def buscar_token(self, token: str) -> Optional[Tuple[int, int, str]]:
+        """
+        Busca o destino de um token de botao.
+        
+        Returns:
+            Tupla (mensagem_id, chat_id, nome) ou None se nao existe ou expirou
+        """
+        registro = self.dados["tokens"].get(token)
+        if registro is None or registro[3] < time.time():
+            return None
+        return registro[0], registro[1], registro[2]
+    
+    def ja_confirmou(self, mensagem_id: int, chat_id: int) -> bool:
+        """Indica se o policial ja confirmou ciencia da escala."""
+        registro = self.dados["confirmacoes"].get(str(mensagem_id), {}).get(str(chat_id))
+        return bool(registro and registro["confirmou"])
+    
+    def limpar_tokens_expirados(self):
+        """Remove os tokens vencidos (chamado a cada nova escala)."""
+        agora = time.time()
+        tokens = self.dados["tokens"]
+        for token in [t for t, registro in tokens.items() if registro[3] < agora]:
+            del tokens[token]
+    
+    def adicionar_pendentes(self, mensagem_id: int, pendentes: Dict[int, str]):
+        """
+        Marca os policiais notificados como pendentes de confirmacao.
+        
+        Args:
+            mensagem_id: ID da escala
+            pendentes: chat_id -> nome como aparece na escala
+        """
+        conjunto = self.dados["pendentes"].setdefault(str(mensagem_id), {})
+        totais = self.dados["totais"].setdefault(str(mensagem_id), {"notificados": 0, "confirmados": 0})
+        for chat_id, nome_completo in pendentes.items():
+            if str(chat_id) not in conjunto:
+                totais["notificados"] += 1
+            conjunto[str(chat_id)] = nome_completo
         self.salvar()
+    
+    def registrar_falha_envio(self, mensagem_id: int, chat_id: int):
+        """
+        A notificacao nao chegou ao policial (bot bloqueado, chat invalido):
+        ele sai dos pendentes (sem lembretes) e do total de notificados.
+        """
+        conjunto = self.dados["pendentes"].get(str(mensagem_id), {})
+        if conjunto.pop(str(chat_id), None) is None:
+            return
+        totais = self.dados["totais"].get(str(mensagem_id))
+        if totais:
+            totais["notificados"] -= 1
+            totais["falhas"] = totais.get("falhas", 0) + 1
+        self.salvar()
+    
+    def remover_pendentes(self, mensagem_id: int, chat_ids: List[int]):
+        """Tira policiais da lista de pendentes (ex: sairam na retificacao)."""
+        conjunto = self.dados["pendentes"].get(str(mensagem_id))
+        if not conjunto:
+            return
+        for chat_id in chat_ids:
+            conjunto.pop(str(chat_id), None)
+        self.salvar()
+    
+    def listar_pendentes(self, mensagem_id: int) -> Dict[int, str]:
+        """Retorna chat_id -> nome de quem ainda nao confirmou a escala."""
+        conjunto = self.dados["pendentes"].get(str(mensagem_id), {})
+        return {int(chat_id): nome for chat_id, nome in conjunto.items()}
+    
+    def salvar_lembrete(self, mensagem_id: int, agenda: dict):
+        """Grava a agenda de lembretes da escala (sobrevive a reinicios)."""
+        self.dados["lembretes"][str(mensagem_id)] = agenda
+        self.salvar()
+    
+    def remover_lembrete(self, mensagem_id: int):
+        """Encerra os lembretes da escala."""
+        if self.dados["lembretes"].pop(str(mensagem_id), None) is not None:
+            self.salvar()
 
 
-# Instancia global do banco de dados
-db = BancoDeDados()
+# Banco de dados e parser de PDF: criados no main(), nunca na importacao.
+# Os workers de OCR nascem por "spawn" e reimportam este arquivo: eles
+# nao podem carregar o banco nem mexer no historico.
+db: Optional[BancoDeDados] = None
+pdf_parser: Optional[PDFParser] = None
+
+# Fila que agrupa as notificacoes por policial
+fila_notificacoes = FilaNotificacoes(janela=JANELA_AGRUPAMENTO)
+
+# Limite de comandos por chat/global e cache das respostas do /status
+limitador_comandos = LimitadorComandos(
+    por_minuto_chat=COMANDOS_POR_MINUTO_CHAT,
+    rajada_chat=RAJADA_COMANDOS_CHAT,
+    por_segundo_global=COMANDOS_POR_SEGUNDO_GLOBAL
+)
+cache_status = CacheRespostas(validade=60)
 
-# Instancia do parser de PDF
-pdf_parser = PDFParser()
+# ============== LIMITE DE COMANDOS ==============
+
+async def limitar_comandos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Roda antes de todos os comandos (grupo -1).
+    Descarta o comando se o chat, ou o bot como um todo, passou do limite.
+    """
+    chat_id = update.effective_chat.id
+    motivo = limitador_comandos.permitir(chat_id)
+    if motivo is None:
+        return
+    
+    # Avisa o chat uma vez; com o bot sobrecarregado nao responde nada
+    if motivo == "chat" and limitador_comandos.primeiro_descarte(chat_id):
+        await update.effective_message.reply_text(
+            "⏳ Muitos comandos seguidos. Aguarde alguns segundos e tente de novo."
+        )
+    raise ApplicationHandlerStop
+
+
+async def relatar_descartes(context: ContextTypes.DEFAULT_TYPE):
+    """Registra no log quanto trafego de comandos foi descartado."""
+    contadores = limitador_comandos.contadores
+    anteriores = context.job.data
+    if any(contadores[chave] != anteriores.get(chave) for chave in ("descartados_chat", "descartados_global")):
+        logger.warning(
+            f"Comandos: {contadores['aceitos']} aceitos, "
+            f"{contadores['descartados_chat']} descartados por chat, "
+            f"{contadores['descartados_global']} descartados no limite global, "
+            f"{cache_status.acertos} /status respondidos do cache"
+        )
+    context.job.data = dict(contadores)
+
+
+async def manter_historico(context: ContextTypes.DEFAULT_TYPE):
+    """Compacta as particoes antigas do historico e apaga as vencidas."""
+    resultado = await asyncio.to_thread(db.historico.manter, RETENCAO_HISTORICO_MESES)
+    if resultado["compactadas"] or resultado["apagadas"]:
+        logger.info(
+            f"Historico: {resultado['compactadas']} particao(oes) compactada(s) "
+            f"({resultado['linhas_removidas']} linha(s) de escalas substituidas removida(s)), "
+            f"{resultado['apagadas']} apagada(s)"
+        )
 
 # ============== COMANDOS DO BOT ==============
 
@@ -191,6 +674,8 @@ Este bot foi criado para enviar notificacoes automaticas sobre sua escala de ser
 /configurar - Cadastrar seu nome para receber avisos
 /ajuda - Ver instrucoes de uso
 /status - Verificar se voce esta cadastrado
+/minhaescala - Ver seus proximos turnos
+/historico - Ver seus ultimos turnos e confirmacoes
 
 ⚠️ *IMPORTANTE:* Para funcionar, voce precisa se cadastrar usando o comando /configurar
 """
@@ -224,6 +709,8 @@ Ao receber a notificacao, clique no botao *"✅ CONFIRMAR CIENCIA"* para registr
 
 *Comandos uteis:*
 /status - Verifica seu cadastro
+/minhaescala - Mostra seus proximos turnos
+/historico - Mostra seus ultimos turnos e confirmacoes
 /recomecar - Remove seu cadastro atual
 """
     
@@ -253,25 +740,38 @@ async def comando_configurar(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Junta todos os argumentos (para nomes compostos)
     nome_completo = ' '.join(args)
     
-    # Tenta cadastrar
-    sucesso = db.cadastrar_policial(nome_completo, chat_id)
-    
-    if sucesso:
-        await update.message.reply_text(
-            f"✅ *Cadastro realizado com sucesso!*\n\n"
-            f"Nome: `{nome_completo}`\n"
-            f"Chat ID: `{chat_id}`\n\n"
-            f"Voce recebera notificacoes sempre que sua escala for publicada.\n\n"
-            f"Teste: Envie /status para confirmar.",
-            parse_mode='Markdown'
-        )
-        logger.info(f"Novo cadastro: {nome_completo} (Chat: {chat_id})")
-    else:
-        await update.message.reply_text(
-            f"⚠️ *Aviso:* Este nome ja esta cadastrado!\n\n"
-            f"Se precisar atualizar, use /recomecar primeiro.",
-            parse_mode='Markdown'
-        )
+    # Dois chats disputando o mesmo nome recebem respostas coerentes
+    async with db.trava("nome", separar_posto(nome_completo)[1]), db.trava("chat", chat_id):
+        # Um cadastro por chat: para trocar o nome, antes o /recomecar
+        atual = db.buscar_policial_por_chat(chat_id)
+        if atual is not None:
+            await update.message.reply_text(
+                f"⚠️ *Aviso:* Este chat ja esta cadastrado como `{atual.nome_completo}`.\n\n"
+                f"Para usar outro nome, envie /recomecar primeiro.",
+                parse_mode='Markdown'
+            )
+            return
+        
+        # Tenta cadastrar
+        sucesso = db.cadastrar_policial(nome_completo, chat_id)
+        cache_status.invalidar(chat_id)
+        
+        if sucesso:
+            await update.message.reply_text(
+                f"✅ *Cadastro realizado com sucesso!*\n\n"
+                f"Nome: `{nome_completo}`\n"
+                f"Chat ID: `{chat_id}`\n\n"
+                f"Voce recebera notificacoes sempre que sua escala for publicada.\n\n"
+                f"Teste: Envie /status para confirmar.",
+                parse_mode='Markdown'
+            )
+            logger.info(f"Novo cadastro: {nome_completo} (Chat: {chat_id})")
+        else:
+            await update.message.reply_text(
+                f"⚠️ *Aviso:* Este nome ja esta cadastrado!\n\n"
+                f"Se precisar atualizar, use /recomecar primeiro.",
+                parse_mode='Markdown'
+            )
 
 
 async def comando_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -280,67 +780,316 @@ async def comando_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     chat_id = update.effective_chat.id
     
-    # Busca o policial pelo chat_id
-    encontrado = None
-    for nome, dados in db.dados["policiais"].items():
-        if dados["chat_id"] == chat_id:
-            encontrado = (nome, dados)
-            break
+    # /status repetido: responde com o texto montado ha pouco
+    texto = cache_status.obter(chat_id)
+    if texto is None:
+        # Busca o policial pelo chat_id
+        policial = db.buscar_policial_por_chat(chat_id)
+        
+        if policial:
+            texto = (
+                f"✅ *Voce esta cadastrado!*\n\n"
+                f"Nome na escala: `{policial.nome_completo}`\n"
+                f"Cadastrado em: {policial.data_cadastro.strftime('%Y-%m-%d')}\n\n"
+                f"Voce recebera notificacoes de escala."
+            )
+        else:
+            texto = (
+                "❌ *Voce ainda nao esta cadastrado!*\n\n"
+                "Use /configurar para se cadastrar."
+            )
+        cache_status.guardar(chat_id, texto)
+    
+    await update.message.reply_text(texto, parse_mode='Markdown')
+
+
+async def comando_recomecar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Comando /recomecar - Remove o cadastro do usuario.
+    """
+    chat_id = update.effective_chat.id
+    
+    async with db.trava("chat", chat_id):
+        # Busca e remove o policial
+        removido = db.remover_policial_por_chat(chat_id)
+        cache_status.invalidar(chat_id)
+        
+        if removido:
+            await update.message.reply_text(
+                "✅ Seu cadastro foi removido.\n\n"
+                "Use /configurar para se cadastrar novamente.",
+                parse_mode='Markdown'
+            )
+        else:
+            await update.message.reply_text(
+                "Você não estava cadastrado.\n\n"
+                "Use /configurar para se cadastrar.",
+                parse_mode='Markdown'
+            )
+
+
+async def comando_minhaescala(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Comando /minhaescala - Mostra os proximos turnos do policial.
+    """
+    chat_id = update.effective_chat.id
     
-    if encontrado:
-        nome, dados = encontrado
+    policial = db.buscar_policial_por_chat(chat_id)
+    if not policial:
         await update.message.reply_text(
-            f"✅ *Voce esta cadastrado!*\n\n"
-            f"Nome na escala: `{nome}`\n"
-            f"Cadastrado em: {dados['data_cadastro'][:10]}\n\n"
-            f"Voce recebera notificacoes de escala.",
+            "❌ *Voce ainda nao esta cadastrado!*\n\n"
+            "Use /configurar para se cadastrar.",
             parse_mode='Markdown'
         )
-    else:
+        return
+    
+    turnos = db.proximos_turnos(policial)
+    
+    if not turnos:
         await update.message.reply_text(
-            "❌ *Voce ainda nao esta cadastrado!*\n\n"
-            "Use /configurar para se cadastrar.",
+            f"📭 Nenhum turno futuro encontrado para `{policial.nome_completo}`.",
             parse_mode='Markdown'
         )
+        return
+    
+    texto = "🗓️ *Seus proximos turnos*\n\n"
+    for turno in turnos[:10]:
+        texto += _descrever_turno(turno) + "\n"
+    
+    await update.message.reply_text(texto, parse_mode='Markdown')
 
 
-async def comando_recomecar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def comando_historico(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Comando /recomecar - Remove o cadastro do usuario.
+    Comando /historico - Mostra os ultimos turnos do policial e quando
+    ele confirmou ciencia de cada escala.
+    Uso: /historico ou /historico 20
     """
     chat_id = update.effective_chat.id
     
-    # Busca e remove o policial
-    removido = False
-    for nome in list(db.dados["policiais"].keys()):
-        if db.dados["policiais"][nome]["chat_id"] == chat_id:
-            del db.dados["policiais"][nome]
-            db.salvar()
-            removido = True
-            break
-    
-    if removido:
+    policial = db.buscar_policial_por_chat(chat_id)
+    if not policial:
         await update.message.reply_text(
-            "✅ Seu cadastro foi removido.\n\n"
-            "Use /configurar para se cadastrar novamente.",
+            "❌ *Voce ainda nao esta cadastrado!*\n\n"
+            "Use /configurar para se cadastrar.",
             parse_mode='Markdown'
         )
-    else:
+        return
+    
+    quantidade = int(context.args[0]) if context.args and context.args[0].isdigit() else 10
+    quantidade = max(1, min(quantidade, 30))
+    
+    # Le so as linhas do policial (pelo indice), fora do loop de eventos
+    # Inclui o nome com outro posto que a notificacao entrega a este cadastro
+    turnos = await asyncio.to_thread(
+        db.historico.turnos_do_policial, policial.nome_completo, chat_id, quantidade,
+        lambda nome_completo: db.policiais.buscar(nome_completo) is policial
+    )
+    
+    if not turnos:
         await update.message.reply_text(
-            "Você não estava cadastrado.\n\n"
-            "Use /configurar para se cadastrar.",
+            f"📭 Nenhum turno encontrado no historico de `{policial.nome_completo}`.",
             parse_mode='Markdown'
         )
+        return
+    
+    texto = f"📚 *Seus ultimos {len(turnos)} turnos*\n\n"
+    for turno in turnos:
+        texto += _descrever_turno({
+            'data': turno['data_escala'], 'equipe': turno.get('equipe'), 'local': turno.get('local')
+        }) + "\n"
+        if turno['confirmado_em']:
+            confirmado = datetime.fromisoformat(turno['confirmado_em'])
+            texto += f"    ✅ Ciente em {confirmado.strftime('%d/%m/%Y %H:%M')}\n"
+        else:
+            texto += "    ⏳ Sem confirmacao\n"
+    
+    await update.message.reply_text(texto, parse_mode='Markdown')
+
+
+async def comando_contagem(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Comando /contagem - Turnos de cada policial em um periodo (so administradores).
+    Uso: /contagem 01/01/2024 31/01/2024 (sem datas: mes atual)
+    """
+    chat_id = update.effective_chat.id
+    
+    if chat_id not in ADMINS:
+        await update.message.reply_text("⛔ Comando disponivel apenas para administradores.")
+        return
+    
+    if not context.args:
+        # Sem datas: o mes atual inteiro
+        hoje = datetime.now()
+        desde, ate, periodo = hoje.strftime('%Y-%m-01'), hoje.strftime('%Y-%m-31'), hoje.strftime('%m/%Y')
+    else:
+        try:
+            inicio, fim = (datetime.strptime(data, '%d/%m/%Y') for data in context.args)
+        except ValueError:
+            inicio = fim = None
+        if inicio is None or inicio > fim:
+            await update.message.reply_text(
+                "❌ *Uso correto:*\n"
+                "`/contagem 01/01/2024 31/01/2024`",
+                parse_mode='Markdown'
+            )
+            return
+        desde, ate = inicio.strftime('%Y-%m-%d'), fim.strftime('%Y-%m-%d')
+        periodo = f"{context.args[0]} a {context.args[1]}"
+    
+    # Conta so pelo indice (sem ler as linhas), fora do loop de eventos
+    contagem = await asyncio.to_thread(db.historico.contar_turnos, desde, ate)
+    
+    if not contagem:
+        await update.message.reply_text(f"📭 Nenhum turno no historico em {periodo}.")
+        return
+    
+    linhas = []
+    # Chave por posto e nome: quem foi promovido no periodo aparece nas duas linhas
+    for nome_completo, turnos in sorted(contagem.items(), key=lambda item: (-item[1], item[0])):
+        linhas.append(f"{turnos:>3}  {nome_completo}")
+    
+    texto = f"📊 Turnos em {periodo} ({len(linhas)} policiais, {sum(contagem.values())} turnos)\n\n"
+    # Cabe em uma mensagem do Telegram (4096 caracteres)
+    mostradas = 0
+    while mostradas < len(linhas) and len(texto) + len(linhas[mostradas]) < 3900:
+        texto += linhas[mostradas] + "\n"
+        mostradas += 1
+    if mostradas < len(linhas):
+        texto += f"... e mais {len(linhas) - mostradas} policiais (exporte os rosters pelo web_server)"
+    
+    await update.message.reply_text(texto)
 
 
 # ============== PROCESSAMENTO DE ESCALAS ==============
 
+def escapar_markdown(texto: str) -> str:
+    """
+    Escapa _ * ` e [ para o Markdown das mensagens: um "_" solto
+    (ex: "foto_123.jpg") faria o Telegram recusar a mensagem inteira.
+    """
+    return re.sub(r'([_*`\[])', r'\\\1', texto)
+
+
+def _descrever_policial(nome_completo: str, turnos: List[list]) -> str:
+    """Nome do policial com data, equipe e local de cada turno, para o resumo do canal."""
+    partes = [" - ".join(escapar_markdown(campo) for campo in turno if campo) for turno in turnos]
+    partes = [parte for parte in partes if parte]
+    return f"{nome_completo} ({'; '.join(partes)})" if partes else nome_completo
+
+
+def comparar_rosters(anterior: dict, policiais: List[dict], turnos: Dict[str, List[dict]]) -> dict:
+    """
+    Compara o roster de uma retificacao com o roster publicado antes.
+    Qualquer mudanca nos turnos do policial (data, equipe ou local de
+    qualquer um deles, um turno a mais ou a menos) conta como alteracao;
+    mudanca de posto (promocao) tambem, quando o nome sem posto eh unico
+    nos dois rosters.
+    
+    Args:
+        anterior: Roster salvo (nome_completo -> [[data, equipe, local], ...])
+        policiais: Policiais encontrados na nova escala
+        turnos: Turnos da nova escala (nome_completo -> turnos, de montar_turnos)
+        
+    Returns:
+        Dicionario com 'adicionados', 'removidos' e 'alterados'
+        (alterados sao pares (descricao_antiga, policial_novo))
+    """
+    atuais = {p['nome_completo']: p for p in policiais}
+    
+    adicionados = [p for nome_completo, p in atuais.items() if nome_completo not in anterior]
+    removidos = [nome_completo for nome_completo in anterior if nome_completo not in atuais]
+    alterados = []
+    for nome_completo, p in atuais.items():
+        if nome_completo not in anterior:
+            continue
+        antes = {tuple(turno) for turno in anterior[nome_completo]}
+        depois = {tuple(turno) for turno in resumir_turnos(turnos.get(nome_completo, []))}
+        if antes != depois:
+            alterados.append((_descrever_policial(nome_completo, anterior[nome_completo]), p))
+    
+    # Segunda passada: quem saiu e entrou com o mesmo nome e outro posto
+    # foi promovido, se o nome nao se repete em nenhum dos dois rosters
+    nomes_anteriores = Counter(separar_posto(nome_completo)[1] for nome_completo in anterior)
+    nomes_atuais = Counter(separar_posto(nome_completo)[1] for nome_completo in atuais)
+    removidos_por_nome = {separar_posto(nome_completo)[1]: nome_completo for nome_completo in removidos}
+    for p in list(adicionados):
+        nome = separar_posto(p['nome_completo'])[1]
+        if nome in removidos_por_nome and nomes_anteriores[nome] == 1 and nomes_atuais[nome] == 1:
+            antigo = removidos_por_nome[nome]
+            adicionados.remove(p)
+            removidos.remove(antigo)
+            alterados.append((_descrever_policial(antigo, anterior[antigo]), p))
+    
+    return {
+        "adicionados": adicionados,
+        "removidos": removidos,
+        "alterados": alterados
+    }
+
+
+def montar_turnos(equipes: List[dict], data_padrao: str) -> Dict[str, List[dict]]:
+    """
+    Monta os turnos de cada policial a partir dos blocos da escala.
+    
+    Args:
+        equipes: Blocos {'data', 'equipe', 'local', 'policiais'} do parser
+        data_padrao: Data usada nos blocos sem data
+        
+    Returns:
+        nome_completo -> lista de turnos ({'dia', 'data', 'equipe', 'local'})
+    """
+    turnos = {}
+    for bloco in equipes:
+        data = bloco['data'] or data_padrao
+        turno = {
+            "dia": dia_iso(data),
+            "data": data,
+            "equipe": bloco['equipe'],
+            "local": bloco['local']
+        }
+        for nome_completo in bloco['policiais']:
+            # Mesma forma do nome_completo do cadastro (posto e espacos normalizados)
+            posto, nome = separar_posto(nome_completo)
+            turnos.setdefault(f"{posto} {nome}" if posto else nome, []).append(turno)
+    return turnos
+
+
+def resumir_turnos(turnos: List[dict]) -> List[list]:
+    """Turnos como [data, equipe, local] (a forma guardada no roster)."""
+    return [[turno['data'], turno['equipe'], turno['local']] for turno in turnos]
+
+
+def _descrever_turno(turno: dict) -> str:
+    """Uma linha com data, equipe e local do turno."""
+    texto = f"📅 {escapar_markdown(turno['data'])}"
+    if turno.get('equipe'):
+        texto += f" - 👥 {escapar_markdown(turno['equipe'])}"
+    if turno.get('local'):
+        texto += f" - 📍 {escapar_markdown(turno['local'])}"
+    return texto
+
+
+def _listar_nomes(titulo: str, nomes: List[str]) -> str:
+    """Monta um trecho do resumo com no maximo 10 nomes."""
+    texto = f"\n*{titulo}:*\n"
+    for nome in nomes[:10]:  # Mostra so os 10 primeiros
+        texto += f"• {nome}\n"
+    if len(nomes) > 10:
+        texto += f"... e mais {len(nomes) - 10}\n"
+    return texto
+
+
 async def processar_pdf_escala(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Processa PDFs enviados ao canal de escalas.
     Extrai os nomes e envia notificacoes.
+    
+    Se ja existe uma escala do canal para a mesma data, o PDF eh tratado
+    como retificacao: so quem entrou, saiu ou mudou eh notificado.
     """
-    mensagem = update.message
+    # Em canais a mensagem chega como channel_post (update.message fica vazio)
+    mensagem = update.effective_message
     chat_id = mensagem.chat_id
     mensagem_id = mensagem.message_id
     
@@ -349,11 +1098,6 @@ async def processar_pdf_escala(update: Update, context: ContextTypes.DEFAULT_TYP
         logger.info(f"Mensagem de outro canal ignorada: {chat_id}")
         return
     
-    # Verifica se ja processou esta escala
-    if db.ja_processou_escala(mensagem_id):
-        logger.info(f"Escala {mensagem_id} ja foi processada. Ignorando.")
-        return
-    
     # Verifica se tem documento
     if not mensagem.document:
         return
@@ -362,82 +1106,281 @@ async def processar_pdf_escala(update: Update, context: ContextTypes.DEFAULT_TYP
     if not mensagem.document.file_name.lower().endswith('.pdf'):
         return
     
-    logger.info(f"Novo PDF detectado: {mensagem.document.file_name}")
+    # Com updates concorrentes, a mesma mensagem so eh processada uma vez
+    async with db.trava("escala", mensagem_id):
+        # Verifica se ja processou esta escala
+        if db.ja_processou_escala(mensagem_id):
+            logger.info(f"Escala {mensagem_id} ja foi processada. Ignorando.")
+            return
+        
+        logger.info(f"Novo PDF detectado: {mensagem.document.file_name}")
+        await _processar_escala(
+            context, mensagem, mensagem.document.file_name,
+            [(mensagem.document.file_id, f"/tmp/escala_{mensagem_id}.pdf")],
+            lambda caminhos: pdf_parser.extrair_escala(caminhos[0])
+        )
+
+
+# Albuns de fotos em montagem: media_group_id -> mensagens ja recebidas
+_albuns: Dict[str, list] = {}
+
+
+def _arquivo_da_imagem(mensagem) -> Tuple[str, str]:
+    """
+    Escolhe o arquivo de uma foto ou imagem enviada como documento.
+    
+    Returns:
+        Tupla (file_id, caminho temporario)
+    """
+    if mensagem.photo:
+        # O Telegram manda varios tamanhos da foto: o OCR precisa do maior
+        maior = max(mensagem.photo, key=lambda tamanho: tamanho.width * tamanho.height)
+        return maior.file_id, f"/tmp/escala_{mensagem.message_id}.jpg"
+    extensao = os.path.splitext(mensagem.document.file_name or "")[1] or ".img"
+    return mensagem.document.file_id, f"/tmp/escala_{mensagem.message_id}{extensao}"
+
+
+async def processar_imagem_escala(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Processa fotos da escala e imagens (PNG/JPEG) enviadas como arquivo.
+    As imagens vao direto para o OCR, sem virar PDF.
+    
+    As fotos de um album chegam em updates separados: o primeiro espera
+    ESPERA_ALBUM segundos pelos outros (os updates sao concorrentes)
+    e todas sao lidas juntas, como paginas de uma mesma escala.
+    """
+    mensagem = update.effective_message
+    
+    # Verifica se eh o canal correto
+    if str(mensagem.chat_id) != str(CANAL_ESCALA_ID):
+        logger.info(f"Mensagem de outro canal ignorada: {mensagem.chat_id}")
+        return
+    
+    if mensagem.media_group_id:
+        album = _albuns.get(mensagem.media_group_id)
+        if album is not None:
+            album.append(mensagem)
+            return
+        _albuns[mensagem.media_group_id] = [mensagem]
+        await asyncio.sleep(ESPERA_ALBUM)
+        mensagens = sorted(_albuns.pop(mensagem.media_group_id), key=lambda m: m.message_id)
+    else:
+        mensagens = [mensagem]
+    
+    # A primeira mensagem representa a escala (recebe o resumo e da o ID)
+    principal = mensagens[0]
+    if len(mensagens) > 1:
+        nome_arquivo = f"album_{principal.message_id} ({len(mensagens)} fotos)"
+    elif principal.document:
+        nome_arquivo = principal.document.file_name or f"imagem_{principal.message_id}"
+    else:
+        nome_arquivo = f"foto_{principal.message_id}.jpg"
     
-    # Baixa o arquivo
-    arquivo = await context.bot.get_file(mensagem.document.file_id)
-    caminho_pdf = f"/tmp/escala_{mensagem_id}.pdf"
-    await arquivo.download_to_drive(caminho_pdf)
+    async with db.trava("escala", principal.message_id):
+        if db.ja_processou_escala(principal.message_id):
+            logger.info(f"Escala {principal.message_id} ja foi processada. Ignorando.")
+            return
+        
+        logger.info(f"Nova escala em imagem detectada: {nome_arquivo}")
+        await _processar_escala(
+            context, principal, nome_arquivo,
+            [_arquivo_da_imagem(m) for m in mensagens],
+            pdf_parser.extrair_escala_de_imagens
+        )
+        
+        # As outras fotos do album tambem contam como processadas
+        if db.ja_processou_escala(principal.message_id):
+            for outra in mensagens[1:]:
+                db.marcar_escala_processada(outra.message_id)
+
+
+async def _processar_escala(context: ContextTypes.DEFAULT_TYPE, mensagem, nome_arquivo: str,
+                            arquivos: List[Tuple[str, str]], extrair):
+    """
+    Baixa os arquivos da escala, le os policiais e envia as notificacoes.
+    
+    Args:
+        mensagem: Mensagem do canal que recebe o resumo (a primeira, num album)
+        nome_arquivo: Nome mostrado nas notificacoes e nos botoes
+        arquivos: Lista de (file_id, caminho temporario) para baixar
+        extrair: Funcao que recebe os caminhos e devolve a escala estruturada
+    """
+    chat_id = mensagem.chat_id
+    mensagem_id = mensagem.message_id
+    caminhos = [caminho for _, caminho in arquivos]
     
     try:
-        # Processa o PDF
-        policiais_na_escala = pdf_parser.processar_pdf(caminho_pdf)
+        # Baixa os arquivos
+        for file_id, caminho in arquivos:
+            arquivo = await context.bot.get_file(file_id)
+            await arquivo.download_to_drive(caminho)
+        
+        # Le a escala (em outra thread: o loop segue atendendo os outros updates)
+        escala = await asyncio.to_thread(extrair, caminhos)
+        policiais_na_escala = escala['policiais']
         
         if not policiais_na_escala:
             await mensagem.reply_text(
                 "⚠️ Nenhum policial encontrado nesta escala.\n"
-                "Verifique se o PDF esta correto.",
+                "Verifique se o arquivo esta correto.",
                 quote=True
             )
             return
         
-        # Contadores
-        notificados = 0
-        nao_cadastrados = []
+        # Sem data no documento, usa o dia da postagem (e nunca eh retificacao:
+        # dois documentos sem data no mesmo dia nao sao a mesma escala)
+        data_escala = escala['data'] or datetime.now().strftime('%d/%m/%Y')
         
-        # Envia notificacao para cada policial
-        for policial in policiais_na_escala:
-            dados_policial = db.buscar_policial_por_nome(policial['nome_completo'])
+        # Turnos (data/equipe/local) de cada policial nesta escala
+        turnos = montar_turnos(escala['equipes'], data_escala)
+        
+        # Duas escalas da mesma data ao mesmo tempo: a segunda espera a
+        # primeira gravar o roster antes de comparar com ele
+        async with db.trava("roster", f"{chat_id}|{data_escala}"):
+            # Escala desta data com os mesmos cabecalhos: eh uma retificacao
+            roster_anterior = db.buscar_roster(chat_id, data_escala, turnos) if escala['data'] else None
+            if roster_anterior:
+                diferencas = comparar_rosters(roster_anterior['policiais'], policiais_na_escala, turnos)
+                a_notificar = diferencas['adicionados'] + [novo for _, novo in diferencas['alterados']]
+                logger.info(
+                    f"Retificacao da escala de {data_escala}: "
+                    f"{len(diferencas['adicionados'])} adicionado(s), "
+                    f"{len(diferencas['removidos'])} removido(s), "
+                    f"{len(diferencas['alterados'])} alterado(s)"
+                )
+            else:
+                diferencas = None
+                a_notificar = policiais_na_escala
+            
+            # Botoes de escalas antigas nao precisam mais ficar guardados
+            db.limpar_tokens_expirados()
+            
+            # Contadores
+            notificados = 0
+            nao_cadastrados = []
+            pendentes = {}  # chat_id -> nome, para os lembretes
+            avisos = []  # (chat_id, aviso): entram na fila depois de gravar os pendentes
+            
+            titulo = "ESCALA RETIFICADA" if diferencas else "NOVA ESCALA DE SERVICO"
             
-            if dados_policial:
-                # Cria botao de confirmacao
-                keyboard = [
-                    [InlineKeyboardButton(
-                        "✅ CONFIRMAR CIENCIA", 
-                        callback_data=f"confirmar_{mensagem_id}_{policial['nome_completo']}"
-                    )]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+            # Envia notificacao para cada policial
+            for policial in a_notificar:
+                dados_policial = db.buscar_policial_por_nome(policial['nome_completo'])
                 
-                # Monta a mensagem
-                texto_mensagem = (
-                    f"🚨 *NOVA ESCALA DE SERVICO* 🚨\n\n"
-                    f"Ola, *{policial['nome_completo']}*!\n\n"
-                    f"Voce foi escalado para o proximo plantao.\n\n"
-                    f"📄 Escala: {mensagem.document.file_name}\n"
-                    f"📅 Data: {datetime.now().strftime('%d/%m/%Y')}\n\n"
-                    f"Por favor, confirme o recebimento desta mensagem."
-                )
+                if dados_policial:
+                    # Monta a mensagem
+                    texto_mensagem = (
+                        f"🚨 *{titulo}* 🚨\n\n"
+                        f"Ola, *{policial['nome_completo']}*!\n\n"
+                        f"Voce foi escalado para o proximo plantao.\n\n"
+                        f"📄 Escala: {escapar_markdown(nome_arquivo)}\n"
+                    )
+                    # Data, equipe e local de cada turno do policial nesta escala
+                    turnos_policial = turnos.get(policial['nome_completo'])
+                    if turnos_policial:
+                        texto_mensagem += '\n'.join(_descrever_turno(t) for t in turnos_policial) + "\n\n"
+                    else:
+                        texto_mensagem += f"📅 Data: {data_escala}\n\n"
+                    texto_mensagem += "Por favor, confirme o recebimento desta mensagem."
+                    
+                    # Botao da escala (o aviso entra na fila depois de gravar os pendentes)
+                    token = db.emitir_token(mensagem_id, dados_policial.chat_id, policial['nome_completo'])
+                    avisos.append((dados_policial.chat_id, {
+                        'texto': texto_mensagem,
+                        'botao': f"✅ CONFIRMAR - {nome_arquivo}"[:60],
+                        'callback_data': f"{PREFIXO_CONFIRMAR}{token}",
+                        'ao_falhar': lambda chat, mid=mensagem_id: db.registrar_falha_envio(mid, chat)
+                    }))
+                    notificados += 1
+                    pendentes[dados_policial.chat_id] = policial['nome_completo']
+                    logger.info(f"Notificacao enfileirada para {policial['nome_completo']}")
+                else:
+                    nao_cadastrados.append(policial['nome_completo'])
+            
+            # Avisa quem saiu da escala na retificacao
+            if diferencas:
+                # Quem saiu ou mudou nao deve mais ser lembrado da escala anterior
+                saiu_da_anterior = list(pendentes)
                 
-                try:
-                    await context.bot.send_message(
-                        chat_id=dados_policial['chat_id'],
-                        text=texto_mensagem,
-                        parse_mode='Markdown',
-                        reply_markup=reply_markup
+                for nome_completo in diferencas['removidos']:
+                    dados_policial = db.buscar_policial_por_nome(nome_completo)
+                    if not dados_policial:
+                        continue
+                    saiu_da_anterior.append(dados_policial.chat_id)
+                    texto_mensagem = (
+                        f"ℹ️ *ESCALA RETIFICADA* ℹ️\n\n"
+                        f"Ola, *{nome_completo}*!\n\n"
+                        f"Voce foi *retirado* da escala de {data_escala}.\n\n"
+                        f"📄 Escala: {escapar_markdown(nome_arquivo)}"
                     )
+                    avisos.append((dados_policial.chat_id, {'texto': texto_mensagem}))
                     notificados += 1
-                    logger.info(f"Notificacao enviada para {policial['nome_completo']}")
-                except Exception as e:
-                    logger.error(f"Erro ao notificar {policial['nome_completo']}: {e}")
-            else:
-                nao_cadastrados.append(policial['nome_completo'])
-        
-        # Marca como processada
-        db.marcar_escala_processada(mensagem_id)
+            
+                db.remover_pendentes(roster_anterior['mensagem_id'], saiu_da_anterior)
+            
+            # Marca como processada e guarda o roster para futuras retificacoes
+            db.marcar_escala_processada(mensagem_id)
+            substitui = roster_anterior['mensagem_id'] if roster_anterior else None
+            if escala['data']:
+                db.salvar_roster(chat_id, data_escala, mensagem_id, turnos, substitui)
+            db.registrar_escala_no_historico(
+                chat_id, mensagem_id, nome_arquivo,
+                data_escala, policiais_na_escala, substitui
+            )
+            
+            # Atualiza o indice de turnos (usado pelo /minhaescala)
+            db.registrar_turnos(
+                mensagem_id, turnos,
+                substituir=(
+                    roster_anterior['mensagem_id'],
+                    list(roster_anterior['policiais'])
+                ) if roster_anterior else None
+            )
+            
+            # Agenda os lembretes para quem nao confirmar
+            if pendentes:
+                db.adicionar_pendentes(mensagem_id, pendentes)
+                agendar_lembretes(context.job_queue, chat_id, mensagem_id, nome_arquivo, data_escala)
+            
+            # Entra na fila de cada policial (agrupa com outras escalas recentes);
+            # quem nao receber sai dos pendentes e do total de notificados
+            for destino, aviso in avisos:
+                await fila_notificacoes.enfileirar(context.bot, destino, aviso)
         
         # Resumo no canal
-        resumo = f"✅ *Escala processada!*\n\n"
+        if diferencas:
+            resumo = f"✅ *Retificacao processada!* ({data_escala})\n\n"
+        else:
+            resumo = f"✅ *Escala processada!*\n\n"
         resumo += f"📊 Total na escala: {len(policiais_na_escala)}\n"
-        resumo += f"✉️ Notificados: {notificados}\n"
+        
+        if diferencas:
+            resumo += f"➕ Adicionados: {len(diferencas['adicionados'])}\n"
+            resumo += f"➖ Removidos: {len(diferencas['removidos'])}\n"
+            resumo += f"🔄 Alterados: {len(diferencas['alterados'])}\n"
+        
+        # As mensagens ainda estao na fila: falhas de entrega aparecem nos lembretes
+        resumo += f"✉️ Enfileirados: {notificados}\n"
         
         if nao_cadastrados:
             resumo += f"❌ Nao cadastrados: {len(nao_cadastrados)}\n"
-            resumo += f"\n*Policiais nao cadastrados:*\n"
-            for nome in nao_cadastrados[:10]:  # Mostra so os 10 primeiros
-                resumo += f"• {nome}\n"
-            if len(nao_cadastrados) > 10:
-                resumo += f"... e mais {len(nao_cadastrados) - 10}\n"
+        
+        if diferencas:
+            if diferencas['adicionados']:
+                resumo += _listar_nomes("Adicionados", [p['nome_completo'] for p in diferencas['adicionados']])
+            if diferencas['removidos']:
+                resumo += _listar_nomes("Removidos", diferencas['removidos'])
+            if diferencas['alterados']:
+                resumo += _listar_nomes(
+                    "Alterados",
+                    [f"{antigo} → {_descrever_policial(novo['nome_completo'], resumir_turnos(turnos.get(novo['nome_completo'], [])))}"
+                     for antigo, novo in diferencas['alterados']]
+                )
+            if not any(diferencas.values()):
+                resumo += "\nNenhuma mudanca em relacao a escala anterior."
+        
+        if nao_cadastrados:
+            resumo += _listar_nomes("Policiais nao cadastrados", nao_cadastrados)
             resumo += f"\nEstes precisam usar /configurar no privado do bot."
         
         await mensagem.reply_text(resumo, parse_mode='Markdown', quote=True)
@@ -449,9 +1392,10 @@ async def processar_pdf_escala(update: Update, context: ContextTypes.DEFAULT_TYP
             quote=True
         )
     finally:
-        # Limpa o arquivo temporario
-        if os.path.exists(caminho_pdf):
-            os.remove(caminho_pdf)
+        # Limpa os arquivos temporarios
+        for caminho in caminhos:
+            if os.path.exists(caminho):
+                os.remove(caminho)
 
 
 async def botao_confirmar_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -459,45 +1403,274 @@ async def botao_confirmar_callback(update: Update, context: ContextTypes.DEFAULT
     Processa o clique no botao "Confirmar Ciencia".
     """
     query = update.callback_query
-    await query.answer()  # Remove o "carregando..."
     
-    # Extrai dados do callback_data
-    # Formato: confirmar_{mensagem_id}_{nome_completo}
-    partes = query.data.split('_', 2)
-    if len(partes) < 3:
-        return
+    # Cliques do mesmo chat registram um de cada vez: cada um monta os
+    # botoes da mesma mensagem e precisa ver os que o anterior ja tirou
+    async with db.trava("chat", query.message.chat_id):
+        # Formato: c:{token} (o token aponta para a escala e o destinatario)
+        destino = None
+        if query.data.startswith(PREFIXO_CONFIRMAR):
+            destino = db.buscar_token(query.data[len(PREFIXO_CONFIRMAR):])
+        
+        if destino is None:
+            # Botao expirado ou do formato antigo (confirmar_{id}_{nome})
+            await query.answer(
+                "⚠️ Este botao nao vale mais (expirou).",
+                show_alert=True
+            )
+            return
+        
+        mensagem_id, chat_id, nome_completo = destino
+        
+        # O token continua valido ate expirar: se a edicao abaixo falhou,
+        # um novo clique so refaz a edicao (a confirmacao nao conta duas vezes)
+        if db.registrar_confirmacao(mensagem_id, chat_id, True, nome_completo):
+            await query.answer()  # Remove o "carregando..."
+        else:
+            await query.answer("✅ Sua ciencia ja estava registrada.")
+        
+        # Mensagens agrupadas tem um botao por escala: so o clicado sai
+        # (e os que outro clique ja usou, se a mensagem recebida estava desatualizada)
+        botoes_restantes = []
+        rotulo_clicado = None
+        if query.message.reply_markup:
+            for linha in query.message.reply_markup.inline_keyboard:
+                dados_botao = linha[0].callback_data or ""
+                if dados_botao == query.data:
+                    rotulo_clicado = linha[0].text
+                elif dados_botao.startswith(PREFIXO_CONFIRMAR):
+                    outro = db.buscar_token(dados_botao[len(PREFIXO_CONFIRMAR):])
+                    if outro and not db.ja_confirmou(outro[0], outro[1]):
+                        botoes_restantes.append(linha)
+        
+        # Atualiza a mensagem (o texto recebido vem sem a marcacao:
+        # text_markdown refaz o negrito e escapa o resto, como "foto_123.jpg")
+        texto_original = query.message.text_markdown
+        
+        nova_mensagem = f"{texto_original}\n\n✅ *CIENCIA CONFIRMADA*\n"
+        if botoes_restantes and rotulo_clicado:
+            nova_mensagem += f"Escala: {escapar_markdown(rotulo_clicado.replace('✅ CONFIRMAR - ', ''))}\n"
+        nova_mensagem += f"Confirmado em: {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+        markup = InlineKeyboardMarkup(botoes_restantes) if botoes_restantes else None
     
-    mensagem_id = partes[1]
-    nome_completo = partes[2]
-    chat_id = query.message.chat_id
+    # A edicao pode esperar a fila por minutos: fica fora da trava do chat
+    # (/configurar e /recomecar nao esperam). A trava da mensagem eh pedida
+    # sem await antes, assim as edicoes saem na ordem dos cliques
+    async with db.trava("mensagem", f"{query.message.chat_id}|{query.message.message_id}"):
+        # Remove o botao clicado e atualiza o texto
+        await _editar_confirmacao(query, nova_mensagem, markup)
     
-    # Registra a confirmacao
-    db.registrar_confirmacao(mensagem_id, chat_id, True)
+    logger.info(f"Ciencia confirmada por {nome_completo}")
+
+
+async def _editar_confirmacao(query, texto: str, reply_markup: Optional[InlineKeyboardMarkup]):
+    """
+    Edita a mensagem do botao clicado. A confirmacao ja foi gravada:
+    a edicao passa pela fila de notificacoes (mesmo limite de taxa dos
+    envios) e insiste ate o prazo da fila se o Telegram pedir para esperar.
+    """
+    editada = await fila_notificacoes.editar(
+        query.get_bot(), query.message.chat_id, query.message.message_id, texto, reply_markup
+    )
+    if not editada:
+        logger.warning(f"Confirmacao gravada, mas a mensagem do chat {query.message.chat_id} nao foi editada")
+
+
+# ============== LEMBRETES ==============
+
+def interpretar_escalonamento(texto: str) -> List[Tuple[float, str]]:
+    """
+    Converte a configuracao de lembretes em uma lista de passos.
     
-    # Atualiza a mensagem
-    texto_original = query.message.text
+    Args:
+        texto: Ex: "2h,6h,8h:canal" (sufixos h ou m; acao padrao "lembrete")
+        
+    Returns:
+        Lista ordenada de (segundos apos o envio, acao)
+    """
+    passos = []
+    for item in texto.split(','):
+        item = item.strip().lower()
+        if not item:
+            continue
+        tempo, _, acao = item.partition(':')
+        acao = acao or "lembrete"
+        if acao not in ("lembrete", "canal"):
+            raise ValueError(f"Acao de lembrete invalida: {acao}")
+        multiplicador = 60 if tempo.endswith('m') else 3600
+        passos.append((float(tempo.rstrip('+hm')) * multiplicador, acao))
+    return sorted(passos)
+
+
+PASSOS_LEMBRETE = interpretar_escalonamento(ESCALONAMENTO_LEMBRETES)
+
+
+def agendar_lembretes(job_queue, canal_id: int, mensagem_id: int, arquivo: str, data_escala: str):
+    """Cria a agenda de lembretes da escala e agenda o primeiro passo."""
+    if not PASSOS_LEMBRETE:
+        return
     
-    nova_mensagem = (
-        f"{texto_original}\n\n"
-        f"✅ *CIENCIA CONFIRMADA*\n"
-        f"Confirmado em: {datetime.now().strftime('%d/%m/%Y %H:%M')}"
-    )
+    agenda = {
+        "canal": canal_id,
+        "inicio": time.time(),
+        "passo": 0,
+        "arquivo": arquivo,
+        "data": data_escala
+    }
+    db.salvar_lembrete(mensagem_id, agenda)
+    _agendar_passo(job_queue, mensagem_id, agenda)
+
+
+def _agendar_passo(job_queue, mensagem_id: int, agenda: dict):
+    """Agenda no JobQueue o proximo passo de lembrete da escala."""
+    if job_queue is None:
+        logger.warning("JobQueue indisponivel: instale python-telegram-bot[job-queue]")
+        return
     
-    # Remove o botao e atualiza o texto
-    await query.edit_message_text(
-        nova_mensagem,
-        parse_mode='Markdown'
+    atraso, _ = PASSOS_LEMBRETE[agenda["passo"]]
+    espera = max(0.0, agenda["inicio"] + atraso - time.time())
+    job_queue.run_once(
+        executar_lembrete,
+        when=espera,
+        data=int(mensagem_id),
+        name=f"lembrete_{mensagem_id}"
     )
+
+
+async def executar_lembrete(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Executa um passo de lembrete: avisa os pendentes ou alerta o canal,
+    e agenda o passo seguinte.
+    """
+    mensagem_id = context.job.data
     
-    logger.info(f"Ciencia confirmada por {nome_completo}")
+    # O passo le os pendentes, envia e grava a agenda: um de cada vez por escala
+    async with db.trava("escala", mensagem_id):
+        agenda = db.dados["lembretes"].get(str(mensagem_id))
+        if not agenda:
+            return
+        
+        pendentes = db.listar_pendentes(mensagem_id)
+        if not pendentes:
+            logger.info(f"Escala {mensagem_id}: todos confirmaram. Lembretes encerrados.")
+            db.remover_lembrete(mensagem_id)
+            return
+        
+        _, acao = PASSOS_LEMBRETE[agenda["passo"]]
+        
+        if acao == "canal":
+            texto = (
+                f"⏰ *Confirmacoes pendentes*\n\n"
+                f"📄 Escala: {escapar_markdown(agenda['arquivo'])}\n"
+                f"📅 Data: {agenda['data']}\n"
+                f"❌ Sem confirmacao: {len(pendentes)}\n"
+            )
+            totais = db.dados["totais"].get(str(mensagem_id))
+            if totais:
+                texto += f"✅ Confirmaram: {totais['confirmados']} de {totais['notificados']}\n"
+                if totais.get("falhas"):
+                    texto += f"📵 Nao entregues: {totais['falhas']}\n"
+            texto += _listar_nomes("Policiais pendentes", sorted(pendentes.values()))
+            await fila_notificacoes.enfileirar(context.bot, agenda['canal'], {'texto': texto})
+        else:
+            # Os lembretes passam pela mesma fila (agrupada e com limite de taxa)
+            for chat_id, nome_completo in pendentes.items():
+                await fila_notificacoes.enfileirar(context.bot, chat_id, {
+                    'texto': (
+                        f"⏰ *LEMBRETE DE ESCALA* ⏰\n\n"
+                        f"Ola, *{nome_completo}*!\n\n"
+                        f"Voce ainda nao confirmou a ciencia da escala.\n\n"
+                        f"📄 Escala: {escapar_markdown(agenda['arquivo'])}\n"
+                        f"📅 Data: {agenda['data']}"
+                    ),
+                    'botao': f"✅ CONFIRMAR - {agenda['arquivo']}"[:60],
+                    'callback_data': f"{PREFIXO_CONFIRMAR}{db.emitir_token(mensagem_id, chat_id, nome_completo)}",
+                    'ao_falhar': lambda chat, mid=mensagem_id: db.registrar_falha_envio(mid, chat)
+                })
+        
+        logger.info(f"Escala {mensagem_id}: passo {agenda['passo'] + 1} ({acao}) para {len(pendentes)} pendente(s)")
+        
+        # Proximo passo (ou fim da agenda)
+        agenda["passo"] += 1
+        if agenda["passo"] >= len(PASSOS_LEMBRETE):
+            db.remover_lembrete(mensagem_id)
+        else:
+            db.salvar_lembrete(mensagem_id, agenda)
+            _agendar_passo(context.job_queue, mensagem_id, agenda)
+
+
+async def restaurar_lembretes(application: Application):
+    """Reagenda os lembretes gravados no banco (apos um reinicio do bot)."""
+    for mensagem_id, agenda in list(db.dados["lembretes"].items()):
+        if agenda["passo"] >= len(PASSOS_LEMBRETE):
+            db.remover_lembrete(mensagem_id)
+            continue
+        _agendar_passo(application.job_queue, int(mensagem_id), agenda)
+    
+    if db.dados["lembretes"]:
+        logger.info(f"{len(db.dados['lembretes'])} agenda(s) de lembrete restaurada(s)")
 
 
 # ============== INICIALIZACAO ==============
 
+async def encerrar_notificacoes(application: Application):
+    """
+    Envia as notificacoes que ainda estavam esperando a janela de
+    agrupamento e grava as alteracoes do banco que ainda nao foram gravadas.
+    """
+    await fila_notificacoes.esvaziar()
+    await db.descarregar()
+
+
+def registrar_handlers(application: Application):
+    """
+    Adiciona todos os handlers do bot na aplicacao.
+    (Separado do main para ser reaproveitado pelo teste de carga.)
+    """
+    # Limite de comandos: roda antes de todos os outros handlers
+    application.add_handler(MessageHandler(filters.COMMAND, limitar_comandos), group=-1)
+    if application.job_queue:
+        application.job_queue.run_repeating(relatar_descartes, interval=600, first=600, data={})
+        application.job_queue.run_repeating(manter_historico, interval=24 * 3600, first=60)
+    
+    # Adiciona handlers de comandos
+    application.add_handler(CommandHandler("start", comando_start))
+    application.add_handler(CommandHandler("ajuda", comando_ajuda))
+    application.add_handler(CommandHandler("help", comando_ajuda))
+    application.add_handler(CommandHandler("configurar", comando_configurar))
+    application.add_handler(CommandHandler("status", comando_status))
+    application.add_handler(CommandHandler("recomecar", comando_recomecar))
+    application.add_handler(CommandHandler("minhaescala", comando_minhaescala))
+    application.add_handler(CommandHandler("historico", comando_historico))
+    application.add_handler(CommandHandler("contagem", comando_contagem))
+    
+    # Handler para PDFs no canal
+    # (o filtro precisa do ID como inteiro: com texto ele nunca casa)
+    canal_id = int(CANAL_ESCALA_ID) if CANAL_ESCALA_ID.lstrip('-').isdigit() else None
+    application.add_handler(MessageHandler(
+        filters.Document.PDF & filters.Chat(chat_id=canal_id),
+        processar_pdf_escala
+    ))
+    
+    # Handler para fotos e imagens (PNG/JPEG como arquivo) no canal
+    application.add_handler(MessageHandler(
+        (filters.PHOTO | filters.Document.MimeType("image/png") | filters.Document.MimeType("image/jpeg"))
+        & filters.Chat(chat_id=canal_id),
+        processar_imagem_escala
+    ))
+    
+    # Handler para botao de confirmacao (inclui os botoes do formato antigo)
+    application.add_handler(CallbackQueryHandler(
+        botao_confirmar_callback, pattern=f"^({PREFIXO_CONFIRMAR}|confirmar_)"
+    ))
+
+
 def main():
     """
     Funcao principal que inicia o bot.
     """
+    global db, pdf_parser
+    
     logger.info("Iniciando Bot de Escala Militar...")
     
     # Verifica se o token foi configurado
@@ -509,30 +1682,31 @@ def main():
     if not CANAL_ESCALA_ID:
         logger.warning("CANAL_ESCALA_ID nao configurado!")
     
-    # Cria a aplicacao
-    application = Application.builder().token(BOT_TOKEN).build()
+    db = BancoDeDados()
+    pdf_parser = PDFParser(motor_ocr=OCR_MOTOR)
     
-    # Adiciona handlers de comandos
-    application.add_handler(CommandHandler("start", comando_start))
-    application.add_handler(CommandHandler("ajuda", comando_ajuda))
-    application.add_handler(CommandHandler("help", comando_ajuda))
-    application.add_handler(CommandHandler("configurar", comando_configurar))
-    application.add_handler(CommandHandler("status", comando_status))
-    application.add_handler(CommandHandler("recomecar", comando_recomecar))
-    
-    # Handler para PDFs no canal
-    application.add_handler(MessageHandler(
-        filters.Document.PDF & filters.Chat(chat_id=CANAL_ESCALA_ID if CANAL_ESCALA_ID else None),
-        processar_pdf_escala
-    ))
+    # Cria a aplicacao (ao iniciar, reagenda os lembretes gravados;
+    # ao desligar, envia as notificacoes ainda agrupadas).
+    # Os updates sao processados em paralelo: um PDF demorado nao atrasa
+    # os comandos dos outros usuarios (o banco usa travas por chave)
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(True)
+        .post_init(restaurar_lembretes)
+        .post_stop(encerrar_notificacoes)
+        .build()
+    )
     
-    # Handler para botao de confirmacao
-    application.add_handler(CallbackQueryHandler(botao_confirmar_callback, pattern="^confirmar_"))
+    registrar_handlers(application)
     
     logger.info("Bot iniciado e aguardando mensagens...")
     
     # Inicia o bot (modo polling)
     application.run_polling(allowed_updates=Update.ALL_TYPES)
+    
+    # Libera os workers de OCR ao desligar
+    pdf_parser.encerrar()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,614 @@
+"""
+HISTORICO - Registro Permanente de Escalas e Confirmacoes
+=========================================================
+O bot acrescenta uma linha JSON por evento em arquivos que so
+crescem, separados pelo mes em que foram gravados (particoes):
+
+- escalas/AAAA-MM.jsonl       uma linha por escala processada
+- rosters/AAAA-MM.jsonl       uma linha por policial em cada escala
+- confirmacoes/AAAA-MM.jsonl  uma linha por ciencia confirmada
+
+So a particao do mes atual recebe linhas novas; as anteriores
+ficam fechadas.
+
+O servidor web le estes arquivos aos poucos (linha a linha) para
+exportar o historico, sem carregar o banco inteiro na memoria.
+O cursor de paginacao eh "AAAA-MM:posicao" (particao e byte nela).
+
+Toda linha comeca com o campo "dia" (AAAA-MM-DD), assim o filtro
+por data nao precisa interpretar o JSON das linhas fora do periodo.
+
+Indice por policial: cada particao de rosters (pelo nome com posto)
+e de confirmacoes (pelo chat_id) tem a lista de (dia, escala, posicao)
+de cada policial. O /historico le so as linhas do policial e a
+contagem de turnos usa so o indice, sem percorrer todas as escalas.
+Quais escalas foram substituidas por retificacao fica em memoria,
+atualizado so com as escalas gravadas depois da ultima consulta.
+
+So o bot altera a pasta (preparar, acrescentar, manter); o servidor
+web apenas le.
+
+Manutencao (uma vez por dia):
+- Compactacao: particoes fechadas ha mais de um mes vao para o disco
+  com o indice (AAAA-MM.indice.json). Nos rosters, saem as linhas de
+  escalas substituidas por retificacao em que o turno do policial
+  mudou (o /historico so compara com as que ficaram iguais). Um cursor
+  de exportacao guardado antes aponta para o arquivo antigo: a
+  exportacao dessa particao precisa recomecar.
+- Retencao: particoes mais antigas que o limite sao apagadas
+
+Autor: Bot Escala Militar
+"""
+
+import json
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from pdf_parser import separar_posto
+
+# Tipos de historico e as colunas exportadas de cada um
+COLUNAS = {
+    "escalas": ["dia", "mensagem_id", "canal", "data_escala", "arquivo", "total", "retificacao", "registrado_em",
+                "substitui"],
+    "rosters": ["dia", "mensagem_id", "data_escala", "nome_completo", "equipe", "local"],
+    "confirmacoes": ["dia", "mensagem_id", "chat_id", "nome_completo", "confirmado_em"],
+}
+
+# Campo que identifica o policial nos tipos com indice
+CAMPO_INDICE = {"rosters": "nome_completo", "confirmacoes": "chat_id"}
+
+# Campos do roster que definem o turno (iguais = a ciencia anterior vale)
+CAMPOS_TURNO = ("data_escala", "equipe", "local")
+
+_PREFIXO_DIA = b'{"dia":"'
+_REGEX_MES = re.compile(r"\d{4}-\d{2}")
+
+
+def dia_iso(data: str) -> str:
+    """Converte DD/MM/AAAA para AAAA-MM-DD (ou devolve como veio)."""
+    partes = data.split('/')
+    if len(partes) == 3:
+        return f"{partes[2]}-{partes[1]}-{partes[0]}"
+    return data
+
+
+def mes_atual() -> str:
+    """Particao que recebe as linhas gravadas agora (AAAA-MM)."""
+    return date.today().strftime('%Y-%m')
+
+
+def somar_meses(mes: str, meses: int) -> str:
+    """Soma (ou subtrai) meses de um AAAA-MM."""
+    ano, numero = map(int, mes.split('-'))
+    total = ano * 12 + numero - 1 + meses
+    return f"{total // 12:04d}-{total % 12 + 1:02d}"
+
+
+def _dia_numero(dia: str) -> int:
+    """AAAA-MM-DD -> AAAAMMDD (0 se o dia nao estiver nesse formato)."""
+    numero = dia.replace('-', '')
+    return int(numero) if len(numero) == 8 and numero.isdigit() else 0
+
+
+def _chave(tipo: str, valor) -> str:
+    """Chave do indice: nome com posto (rosters) ou chat_id (confirmacoes)."""
+    if tipo == "rosters":
+        posto, nome = separar_posto(valor)
+        return f"{posto} {nome}" if posto else nome
+    return str(valor)
+
+
+class IndiceParticao:
+    """
+    Indice de uma particao: chave do policial -> entradas
+    (dia AAAAMMDD, mensagem_id, posicao da linha) em um array plano.
+    """
+
+    __slots__ = ('tamanho', 'entradas', 'menor_dia', 'maior_dia')
+
+    def __init__(self):
+        self.tamanho = 0  # bytes do arquivo ja indexados
+        self.entradas: Dict[str, array] = {}
+        self.menor_dia = 0
+        self.maior_dia = 0
+
+    def adicionar(self, chave: str, dia: int, mensagem_id: int, posicao: int):
+        lista = self.entradas.get(chave)
+        if lista is None:
+            lista = self.entradas[chave] = array('q')
+        lista.extend((dia, mensagem_id, posicao))
+        if dia:
+            self.menor_dia = min(self.menor_dia or dia, dia)
+            self.maior_dia = max(self.maior_dia, dia)
+
+    def do_policial(self, chave: str) -> Iterator[Tuple[int, int, int]]:
+        """Entradas (dia, mensagem_id, posicao) de um policial."""
+        lista = self.entradas.get(chave, ())
+        for i in range(0, len(lista), 3):
+            yield lista[i], lista[i + 1], lista[i + 2]
+
+    def exportar(self) -> dict:
+        return {
+            "tamanho": self.tamanho,
+            "dias": [self.menor_dia, self.maior_dia],
+            "entradas": {chave: lista.tolist() for chave, lista in self.entradas.items()},
+        }
+
+    @classmethod
+    def carregar(cls, dados: dict) -> "IndiceParticao":
+        indice = cls()
+        indice.tamanho = dados["tamanho"]
+        indice.menor_dia, indice.maior_dia = dados["dias"]
+        indice.entradas = {chave: array('q', lista) for chave, lista in dados["entradas"].items()}
+        return indice
+
+
+class Historico:
+    """Arquivos JSON-lines so de acrescimo, por tipo de evento e mes."""
+
+    def __init__(self, pasta: str, max_indices: int = 12):
+        """
+        Args:
+            pasta: Pasta do historico
+            max_indices: Indices de particao mantidos na memoria
+                         (os menos usados saem primeiro)
+        """
+        self.pasta = pasta
+        self.max_indices = max_indices
+        self._indices: "OrderedDict[Tuple[str, str], IndiceParticao]" = OrderedDict()
+        # (tipo, particao) -> (tamanho, menor dia, maior dia), para pular
+        # particoes fora do periodo sem carregar o indice
+        self._dias: Dict[Tuple[str, str], Tuple[int, int, int]] = {}
+        self._trava = threading.Lock()
+
+        # Escalas lidas ate agora (atualizadas a partir do cursor)
+        self._cursor_escalas = "0"
+        self._anterior: Dict[int, int] = {}  # retificacao -> escala que ela substituiu
+        self._particao_escala: Dict[int, str] = {}  # escala -> particao em que foi gravada
+
+    def preparar(self):
+        """
+        Cria as pastas de cada tipo.
+        Chamado so pelo bot (o servidor web nunca altera o historico).
+        """
+        for tipo in COLUNAS:
+            os.makedirs(os.path.join(self.pasta, tipo), exist_ok=True)
+
+    def caminho(self, tipo: str, particao: str) -> str:
+        if tipo not in COLUNAS:
+            raise ValueError(f"Tipo de historico desconhecido: {tipo}")
+        return os.path.join(self.pasta, tipo, f"{particao}.jsonl")
+
+    def _caminho_indice(self, tipo: str, particao: str) -> str:
+        return os.path.join(self.pasta, tipo, f"{particao}.indice.json")
+
+    def particoes(self, tipo: str) -> List[str]:
+        """Meses (AAAA-MM) com arquivo do tipo, do mais antigo ao mais novo."""
+        if tipo not in COLUNAS:
+            raise ValueError(f"Tipo de historico desconhecido: {tipo}")
+        pasta = os.path.join(self.pasta, tipo)
+        if not os.path.isdir(pasta):
+            return []
+        return sorted(
+            nome[:-len(".jsonl")] for nome in os.listdir(pasta)
+            if nome.endswith(".jsonl") and _REGEX_MES.fullmatch(nome[:-len(".jsonl")])
+        )
+
+    def vazio(self) -> bool:
+        return not any(self.particoes(tipo) for tipo in COLUNAS)
+
+    # ============== ESCRITA ==============
+
+    def acrescentar(self, tipo: str, registros: list):
+        """
+        Acrescenta registros ao fim da particao do mes atual.
+
+        Args:
+            tipo: "escalas", "rosters" ou "confirmacoes"
+            registros: Lista de dicionarios com as colunas do tipo;
+                       "dia" (AAAA-MM-DD) eh obrigatorio e vai na frente
+        """
+        linhas = "".join(
+            json.dumps({"dia": registro["dia"], **registro}, ensure_ascii=False, separators=(",", ":")) + "\n"
+            for registro in registros
+        )
+        with open(self.caminho(tipo, mes_atual()), 'a', encoding='utf-8') as f:
+            f.write(linhas)
+
+    # ============== LEITURA ==============
+
+    @staticmethod
+    def ler_cursor(cursor: str) -> Tuple[str, int]:
+        """
+        Interpreta o cursor "AAAA-MM:posicao" ("" ou "0" = inicio).
+
+        Raises:
+            ValueError: Cursor em outro formato
+        """
+        if cursor in ("", "0"):
+            return "", 0
+        particao, _, posicao = cursor.partition(':')
+        if not _REGEX_MES.fullmatch(particao) or not posicao.isdigit():
+            raise ValueError(f"Cursor invalido: {cursor}")
+        return particao, int(posicao)
+
+    def _linhas(self, tipo: str, cursor: str, fim: Optional[str] = None) -> Iterator[Tuple[str, bytes]]:
+        """
+        Percorre as linhas completas a partir do cursor, particao por particao.
+        Uma linha ainda sendo escrita (sem o \\n final) fica para a proxima leitura.
+
+        Returns:
+            Iterador de (cursor apos a linha, linha)
+        """
+        particao_inicio, posicao_inicio = self.ler_cursor(cursor)
+        particao_fim, posicao_fim = self.ler_cursor(fim) if fim is not None else (None, None)
+        for particao in self.particoes(tipo):
+            if particao < particao_inicio:
+                continue
+            if particao_fim is not None and particao > particao_fim:
+                return
+            posicao = posicao_inicio if particao == particao_inicio else 0
+            limite = posicao_fim if particao == particao_fim else None
+            with open(self.caminho(tipo, particao), 'rb') as f:
+                f.seek(posicao)
+                for linha in f:
+                    if not linha.endswith(b"\n"):
+                        return
+                    posicao += len(linha)
+                    if limite is not None and posicao > limite:
+                        return
+                    yield f"{particao}:{posicao}", linha
+
+    @staticmethod
+    def _no_periodo(linha: bytes, desde: Optional[str], ate: Optional[str]) -> bool:
+        if not linha.startswith(_PREFIXO_DIA):
+            return False  # cursor no meio de uma linha
+        dia = linha[len(_PREFIXO_DIA):len(_PREFIXO_DIA) + 10].decode('ascii', 'replace')
+        return (desde is None or dia >= desde) and (ate is None or dia <= ate)
+
+    def paginar(self, tipo: str, cursor: str = "", limite: int = 1000,
+                desde: Optional[str] = None, ate: Optional[str] = None) -> Tuple[str, bool]:
+        """
+        Descobre onde termina a pagina que comeca no cursor
+        (so percorre os arquivos, sem guardar as linhas).
+
+        Returns:
+            Tupla (cursor da proxima pagina, se ainda ha linhas depois dela)
+        """
+        encontrados = 0
+        fim = cursor or "0"
+        for depois, linha in self._linhas(tipo, cursor):
+            if self._no_periodo(linha, desde, ate):
+                if encontrados == limite:
+                    return fim, True
+                encontrados += 1
+            fim = depois
+        return fim, False
+
+    def fim(self, tipo: str) -> str:
+        """Cursor do fim do historico do tipo (sem percorrer as linhas)."""
+        particoes = self.particoes(tipo)
+        if not particoes:
+            return "0"
+        return f"{particoes[-1]}:{os.path.getsize(self.caminho(tipo, particoes[-1]))}"
+
+    def ler(self, tipo: str, cursor: str, fim: str,
+            desde: Optional[str] = None, ate: Optional[str] = None) -> Iterator[bytes]:
+        """Gera as linhas (JSON, com \\n) do periodo entre cursor e fim."""
+        for _, linha in self._linhas(tipo, cursor, fim):
+            if self._no_periodo(linha, desde, ate):
+                yield linha
+
+    def _ler_linha(self, tipo: str, particao: str, posicao: int) -> dict:
+        with open(self.caminho(tipo, particao), 'rb') as f:
+            f.seek(posicao)
+            return json.loads(f.readline())
+
+    # ============== INDICE POR POLICIAL ==============
+
+    def _indexar(self, tipo: str, particao: str, indice: IndiceParticao):
+        """Acrescenta ao indice as linhas da particao depois de indice.tamanho."""
+        campo = CAMPO_INDICE[tipo]
+        with open(self.caminho(tipo, particao), 'rb') as f:
+            f.seek(indice.tamanho)
+            posicao = indice.tamanho
+            for linha in f:
+                if not linha.endswith(b"\n"):
+                    break
+                registro = json.loads(linha)
+                if registro.get(campo) not in (None, ""):
+                    indice.adicionar(_chave(tipo, registro[campo]), _dia_numero(registro["dia"]),
+                                     int(registro["mensagem_id"]), posicao)
+                posicao += len(linha)
+        indice.tamanho = posicao
+
+    def _indice(self, tipo: str, particao: str) -> IndiceParticao:
+        """
+        Indice da particao, em dia com as linhas novas do arquivo
+        (chamar com a trava).
+        """
+        chave = (tipo, particao)
+        tamanho = os.path.getsize(self.caminho(tipo, particao))
+        indice = self._indices.get(chave)
+        if indice is None or indice.tamanho > tamanho:
+            indice = None
+            caminho_indice = self._caminho_indice(tipo, particao)
+            if os.path.exists(caminho_indice):
+                with open(caminho_indice, 'r', encoding='utf-8') as f:
+                    indice = IndiceParticao.carregar(json.load(f))
+                if indice.tamanho > tamanho:
+                    indice = None  # indice de uma versao anterior do arquivo
+            indice = indice or IndiceParticao()
+            self._indices[chave] = indice
+            if len(self._indices) > self.max_indices:
+                self._indices.popitem(last=False)
+        else:
+            self._indices.move_to_end(chave)
+
+        if tamanho > indice.tamanho:
+            self._indexar(tipo, particao, indice)
+        self._dias[chave] = (indice.tamanho, indice.menor_dia, indice.maior_dia)
+        return indice
+
+    def _atualizar_escalas(self):
+        """
+        Le so as escalas gravadas desde a ultima consulta e atualiza
+        quem foi substituido por retificacao (chamar com a trava).
+        """
+        for depois, linha in self._linhas("escalas", self._cursor_escalas):
+            registro = json.loads(linha)
+            mensagem_id = int(registro["mensagem_id"])
+            if registro["substitui"] is not None:
+                self._anterior[mensagem_id] = int(registro["substitui"])
+            self._particao_escala[mensagem_id] = depois.partition(':')[0]
+            self._cursor_escalas = depois
+
+    def escalas_substituidas(self) -> Set[int]:
+        """IDs das escalas que uma retificacao substituiu."""
+        with self._trava:
+            self._atualizar_escalas()
+            return set(self._anterior.values())
+
+    def _linha_na_escala(self, chave: str, mensagem_id: int) -> Optional[dict]:
+        """
+        Linha do policial no roster de uma escala (chamar com a trava).
+        O roster vai para a particao da escala ou, na virada do mes, para a seguinte.
+        """
+        particao_escala = self._particao_escala.get(mensagem_id)
+        if particao_escala is None:
+            return None
+        for particao in [p for p in self.particoes("rosters") if p >= particao_escala][:2]:
+            for _, escala, posicao in self._indice("rosters", particao).do_policial(chave):
+                if escala == mensagem_id:
+                    return self._ler_linha("rosters", particao, posicao)
+        return None
+
+    def _cadeia(self, chave: str, turno: dict) -> List[int]:
+        """
+        A escala do turno e as que ela substituiu enquanto o turno do
+        policial (data, equipe e local) ficou igual, da mais nova para a
+        mais antiga (chamar com a trava). Quem mudou na retificacao
+        recebeu uma notificacao nova: a ciencia anterior nao vale.
+        """
+        cadeia = [int(turno["mensagem_id"])]
+        while cadeia[-1] in self._anterior and len(cadeia) <= len(self._anterior):
+            anterior = self._linha_na_escala(chave, self._anterior[cadeia[-1]])
+            if anterior is None or any(anterior.get(campo) != turno.get(campo) for campo in CAMPOS_TURNO):
+                break
+            cadeia.append(self._anterior[cadeia[-1]])
+        return cadeia
+
+    def turnos_do_policial(self, nome_completo: str, chat_id: int, quantidade: int = 10,
+                           mesmo_policial: Optional[Callable[[str], bool]] = None) -> List[dict]:
+        """
+        Ultimos turnos do policial (mais recentes primeiro), com a hora
+        em que ele confirmou ciencia de cada escala. Quem confirmou a
+        escala original e ficou com o mesmo turno na retificacao
+        continua confirmado.
+
+        Args:
+            nome_completo: Nome do policial com posto (como no cadastro)
+            chat_id: Chat do policial (as confirmacoes sao por chat)
+            quantidade: Maximo de turnos
+            mesmo_policial: Diz se um nome da escala com o mesmo nome e
+                            outro posto tambem eh deste policial (a
+                            notificacao aceita a busca so pelo nome)
+
+        Returns:
+            Linhas do roster, cada uma com "confirmado_em" (ou None)
+        """
+        chave = _chave("rosters", nome_completo)
+        sufixo = " " + separar_posto(nome_completo)[1]
+        achados = []  # (dia, particao, posicao)
+
+        with self._trava:
+            self._atualizar_escalas()
+            substituidas = set(self._anterior.values())
+            # Da particao mais nova para a mais antiga, ate que as
+            # anteriores so possam ter turnos mais velhos que os achados
+            for particao in reversed(self.particoes("rosters")):
+                indice = self._indice("rosters", particao)
+                if len(achados) >= quantidade and indice.maior_dia < achados[quantidade - 1][0]:
+                    break
+                chaves = [chave] + [
+                    outra for outra in indice.entradas
+                    if outra != chave and mesmo_policial is not None
+                    and (outra == sufixo[1:] or outra.endswith(sufixo)) and mesmo_policial(outra)
+                ]
+                for outra in chaves:
+                    for dia, mensagem_id, posicao in indice.do_policial(outra):
+                        if mensagem_id not in substituidas:
+                            achados.append((dia, particao, posicao))
+                achados.sort(reverse=True)
+            achados = achados[:quantidade]
+
+            turnos = [self._ler_linha("rosters", particao, posicao) for _, particao, posicao in achados]
+
+            # A confirmacao eh gravada depois da escala: basta olhar da
+            # particao da escala mais antiga (incluindo as substituidas) em diante
+            cadeias = [self._cadeia(_chave("rosters", turno["nome_completo"]), turno) for turno in turnos]
+            confirmacoes = {}
+            if achados:
+                primeira = min(
+                    [particao for _, particao, _ in achados]
+                    + [self._particao_escala[escala] for cadeia in cadeias for escala in cadeia
+                       if escala in self._particao_escala]
+                )
+                for particao in self.particoes("confirmacoes"):
+                    if particao < primeira:
+                        continue
+                    for _, mensagem_id, posicao in self._indice("confirmacoes", particao).do_policial(str(chat_id)):
+                        confirmacoes.setdefault(mensagem_id, (particao, posicao))
+            for turno, cadeia in zip(turnos, cadeias):
+                local = next((confirmacoes[escala] for escala in cadeia if escala in confirmacoes), None)
+                turno["confirmado_em"] = (
+                    self._ler_linha("confirmacoes", *local)["confirmado_em"] if local else None
+                )
+        return turnos
+
+    def contar_turnos(self, desde: str, ate: str) -> Dict[str, int]:
+        """
+        Turnos de cada policial com dia entre desde e ate (AAAA-MM-DD),
+        sem contar escalas substituidas por retificacao. Usa so o indice;
+        particoes que ja se sabe estarem fora do periodo nem sao abertas.
+
+        Returns:
+            Dicionario nome com posto -> quantidade de turnos
+        """
+        inicio, fim = _dia_numero(desde), _dia_numero(ate)
+        contagem: Dict[str, int] = {}
+
+        with self._trava:
+            self._atualizar_escalas()
+            substituidas = set(self._anterior.values())
+            for particao in self.particoes("rosters"):
+                conhecido = self._dias.get(("rosters", particao))
+                if (conhecido and conhecido[0] == os.path.getsize(self.caminho("rosters", particao))
+                        and (conhecido[2] < inicio or conhecido[1] > fim)):
+                    continue
+                indice = self._indice("rosters", particao)
+                for chave, lista in indice.entradas.items():
+                    turnos = sum(
+                        1 for i in range(0, len(lista), 3)
+                        if inicio <= lista[i] <= fim and lista[i + 1] not in substituidas
+                    )
+                    if turnos:
+                        contagem[chave] = contagem.get(chave, 0) + turnos
+        return contagem
+
+    # ============== MANUTENCAO ==============
+
+    def _ainda_comparada(self, registro: dict, substituta: Dict[int, int]) -> bool:
+        """
+        Indica se a linha de uma escala substituida ainda eh lida pelo
+        _cadeia: o turno do policial ficou igual em todas as retificacoes
+        que vieram depois dela (chamar com a trava).
+        """
+        if not registro.get("nome_completo"):
+            return True  # fora do indice: nao da para conferir
+        chave = _chave("rosters", registro["nome_completo"])
+        escala = int(registro["mensagem_id"])
+        vistas = set()
+        while escala in substituta and escala not in vistas:
+            vistas.add(escala)
+            escala = substituta[escala]
+            nova = self._linha_na_escala(chave, escala)
+            if nova is None or any(nova.get(campo) != registro.get(campo) for campo in CAMPOS_TURNO):
+                return False
+        return True
+
+    def _remover_substituidas(self, particao: str) -> int:
+        """
+        Reescreve a particao de rosters sem as linhas de escalas
+        substituidas que nenhuma consulta le mais (chamar com a trava).
+
+        Returns:
+            Quantidade de linhas removidas
+        """
+        self._atualizar_escalas()
+        substituta = {anterior: escala for escala, anterior in self._anterior.items()}
+        if not substituta:
+            return 0
+
+        caminho = self.caminho("rosters", particao)
+        removidas = 0
+        with open(caminho, 'rb') as origem, open(caminho + ".tmp", 'wb') as destino:
+            for linha in origem:
+                if linha.endswith(b"\n"):
+                    registro = json.loads(linha)
+                    if int(registro["mensagem_id"]) in substituta and not self._ainda_comparada(registro, substituta):
+                        removidas += 1
+                        continue
+                destino.write(linha)
+
+        if removidas:
+            os.replace(caminho + ".tmp", caminho)
+        else:
+            os.remove(caminho + ".tmp")
+        return removidas
+
+    def _compactar(self, tipo: str, particao: str) -> int:
+        """
+        Tira dos rosters as linhas que ninguem le mais e grava o indice
+        da particao no disco. As linhas das escalas substituidas em que
+        o turno ficou igual continuam: o /historico compara com elas
+        para saber se a ciencia anterior continua valendo.
+
+        Returns:
+            Quantidade de linhas removidas
+        """
+        with self._trava:
+            removidas = self._remover_substituidas(particao) if tipo == "rosters" else 0
+            # O indice em memoria aponta para as posicoes do arquivo antigo
+            self._indices.pop((tipo, particao), None)
+            self._dias.pop((tipo, particao), None)
+
+            indice = IndiceParticao()
+            self._indexar(tipo, particao, indice)
+            caminho_indice = self._caminho_indice(tipo, particao)
+            with open(caminho_indice + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(indice.exportar(), f, separators=(",", ":"))
+            os.replace(caminho_indice + ".tmp", caminho_indice)
+            self._indices.pop((tipo, particao), None)
+            self._dias.pop((tipo, particao), None)
+        return removidas
+
+    def manter(self, retencao_meses: int = 0) -> Dict[str, int]:
+        """
+        Compacta as particoes fechadas ha mais de um mes (tira as linhas
+        que ninguem le mais e grava o indice) e apaga as mais antigas
+        que a retencao.
+
+        Args:
+            retencao_meses: Meses de historico mantidos alem do atual (0 = para sempre)
+
+        Returns:
+            Dicionario {"compactadas": n, "apagadas": n, "linhas_removidas": n}
+        """
+        mes = mes_atual()
+        limite_compactacao = somar_meses(mes, -1)
+        limite_retencao = somar_meses(mes, -retencao_meses) if retencao_meses else ""
+        resultado = {"compactadas": 0, "apagadas": 0, "linhas_removidas": 0}
+
+        for tipo in COLUNAS:
+            for particao in self.particoes(tipo):
+                if particao < limite_retencao:
+                    with self._trava:
+                        for caminho in (self.caminho(tipo, particao), self._caminho_indice(tipo, particao)):
+                            if os.path.exists(caminho):
+                                os.remove(caminho)
+                        self._indices.pop((tipo, particao), None)
+                        self._dias.pop((tipo, particao), None)
+                    resultado["apagadas"] += 1
+
+        for tipo in CAMPO_INDICE:
+            for particao in self.particoes(tipo):
+                if particao < limite_compactacao and not os.path.exists(self._caminho_indice(tipo, particao)):
+                    resultado["linhas_removidas"] += self._compactar(tipo, particao)
+                    resultado["compactadas"] += 1
+        return resultado
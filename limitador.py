@@ -0,0 +1,145 @@
+"""
+LIMITADOR - Controle de Excesso de Comandos
+===========================================
+Protege o bot de chats que disparam comandos sem parar
+(cliente com defeito, spam em grupo), para que o processamento
+das escalas nao fique esperando na fila.
+
+- Balde de fichas por chat e um balde global
+- Contadores do trafego descartado
+- Cache curto de respostas (ex: /status repetido)
+
+Autor: Bot Escala Militar
+"""
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class BaldeDeFichas:
+    """Token bucket simples: 'taxa' fichas por segundo, ate 'capacidade'."""
+
+    def __init__(self, taxa: float, capacidade: float):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.fichas = capacidade
+        self.atualizado = time.monotonic()
+
+    def espera(self) -> float:
+        """
+        Recarrega as fichas e informa quanto falta para ter uma.
+
+        Returns:
+            0 se ja ha ficha, ou os segundos ate a proxima
+        """
+        agora = time.monotonic()
+        self.fichas = min(self.capacidade, self.fichas + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+        if self.fichas >= 1:
+            return 0.0
+        return (1 - self.fichas) / self.taxa
+
+    def gastar(self):
+        """Consome uma ficha (chamar so depois de espera() == 0)."""
+        self.fichas -= 1
+
+
+class LimitadorComandos:
+    """
+    Decide se um comando pode ser atendido agora.
+    Guarda no maximo 'max_chats' baldes (os menos usados saem primeiro).
+    """
+
+    def __init__(self, por_minuto_chat: float = 10.0, rajada_chat: int = 5,
+                 por_segundo_global: float = 20.0, max_chats: int = 10000):
+        """
+        Args:
+            por_minuto_chat: Comandos por minuto aceitos de um mesmo chat
+            rajada_chat: Comandos seguidos aceitos de um chat
+            por_segundo_global: Comandos por segundo somando todos os chats
+            max_chats: Quantidade de chats acompanhados ao mesmo tempo
+        """
+        self.taxa_chat = por_minuto_chat / 60.0
+        self.rajada_chat = rajada_chat
+        self.max_chats = max_chats
+
+        self._balde_global = BaldeDeFichas(por_segundo_global, por_segundo_global)
+        self._baldes_chat: "OrderedDict[int, BaldeDeFichas]" = OrderedDict()
+        self._avisados = set()  # chats que ja receberam o aviso de espera
+
+        self.contadores = {
+            "aceitos": 0,
+            "descartados_chat": 0,
+            "descartados_global": 0,
+        }
+
+    def permitir(self, chat_id: int) -> Optional[str]:
+        """
+        Verifica os limites do chat e o global.
+
+        Returns:
+            None se pode atender, ou o motivo do descarte ("chat" ou "global")
+        """
+        balde = self._baldes_chat.get(chat_id)
+        if balde is None:
+            balde = BaldeDeFichas(self.taxa_chat, self.rajada_chat)
+            self._baldes_chat[chat_id] = balde
+            if len(self._baldes_chat) > self.max_chats:
+                antigo, _ = self._baldes_chat.popitem(last=False)
+                self._avisados.discard(antigo)
+        else:
+            self._baldes_chat.move_to_end(chat_id)
+
+        if balde.espera():
+            self.contadores["descartados_chat"] += 1
+            return "chat"
+        if self._balde_global.espera():
+            self.contadores["descartados_global"] += 1
+            return "global"
+
+        balde.gastar()
+        self._balde_global.gastar()
+        self._avisados.discard(chat_id)
+        self.contadores["aceitos"] += 1
+        return None
+
+    def primeiro_descarte(self, chat_id: int) -> bool:
+        """
+        Indica se o chat ainda nao foi avisado para esperar
+        (avisa uma vez so, ate o chat voltar a ser atendido).
+        """
+        if chat_id in self._avisados:
+            return False
+        self._avisados.add(chat_id)
+        return True
+
+
+class CacheRespostas:
+    """Cache de respostas com validade curta e tamanho maximo."""
+
+    def __init__(self, validade: float = 60.0, max_itens: int = 10000):
+        self.validade = validade
+        self.max_itens = max_itens
+        self._itens: "OrderedDict[object, tuple]" = OrderedDict()  # chave -> (expira, valor)
+        self.acertos = 0
+
+    def obter(self, chave):
+        """Retorna o valor guardado ou None se nao existe ou venceu."""
+        item = self._itens.get(chave)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del self._itens[chave]
+            return None
+        self.acertos += 1
+        return item[1]
+
+    def guardar(self, chave, valor):
+        self._itens[chave] = (time.monotonic() + self.validade, valor)
+        self._itens.move_to_end(chave)
+        if len(self._itens) > self.max_itens:
+            self._itens.popitem(last=False)
+
+    def invalidar(self, chave):
+        self._itens.pop(chave, None)
@@ -0,0 +1,267 @@
+"""
+NOTIFICACOES - Fila de Envio Agrupado
+=====================================
+Este modulo junta as notificacoes destinadas ao mesmo policial
+que chegam em sequencia (ex: varios PDFs postados em um minuto)
+e envia uma unica mensagem com todas as escalas.
+
+Cada escala continua com seu proprio botao de confirmacao.
+Uma mensagem leva ate MAX_AVISOS_POR_MENSAGEM escalas, sem passar
+do limite de texto do Telegram (LIMITE_TEXTO); o resto vai na seguinte.
+Os envios (e as edicoes das mensagens confirmadas) passam pelo
+mesmo limitador de taxa, para respeitar o controle de flood do Telegram.
+
+Autor: Bot Escala Militar
+"""
+
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+
+class FilaNotificacoes:
+    """
+    Agrupa notificacoes por chat durante uma janela curta e envia
+    tudo em uma so mensagem, com limite de mensagens por segundo.
+    """
+
+    # Quantidade maxima de escalas em uma mesma mensagem
+    MAX_AVISOS_POR_MENSAGEM = 10
+
+    # Tamanho maximo do texto de uma mensagem no Telegram
+    LIMITE_TEXTO = 4096
+
+    # Segundos que um envio ou uma edicao insiste com o Telegram pedindo para esperar
+    PRAZO_ESPERA = 600.0
+
+    def __init__(self, janela: float = 30.0, mensagens_por_segundo: float = 25.0):
+        """
+        Args:
+            janela: Segundos que o primeiro aviso espera por outros do mesmo chat
+            mensagens_por_segundo: Limite global de envios
+        """
+        self.janela = janela
+        self.intervalo_envio = 1.0 / mensagens_por_segundo
+
+        self._pendentes: Dict[int, List[dict]] = {}  # chat_id -> avisos
+        self._tarefas = set()
+        self._bot = None
+        self._trava_envio = asyncio.Lock()
+        self._ultimo_envio = 0.0
+
+    async def enfileirar(self, bot, chat_id: int, aviso: dict):
+        """
+        Coloca um aviso na fila do chat.
+
+        Args:
+            bot: Bot do Telegram usado para enviar
+            chat_id: Chat do policial
+            aviso: Dicionario com 'texto' e, opcionalmente,
+                   'botao' (texto do botao quando ha varias escalas),
+                   'callback_data' e 'ao_falhar' (funcao chamada com o
+                   chat_id se o Telegram recusar a mensagem de vez)
+        """
+        self._bot = bot
+
+        if chat_id in self._pendentes:
+            self._pendentes[chat_id].append(aviso)
+            return
+
+        # Primeiro aviso do chat: agenda o envio para o fim da janela
+        self._pendentes[chat_id] = [aviso]
+        tarefa = asyncio.create_task(self._enviar_depois(chat_id))
+        self._tarefas.add(tarefa)
+        tarefa.add_done_callback(self._tarefas.discard)
+
+    async def _enviar_depois(self, chat_id: int):
+        """Espera a janela e envia tudo que acumulou para o chat."""
+        await asyncio.sleep(self.janela)
+        avisos = self._pendentes.pop(chat_id, [])
+        # O envio ja retirou os avisos da fila: nao pode ser cancelado no meio
+        await asyncio.shield(self._enviar_avisos(chat_id, avisos))
+
+    async def esvaziar(self):
+        """Envia imediatamente tudo que esta pendente (usado ao desligar)."""
+        for tarefa in list(self._tarefas):
+            tarefa.cancel()
+        pendentes, self._pendentes = self._pendentes, {}
+        for chat_id, avisos in pendentes.items():
+            await self._enviar_avisos(chat_id, avisos)
+
+    async def _enviar_avisos(self, chat_id: int, avisos: List[dict]):
+        """Divide os avisos em mensagens e envia cada uma."""
+        for lote in self.dividir_em_lotes(avisos):
+            texto, reply_markup = self.montar_mensagem(lote)
+
+            def ao_recusar(lote=lote):
+                for aviso in lote:
+                    if aviso.get('ao_falhar'):
+                        aviso['ao_falhar'](chat_id)
+
+            await self.enviar(chat_id, texto, reply_markup, ao_recusar)
+
+    @staticmethod
+    def tamanho_texto(texto: str) -> int:
+        """Tamanho como o Telegram conta (em UTF-16: um emoji pode valer 2)."""
+        return len(texto.encode('utf-16-le')) // 2
+
+    @classmethod
+    def dividir_em_lotes(cls, avisos: List[dict]) -> List[List[dict]]:
+        """
+        Divide os avisos em mensagens de ate MAX_AVISOS_POR_MENSAGEM escalas
+        cujo texto montado (com cabecalho e separadores) cabe em LIMITE_TEXTO.
+        O texto eh medido com a marcacao do Markdown, que o Telegram tira:
+        a mensagem entregue fica sempre menor que a medida.
+        """
+        lotes = []
+        lote: List[dict] = []
+        for aviso in avisos:
+            if lote and (
+                len(lote) == cls.MAX_AVISOS_POR_MENSAGEM
+                or cls.tamanho_texto(cls.montar_mensagem(lote + [aviso])[0]) > cls.LIMITE_TEXTO
+            ):
+                lotes.append(lote)
+                lote = []
+            lote.append(aviso)
+        if lote:
+            lotes.append(lote)
+        return lotes
+
+    @classmethod
+    def _cortar(cls, texto: str) -> str:
+        """Corta um aviso maior que LIMITE_TEXTO no fim de uma linha (sem quebrar o Markdown)."""
+        if cls.tamanho_texto(texto) <= cls.LIMITE_TEXTO:
+            return texto
+        while cls.tamanho_texto(texto) > cls.LIMITE_TEXTO - 2:
+            fim = texto.rfind("\n")
+            texto = texto[:fim] if fim > 0 else texto[:len(texto) * 3 // 4]
+        return texto + "\n…"
+
+    @classmethod
+    def montar_mensagem(cls, avisos: List[dict]):
+        """
+        Junta varios avisos em um texto e um teclado com um botao por escala.
+
+        Returns:
+            Tupla (texto, reply_markup)
+        """
+        if len(avisos) == 1:
+            texto = cls._cortar(avisos[0]['texto'])
+        else:
+            texto = f"📬 *Voce tem {len(avisos)} avisos de escala*\n\n"
+            texto += "\n\n➖➖➖➖➖\n\n".join(aviso['texto'] for aviso in avisos)
+
+        com_botao = [aviso for aviso in avisos if aviso.get('callback_data')]
+        botoes = [
+            # Com um botao so, nao precisa dizer a qual escala ele se refere
+            [InlineKeyboardButton(
+                "✅ CONFIRMAR CIENCIA" if len(com_botao) == 1 else aviso['botao'],
+                callback_data=aviso['callback_data']
+            )]
+            for aviso in com_botao
+        ]
+        reply_markup = InlineKeyboardMarkup(botoes) if botoes else None
+
+        return texto, reply_markup
+
+    async def _aguardar_vez(self):
+        """Espaca os envios para nao passar do limite global."""
+        async with self._trava_envio:
+            espera = self._ultimo_envio + self.intervalo_envio - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            self._ultimo_envio = time.monotonic()
+
+    async def enviar(self, chat_id: int, texto: str,
+                     reply_markup: Optional[InlineKeyboardMarkup] = None,
+                     ao_recusar: Optional[Callable[[], None]] = None) -> bool:
+        """
+        Envia uma mensagem respeitando o limite de taxa.
+        Se o Telegram pedir para esperar (RetryAfter), espera e tenta de
+        novo ate passar PRAZO_ESPERA segundos.
+
+        Args:
+            ao_recusar: Chamada so quando o Telegram recusa a mensagem de vez
+                        (bot bloqueado, chat invalido). Flood ou erro de rede
+                        nao chamam: o policial continua pendente e o lembrete
+                        tenta de novo.
+
+        Returns:
+            True se a mensagem foi enviada
+        """
+        prazo = time.monotonic() + self.PRAZO_ESPERA
+        tentativa = 0
+        while True:
+            tentativa += 1
+            await self._aguardar_vez()
+            try:
+                await self._bot.send_message(
+                    chat_id=chat_id,
+                    text=texto,
+                    parse_mode='Markdown',
+                    reply_markup=reply_markup
+                )
+                return True
+            except RetryAfter as e:
+                if time.monotonic() + e.retry_after > prazo:
+                    logger.error(f"Desistindo de notificar chat {chat_id} apos {tentativa} tentativas "
+                                 f"({self.PRAZO_ESPERA:.0f}s)")
+                    return False
+                logger.warning(f"Flood control para {chat_id}: aguardando {e.retry_after}s "
+                               f"(tentativa {tentativa})")
+                await asyncio.sleep(e.retry_after)
+            except (Forbidden, BadRequest) as e:
+                logger.error(f"Telegram recusou a notificacao do chat {chat_id}: {e}")
+                if ao_recusar:
+                    ao_recusar()
+                return False
+            except Exception as e:
+                logger.error(f"Erro ao notificar chat {chat_id}: {e}")
+                return False
+
+    async def editar(self, bot, chat_id: int, mensagem_id: int, texto: str,
+                     reply_markup: Optional[InlineKeyboardMarkup] = None) -> bool:
+        """
+        Edita uma mensagem ja enviada, no mesmo ritmo dos envios.
+        A edicao mostra algo que ja foi gravado (ex: a ciencia confirmada):
+        como no envio, tenta de novo a cada RetryAfter ate passar
+        PRAZO_ESPERA segundos.
+
+        Returns:
+            True se a mensagem foi editada
+        """
+        prazo = time.monotonic() + self.PRAZO_ESPERA
+        tentativa = 0
+        while True:
+            tentativa += 1
+            await self._aguardar_vez()
+            try:
+                await bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=mensagem_id,
+                    text=texto,
+                    parse_mode='Markdown',
+                    reply_markup=reply_markup
+                )
+                return True
+            except RetryAfter as e:
+                if time.monotonic() + e.retry_after > prazo:
+                    logger.error(f"Desistindo de editar a mensagem {mensagem_id} do chat {chat_id} "
+                                 f"apos {tentativa} tentativas ({self.PRAZO_ESPERA:.0f}s)")
+                    return False
+                logger.warning(f"Flood control ao editar no chat {chat_id}: aguardando {e.retry_after}s "
+                               f"(tentativa {tentativa})")
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                # Ex: a mensagem ja estava editada (clique repetido)
+                logger.warning(f"Mensagem {mensagem_id} do chat {chat_id} nao foi editada: {e}")
+                return False
+            except TelegramError as e:
+                logger.error(f"Erro ao editar a mensagem {mensagem_id} do chat {chat_id}: {e}")
+                return False
@@ -2,24 +2,53 @@
 PDF PARSER - Leitor de Escalas Militares
 =====================================
 Este modulo eh responsavel por extrair os nomes dos policiais
-de arquivos PDF, sejam eles digitais ou escaneados (OCR).
+de arquivos PDF, sejam eles digitais ou escaneados (OCR),
+e de fotos/imagens da escala (direto no OCR).
 
 Autor: Bot Escala Militar
 Versao: 1.0
 """
 
+import os
 import re
 import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import List, Optional
 
-# Tentativa de importar bibliotecas de OCR (para PDFs escaneados)
+# Tentativa de importar bibliotecas de OCR (para PDFs escaneados e fotos)
+try:
+    from PIL import Image, ImageOps
+    IMAGEM_DISPONIVEL = True
+except ImportError:
+    IMAGEM_DISPONIVEL = False
+
 try:
-    import pytesseract
     from pdf2image import convert_from_path
-    from PIL import Image
-    OCR_DISPONIVEL = True
+    RASTERIZACAO_DISPONIVEL = IMAGEM_DISPONIVEL
+except ImportError:
+    RASTERIZACAO_DISPONIVEL = False
+
+try:
+    import pytesseract
+    PYTESSERACT_DISPONIVEL = True
 except ImportError:
-    OCR_DISPONIVEL = False
+    PYTESSERACT_DISPONIVEL = False
+
+# Binding do Tesseract dentro do processo (opcional).
+# Evita abrir um processo "tesseract" por pagina e recarregar o modelo toda vez.
+try:
+    import tesserocr
+    TESSEROCR_DISPONIVEL = True
+except ImportError:
+    TESSEROCR_DISPONIVEL = False
+
+# Fotos vao direto para o OCR (nao precisam do pdf2image)
+OCR_IMAGEM_DISPONIVEL = IMAGEM_DISPONIVEL and (PYTESSERACT_DISPONIVEL or TESSEROCR_DISPONIVEL)
+OCR_DISPONIVEL = RASTERIZACAO_DISPONIVEL and OCR_IMAGEM_DISPONIVEL
+if not OCR_DISPONIVEL:
     logging.warning("OCR nao disponivel. PDFs escaneados nao serao processados.")
 
 # Importar leitor de PDF digital
@@ -37,6 +66,26 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# ============== MOTOR OCR DOS WORKERS ==============
+# Cada processo do pool guarda sua propria instancia do Tesseract.
+# O modelo do idioma eh carregado uma unica vez, quando o worker nasce,
+# e as imagens chegam pela memoria (sem arquivos temporarios).
+
+_motor_worker = None
+
+
+def _iniciar_worker_ocr(idioma: str):
+    """Cria o motor Tesseract do worker (roda uma vez por processo)."""
+    global _motor_worker
+    _motor_worker = tesserocr.PyTessBaseAPI(lang=idioma)
+
+
+def _reconhecer_no_worker(imagem) -> str:
+    """Faz o OCR de uma imagem usando o motor ja carregado do worker."""
+    _motor_worker.SetImage(imagem)
+    return _motor_worker.GetUTF8Text()
+
+
 class PDFParser:
     """
     Classe responsavel por extrair texto de PDFs e identificar nomes de policiais.
@@ -50,11 +99,106 @@ class PDFParser:
         r'CB\b', r'SD\b', r'SD\s*EV\b', r'SD\s*EP\b'
     ]
     
-    def __init__(self):
-        """Inicializa o parser com os padroes de postos."""
+    # Idioma usado pelo Tesseract
+    IDIOMA_OCR = 'por'
+    
+    # Cada worker carrega o modelo do idioma de novo: poucos bastam
+    WORKERS_OCR_PADRAO = 2
+    
+    def __init__(self, motor_ocr: str = "auto", workers_ocr: Optional[int] = None):
+        """
+        Inicializa o parser com os padroes de postos.
+        
+        Args:
+            motor_ocr: "tesserocr" (motor em processo, reutilizado),
+                       "pytesseract" (um subprocesso por pagina) ou
+                       "auto" (tesserocr se estiver instalado)
+            workers_ocr: Quantidade de processos do pool de OCR
+                         (padrao: WORKERS_OCR_PADRAO, limitado aos nucleos)
+        """
         # Cria uma regex unica combinando todos os postos
         self.regex_postos = r'(?:' + '|'.join(self.POSTOS_GRADUACOES) + r')'
-        logger.info("PDF Parser inicializado com sucesso!")
+        
+        # Regex compiladas uma vez (usadas em cada linha do documento)
+        self._regex_policial = re.compile(r'(' + self.regex_postos + r')\s+([A-Z\s]+?)(?:;|,|\.|$)')
+        self._regex_equipe = re.compile(r'^(?:EQUIPE|GUARNI[CÇ][AÃ]O|TURNO|SETOR|VIATURA|VTR)\b')
+        # Posto seguido de nome: onde termina um cabecalho sem ":"
+        self._regex_inicio_policial = re.compile(r'\b' + self.regex_postos + r'\s+[A-Z]')
+        self._regex_local = re.compile(r'^LOCAL\s*:\s*(.+)$')
+        
+        # Escolhe o motor de OCR (com fallback para o pytesseract)
+        motor_ocr = (motor_ocr or "auto").lower()
+        if motor_ocr in ("auto", "tesserocr") and TESSEROCR_DISPONIVEL:
+            self.motor_ocr = "tesserocr"
+        else:
+            if motor_ocr == "tesserocr":
+                logger.warning("tesserocr nao instalado. Usando pytesseract.")
+            self.motor_ocr = "pytesseract"
+        
+        self.workers_ocr = workers_ocr or min(self.WORKERS_OCR_PADRAO, os.cpu_count() or 1)
+        self._pool_ocr = None
+        # Escalas escaneadas chegam em threads diferentes (asyncio.to_thread)
+        self._trava_pool = threading.Lock()
+        
+        logger.info(f"PDF Parser inicializado com sucesso! (OCR: {self.motor_ocr})")
+    
+    def _obter_pool_ocr(self) -> ProcessPoolExecutor:
+        """
+        Cria (uma vez) o pool de workers com os motores Tesseract carregados.
+        Os workers nascem por "spawn": o bot tem varias threads, e um fork
+        copiaria travas que outra thread estivesse segurando.
+        """
+        with self._trava_pool:
+            if self._pool_ocr is None:
+                logger.info(f"Iniciando pool de OCR com {self.workers_ocr} worker(s)...")
+                self._pool_ocr = ProcessPoolExecutor(
+                    max_workers=self.workers_ocr,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_iniciar_worker_ocr,
+                    initargs=(self.IDIOMA_OCR,)
+                )
+            return self._pool_ocr
+    
+    def _desistir_do_pool(self, pool: ProcessPoolExecutor):
+        """
+        Depois que o pool quebra (ex: falta o traineddata do idioma),
+        passa a usar o pytesseract de vez, em vez de recriar o pool a cada escala.
+        """
+        with self._trava_pool:
+            if self._pool_ocr is pool:
+                self._pool_ocr = None
+                pool.shutdown(wait=False)
+            self.motor_ocr = "pytesseract"
+    
+    def encerrar(self):
+        """Finaliza o pool de OCR (libera os processos dos workers)."""
+        with self._trava_pool:
+            pool, self._pool_ocr = self._pool_ocr, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+    
+    def reconhecer_imagens(self, imagens: list) -> List[str]:
+        """
+        Executa o OCR em uma lista de imagens (PIL), mantendo a ordem.
+        
+        Args:
+            imagens: Lista de imagens ja carregadas na memoria
+            
+        Returns:
+            Lista com o texto reconhecido de cada imagem
+        """
+        if self.motor_ocr == "tesserocr":
+            pool = self._obter_pool_ocr()
+            try:
+                return list(pool.map(_reconhecer_no_worker, imagens))
+            except BrokenProcessPool as erro:
+                logger.error(f"Pool de OCR falhou: {erro}")
+                if not PYTESSERACT_DISPONIVEL:
+                    raise
+                self._desistir_do_pool(pool)
+                logger.warning("OCR passa a usar o pytesseract ate o bot reiniciar.")
+        
+        return [pytesseract.image_to_string(imagem, lang=self.IDIOMA_OCR) for imagem in imagens]
     
     def extrair_texto_pdf_digital(self, caminho_pdf: str) -> str:
         """
@@ -113,11 +257,11 @@ class PDFParser:
             # Converte PDF em lista de imagens (uma por pagina)
             imagens = convert_from_path(caminho_pdf, dpi=300)
             
-            logger.info(f"Processando {len(imagens)} pagina(s) com OCR...")
+            logger.info(f"Processando {len(imagens)} pagina(s) com OCR ({self.motor_ocr})...")
+            
+            textos = self.reconhecer_imagens(imagens)
             
-            for numero_pagina, imagem in enumerate(imagens, 1):
-                # Configuracao do Tesseract para portugues
-                texto_pagina = pytesseract.image_to_string(imagem, lang='por')
+            for numero_pagina, texto_pagina in enumerate(textos, 1):
                 texto_completo += texto_pagina + "\n"
                 logger.debug(f"OCR - Pagina {numero_pagina}: {len(texto_pagina)} caracteres reconhecidos")
                 
@@ -127,6 +271,30 @@ class PDFParser:
         
         return texto_completo
     
+    def extrair_texto_imagens(self, caminhos_imagens: List[str]) -> str:
+        """
+        Extrai texto de fotos/imagens da escala (PNG, JPEG...) com OCR.
+        As imagens vao direto para o OCR, sem passar por PDF.
+        
+        Args:
+            caminhos_imagens: Caminhos das imagens, na ordem das paginas
+            
+        Returns:
+            String com o texto de todas as imagens
+        """
+        if not OCR_IMAGEM_DISPONIVEL:
+            raise ImportError("Bibliotecas de OCR nao instaladas (Pillow + Tesseract)!")
+        
+        imagens = []
+        for caminho in caminhos_imagens:
+            with Image.open(caminho) as imagem:
+                # Fotos de celular vem "deitadas" com a rotacao no EXIF
+                imagem = ImageOps.exif_transpose(imagem)
+                imagens.append(imagem.convert("L"))
+        
+        logger.info(f"Processando {len(imagens)} imagem(ns) com OCR ({self.motor_ocr})...")
+        return "\n".join(self.reconhecer_imagens(imagens))
+    
     def extrair_texto(self, caminho_pdf: str, usar_ocr: bool = False) -> str:
         """
         Metodo principal para extrair texto de um PDF.
@@ -175,72 +343,163 @@ class PDFParser:
             
         Returns:
             Lista de dicionarios com 'posto' e 'nome' de cada policial
+            (e tambem 'data', 'equipe' e 'local' onde ele aparece primeiro)
         """
-        policiais_encontrados = []
+        return self.estruturar_escala(texto)['policiais']
+    
+    def separar_posto(self, nome_completo: str) -> tuple:
+        """
+        Separa o posto/graduacao do nome (ex: "SUB TEN SILVA" -> ("SUB TEN", "SILVA")).
         
-        # Normaliza o texto: remove acentos, converte para maiusculas
-        texto = texto.upper()
+        Returns:
+            Tupla (posto, nome); posto vazio se nao reconhecido
+        """
+        return separar_posto(nome_completo)
+    
+    def estruturar_escala(self, texto: str) -> dict:
+        """
+        Le o texto linha a linha (uma unica passada) e monta a escala
+        estruturada: data -> equipe/local -> policiais.
         
-        # Substitui quebras de linha por espacos para facilitar
-        texto = texto.replace('\n', ' ')
+        Linhas com data (ex: "DIA 15/01/2024") abrem uma nova data,
+        cabecalhos como "EQUIPE ALFA:" ou "VIATURA 1234 - SD JOAO"
+        abrem uma nova equipe (os nomes apos o cabecalho contam) e
+        "LOCAL: ..." define o local da equipe atual.
         
-        # Remove espacos multiplos
-        texto = re.sub(r'\s+', ' ', texto)
+        Args:
+            texto: Texto extraido do PDF
+            
+        Returns:
+            Dicionario com:
+            - 'data': primeira data encontrada (DD/MM/AAAA) ou None
+            - 'equipes': lista de blocos {'data', 'equipe', 'local', 'policiais'}
+            - 'policiais': lista sem repeticao (mesmo formato de identificar_nomes)
+        """
+        data_atual = None
+        equipe_atual = None
+        local_atual = None
+        primeira_data = None
         
-        # Padrao para encontrar: POSTO + NOME (ate o proximo ponto, virgula, ponto-e-virgula ou fim)
-        # Exemplo: "SD JOAO VICTOR; SGT FIALHO; SUB TEN SILVA"
-        padrao = r'(' + self.regex_postos + r')\s+([A-Z\s]+?)(?:;|,|\.|\n|$)'
+        equipes = []
+        bloco = None
+        policiais_unicos = []
+        vistos = set()
         
-        # Busca todas as ocorrencias
-        matches = re.findall(padrao, texto)
+        # Ignora se parece ser parte de outro texto (contem palavras comuns)
+        palavras_invalidas = ['ESCALA', 'PLANTAO', 'DATA', 'HORA', 'LOCAL', 'SERVICO']
         
-        for match in matches:
-            posto = match[0].strip()
-            nome = match[1].strip()
+        for linha in texto.upper().split('\n'):
+            # Remove espacos multiplos
+            linha = ' '.join(linha.split())
+            if not linha:
+                continue
             
-            # Limpa o nome (remove espacos extras)
-            nome = ' '.join(nome.split())
+            # Data: abre uma nova secao da escala
+            data = self.identificar_data_escala(linha)
+            if data:
+                data_atual = data
+                primeira_data = primeira_data or data
+                equipe_atual = local_atual = None
+                bloco = None
             
-            # Ignora nomes muito curtos (provavelmente falso positivo)
-            if len(nome) < 2:
-                continue
-                
-            # Ignora se parece ser parte de outro texto (contem palavras comuns)
-            palavras_invalidas = ['ESCALA', 'PLANTAO', 'DATA', 'HORA', 'LOCAL', 'SERVICO']
-            if any(palavra in nome for palavra in palavras_invalidas):
+            # Local da equipe atual
+            encontrado = self._regex_local.match(linha)
+            if encontrado:
+                local_atual = encontrado.group(1).strip(' .;')
+                if bloco is not None:
+                    bloco['local'] = local_atual
                 continue
             
-            policiais_encontrados.append({
-                'posto': posto,
-                'nome': nome,
-                'nome_completo': f"{posto} {nome}"
-            })
+            # Cabecalho de equipe (os nomes podem vir na mesma linha): termina no
+            # ":" ou, sem ":", no primeiro posto (ex: "VIATURA 1234 - SD JOAO")
+            encontrado = self._regex_equipe.match(linha)
+            if encontrado:
+                cabecalho, dois_pontos, resto = linha.partition(':')
+                if not dois_pontos:
+                    policial = self._regex_inicio_policial.search(linha, encontrado.end())
+                    corte = policial.start() if policial else len(linha)
+                    cabecalho, resto = linha[:corte], linha[corte:]
+                equipe_atual = cabecalho.strip(' -;,.')
+                local_atual = None
+                bloco = None
+                linha = resto
             
-            logger.info(f"Policial identificado: {posto} {nome}")
-        
-        # Remove duplicatas mantendo a ordem
-        vistos = set()
-        policiais_unicos = []
-        for policial in policiais_encontrados:
-            chave = policial['nome_completo']
-            if chave not in vistos:
-                vistos.add(chave)
-                policiais_unicos.append(policial)
+            # Padrao para encontrar: POSTO + NOME (ate o proximo ponto, virgula, ponto-e-virgula ou fim da linha)
+            # Exemplo: "SD JOAO VICTOR; SGT FIALHO; SUB TEN SILVA"
+            for match in self._regex_policial.findall(linha):
+                posto = match[0].strip()
+                
+                # Limpa o nome (remove espacos extras)
+                nome = ' '.join(match[1].split())
+                
+                # Ignora nomes muito curtos (provavelmente falso positivo)
+                if len(nome) < 2:
+                    continue
+                
+                if any(palavra in nome for palavra in palavras_invalidas):
+                    continue
+                
+                nome_completo = f"{posto} {nome}"
+                
+                if bloco is None:
+                    bloco = {
+                        'data': data_atual,
+                        'equipe': equipe_atual,
+                        'local': local_atual,
+                        'policiais': []
+                    }
+                    equipes.append(bloco)
+                if nome_completo not in bloco['policiais']:
+                    bloco['policiais'].append(nome_completo)
+                
+                # Remove duplicatas mantendo a ordem
+                if nome_completo in vistos:
+                    continue
+                vistos.add(nome_completo)
+                policiais_unicos.append({
+                    'posto': posto,
+                    'nome': nome,
+                    'nome_completo': nome_completo,
+                    'data': data_atual,
+                    'equipe': equipe_atual,
+                    'local': local_atual
+                })
+                
+                logger.info(f"Policial identificado: {nome_completo}")
         
         logger.info(f"Total de policiais identificados: {len(policiais_unicos)}")
-        return policiais_unicos
+        return {
+            'data': primeira_data,
+            'equipes': equipes,
+            'policiais': policiais_unicos
+        }
     
-    def processar_pdf(self, caminho_pdf: str, usar_ocr: bool = False) -> List[dict]:
+    def identificar_data_escala(self, texto: str) -> Optional[str]:
         """
-        Metodo principal que processa um PDF completo.
-        Extrai o texto e identifica os policiais.
+        Procura a data da escala no texto (ex: "ESCALA DE SERVICO - DIA 15/01/2024").
+        
+        Args:
+            texto: Texto extraido do PDF
+            
+        Returns:
+            Data no formato DD/MM/AAAA ou None se nao encontrada
+        """
+        encontrado = re.search(r'\b(\d{1,2})/(\d{1,2})/(\d{4})\b', texto)
+        if not encontrado:
+            return None
+        dia, mes, ano = encontrado.groups()
+        return f"{int(dia):02d}/{int(mes):02d}/{ano}"
+    
+    def extrair_escala(self, caminho_pdf: str, usar_ocr: bool = False) -> dict:
+        """
+        Processa um PDF e devolve a escala estruturada.
         
         Args:
             caminho_pdf: Caminho para o arquivo PDF
             usar_ocr: Forca o uso de OCR
             
         Returns:
-            Lista de dicionarios com informacoes dos policiais
+            Dicionario com 'data', 'equipes' e 'policiais' (ver estruturar_escala)
         """
         logger.info(f"Iniciando processamento do PDF: {caminho_pdf}")
         
@@ -250,10 +509,47 @@ class PDFParser:
         logger.debug(f"Texto extraido ({len(texto)} caracteres):")
         logger.debug(texto[:500] + "..." if len(texto) > 500 else texto)
         
-        # Identifica os nomes dos policiais
-        policiais = self.identificar_nomes(texto)
+        return self.estruturar_escala(texto)
+    
+    def extrair_escala_de_imagens(self, caminhos_imagens: List[str]) -> dict:
+        """
+        Processa as fotos de uma escala (uma ou varias paginas)
+        e devolve a escala estruturada, como extrair_escala.
+        """
+        logger.info(f"Iniciando processamento de {len(caminhos_imagens)} imagem(ns)")
+        return self.estruturar_escala(self.extrair_texto_imagens(caminhos_imagens))
+    
+    def processar_pdf(self, caminho_pdf: str, usar_ocr: bool = False) -> List[dict]:
+        """
+        Metodo principal que processa um PDF completo.
+        Extrai o texto e identifica os policiais.
         
-        return policiais
+        Args:
+            caminho_pdf: Caminho para o arquivo PDF
+            usar_ocr: Forca o uso de OCR
+            
+        Returns:
+            Lista de dicionarios com informacoes dos policiais
+        """
+        return self.extrair_escala(caminho_pdf, usar_ocr)['policiais']
+
+
+# Regex do posto no inicio do nome (compartilhada com o cadastro de policiais)
+_REGEX_POSTO_INICIAL = re.compile(r'((?:' + '|'.join(PDFParser.POSTOS_GRADUACOES) + r'))\s+')
+
+
+def separar_posto(nome_completo: str) -> tuple:
+    """
+    Separa o posto/graduacao do nome (ex: "SUB TEN SILVA" -> ("SUB TEN", "SILVA")).
+    
+    Returns:
+        Tupla (posto, nome); posto vazio se nao reconhecido
+    """
+    nome_completo = ' '.join(nome_completo.upper().split())
+    encontrado = _REGEX_POSTO_INICIAL.match(nome_completo)
+    if not encontrado:
+        return "", nome_completo
+    return encontrado.group(1).strip(), nome_completo[encontrado.end():].strip()
 
 
 # Teste rapido (executar apenas se rodar este arquivo diretamente)
@@ -0,0 +1,188 @@
+"""
+REGISTRO DE POLICIAIS - Cadastro Compacto em Memoria
+====================================================
+Guarda os policiais cadastrados de forma enxuta, para aguentar
+dezenas de milhares de cadastros (ex: um estado inteiro).
+
+- Cada policial eh um objeto com __slots__ (sem dicionario por objeto)
+- O posto/graduacao eh "internado": todos os "SD" sao a mesma string
+- chat_id eh inteiro e a data de cadastro eh um timestamp (epoch)
+- O nome completo nao eh guardado: eh montado com posto + nome
+
+No arquivo, cada policial vira uma linha [posto, nome, chat_id, cadastro].
+Cadastros no formato antigo (dicionario por nome) sao convertidos ao carregar.
+
+Autor: Bot Escala Militar
+"""
+
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Union
+
+from pdf_parser import separar_posto
+
+
+class Policial:
+    """Um policial cadastrado."""
+
+    __slots__ = ('posto', 'nome', 'chat_id', 'cadastro')
+
+    def __init__(self, posto: str, nome: str, chat_id: int, cadastro: int):
+        self.posto = posto
+        self.nome = nome
+        self.chat_id = chat_id
+        self.cadastro = cadastro  # epoch (segundos)
+
+    @property
+    def nome_completo(self) -> str:
+        """Nome como aparece na escala (ex: "SD JOAO VICTOR")."""
+        return f"{self.posto} {self.nome}" if self.posto else self.nome
+
+    @property
+    def data_cadastro(self) -> datetime:
+        return datetime.fromtimestamp(self.cadastro)
+
+
+class RegistroPoliciais:
+    """
+    Cadastro de policiais com busca O(1) por nome e por chat_id.
+
+    O indice por nome usa o nome SEM posto, assim a mesma estrutura
+    atende a busca exata (posto + nome) e a busca so pelo nome.
+    Quando dois policiais tem o mesmo nome (ex: "SD SILVA" e "CB SILVA"),
+    o indice guarda uma tupla com os dois.
+
+    Cada chat tem no maximo um cadastro (o /status, o /recomecar e a
+    confirmacao de ciencia sao por chat).
+    """
+
+    def __init__(self):
+        self._por_nome: Dict[str, Union[Policial, tuple]] = {}
+        self._por_chat: Dict[int, Policial] = {}
+        self._total = 0
+
+    def __len__(self) -> int:
+        return self._total
+
+    def __iter__(self) -> Iterator[Policial]:
+        for item in self._por_nome.values():
+            if isinstance(item, tuple):
+                yield from item
+            else:
+                yield item
+
+    # ============== CONSULTAS ==============
+
+    def _candidatos(self, nome: str) -> tuple:
+        item = self._por_nome.get(nome)
+        if item is None:
+            return ()
+        return item if isinstance(item, tuple) else (item,)
+
+    def buscar(self, nome_completo: str) -> Optional[Policial]:
+        """
+        Busca pelo nome como aparece na escala.
+        Tenta primeiro posto + nome; se nao achar, aceita so o nome.
+        """
+        posto, nome = separar_posto(nome_completo)
+        candidatos = self._candidatos(nome)
+        for policial in candidatos:
+            if policial.posto == posto:
+                return policial
+        return candidatos[0] if candidatos else None
+
+    def buscar_exato(self, nome_completo: str) -> Optional[Policial]:
+        """Busca exigindo o mesmo posto e o mesmo nome."""
+        posto, nome = separar_posto(nome_completo)
+        for policial in self._candidatos(nome):
+            if policial.posto == posto:
+                return policial
+        return None
+
+    def buscar_por_chat(self, chat_id: int) -> Optional[Policial]:
+        return self._por_chat.get(chat_id)
+
+    # ============== ALTERACOES ==============
+
+    def adicionar(self, nome_completo: str, chat_id: int, cadastro: Optional[float] = None) -> Optional[Policial]:
+        """
+        Cadastra um policial.
+
+        Returns:
+            O novo registro, ou None se o nome (com posto) ja existia
+            ou se o chat ja tem cadastro
+        """
+        posto, nome = separar_posto(nome_completo)
+        return self._inserir(posto, nome, chat_id, time.time() if cadastro is None else cadastro)
+
+    def _inserir(self, posto: str, nome: str, chat_id: int, cadastro: float) -> Optional[Policial]:
+        """Insere nos indices um policial com posto e nome ja separados."""
+        if int(chat_id) in self._por_chat:
+            return None
+        atual = self._por_nome.get(nome)
+        candidatos = () if atual is None else atual if isinstance(atual, tuple) else (atual,)
+        for existente in candidatos:
+            if existente.posto == posto:
+                return None
+
+        policial = Policial(sys.intern(posto), nome, int(chat_id), int(cadastro))
+
+        if atual is None:
+            self._por_nome[nome] = policial
+        else:
+            self._por_nome[nome] = candidatos + (policial,)
+
+        self._por_chat[policial.chat_id] = policial
+        self._total += 1
+        return policial
+
+    def remover(self, policial: Policial):
+        """Remove um policial dos indices."""
+        restantes = tuple(p for p in self._candidatos(policial.nome) if p is not policial)
+        if not restantes:
+            self._por_nome.pop(policial.nome, None)
+        else:
+            self._por_nome[policial.nome] = restantes if len(restantes) > 1 else restantes[0]
+
+        if self._por_chat.get(policial.chat_id) is policial:
+            del self._por_chat[policial.chat_id]
+        self._total -= 1
+
+    # ============== ARQUIVO ==============
+
+    def carregar(self, dados: Union[list, dict]):
+        """
+        Carrega os policiais do arquivo.
+
+        Args:
+            dados: Lista de linhas [posto, nome, chat_id, cadastro]
+                   ou o formato antigo {nome: {chat_id, data_cadastro, ...}}
+
+        Arquivos antigos podem ter mais de um nome no mesmo chat: fica
+        o ultimo cadastrado, que era o que o chat via no /status.
+        """
+        if isinstance(dados, dict):
+            for nome_completo, info in dados.items():
+                try:
+                    cadastro = datetime.fromisoformat(info["data_cadastro"]).timestamp()
+                except (KeyError, TypeError, ValueError):
+                    cadastro = None
+                self._liberar_chat(info["chat_id"])
+                self.adicionar(nome_completo, info["chat_id"], cadastro)
+            return
+
+        # Formato compacto: posto e nome ja vem separados (sem regex por linha)
+        for posto, nome, chat_id, cadastro in dados:
+            self._liberar_chat(chat_id)
+            self._inserir(posto, nome, chat_id, cadastro)
+
+    def _liberar_chat(self, chat_id: int):
+        """Tira o cadastro anterior do chat (so ao carregar arquivos antigos)."""
+        anterior = self._por_chat.get(int(chat_id))
+        if anterior is not None:
+            self.remover(anterior)
+
+    def exportar(self) -> List[list]:
+        """Linhas [posto, nome, chat_id, cadastro] para gravar no arquivo."""
+        return [[p.posto, p.nome, p.chat_id, p.cadastro] for p in self]
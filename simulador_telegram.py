@@ -0,0 +1,364 @@
+"""
+SIMULADOR TELEGRAM - Bot API Falsa para Testes de Carga
+=======================================================
+Servidor HTTP local que imita a Bot API do Telegram, para testar
+o envio em massa e as confirmacoes sem falar com o Telegram real.
+
+Metodos suportados:
+- getMe, getFile (e o download do arquivo)
+- sendMessage, editMessageText, answerCallbackQuery
+
+Os limites de flood sao aplicados como no Telegram:
+- Limite global de mensagens por segundo
+- Limite de mensagens por segundo em cada chat
+Quando passa do limite, responde 429 com "retry_after",
+que o python-telegram-bot transforma em RetryAfter.
+
+Textos com parse_mode "Markdown" sao interpretados como no Telegram
+(Markdown antigo): uma entidade sem fim (ex: um "_" solto) faz a
+mensagem ser recusada com 400 "can't parse entities". Textos com mais
+de 4096 caracteres (depois de tirar a marcacao) sao recusados com
+400 "message is too long".
+
+Como usar:
+    simulador = SimuladorTelegram()
+    simulador.adicionar_arquivo("escala", conteudo_pdf)
+    simulador.iniciar()
+    Application.builder().token(TOKEN)
+        .base_url(simulador.base_url)
+        .base_file_url(simulador.base_file_url)
+
+Autor: Bot Escala Militar
+"""
+
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from limitador import BaldeDeFichas
+
+
+# ============== MARKDOWN ==============
+
+# Tamanho maximo do texto de uma mensagem (em unidades UTF-16)
+LIMITE_TEXTO = 4096
+
+# Caractere que abre cada entidade do Markdown antigo do Telegram
+_ENTIDADES_MARKDOWN = {"*": "bold", "_": "italic", "`": "code"}
+
+
+def interpretar_markdown(texto: str) -> Tuple[str, List[dict]]:
+    """
+    Interpreta o Markdown antigo do Telegram (parse_mode "Markdown").
+    Entidades nao se aninham; fora delas, "\\" escapa _ * ` e [.
+
+    Returns:
+        Tupla (texto sem a marcacao, entidades com offsets em UTF-16)
+
+    Raises:
+        ValueError: Entidade sem fim (o Telegram recusa a mensagem)
+    """
+    saida = []
+    entidades = []
+    tamanho = 0  # tamanho da saida em unidades UTF-16
+    i = 0
+
+    def acrescentar(trecho: str):
+        nonlocal tamanho
+        saida.append(trecho)
+        tamanho += len(trecho.encode('utf-16-le')) // 2
+
+    while i < len(texto):
+        caractere = texto[i]
+        if caractere == "\\" and texto[i + 1:i + 2] in ("_", "*", "`", "["):
+            acrescentar(texto[i + 1])
+            i += 2
+            continue
+
+        if caractere not in _ENTIDADES_MARKDOWN and caractere != "[":
+            acrescentar(caractere)
+            i += 1
+            continue
+
+        erro = ValueError(
+            "Can't find end of the entity starting at byte offset "
+            f"{len(texto[:i].encode('utf-8'))}"
+        )
+        if texto.startswith("```", i):
+            fim = texto.find("```", i + 3)
+            if fim == -1:
+                raise erro
+            entidade, conteudo, i = {"type": "pre"}, texto[i + 3:fim], fim + 3
+        elif caractere == "[":
+            meio = texto.find("](", i + 1)
+            fim = texto.find(")", meio + 2) if meio != -1 else -1
+            if fim == -1:
+                raise erro
+            entidade = {"type": "text_link", "url": texto[meio + 2:fim]}
+            conteudo, i = texto[i + 1:meio], fim + 1
+        else:
+            fim = texto.find(caractere, i + 1)
+            if fim == -1:
+                raise erro
+            entidade, conteudo, i = {"type": _ENTIDADES_MARKDOWN[caractere]}, texto[i + 1:fim], fim + 1
+
+        inicio = tamanho
+        acrescentar(conteudo)
+        if tamanho > inicio:
+            entidades.append(dict(entidade, offset=inicio, length=tamanho - inicio))
+
+    return "".join(saida), entidades
+
+
+class SimuladorTelegram:
+    """
+    Bot API falsa rodando em uma thread, com limites de flood realistas.
+    Guarda as mensagens enviadas para o teste conferir depois.
+    """
+
+    def __init__(self, porta: int = 0, limite_global: float = 30.0,
+                 limite_por_chat: float = 1.0, rajada_por_chat: int = 3,
+                 latencia: float = 0.0):
+        """
+        Args:
+            porta: Porta HTTP (0 escolhe uma livre)
+            limite_global: Mensagens por segundo para todos os chats
+            limite_por_chat: Mensagens por segundo em um mesmo chat
+            rajada_por_chat: Mensagens seguidas permitidas em um chat
+            latencia: Atraso artificial (segundos) em cada resposta
+        """
+        self.limite_global = limite_global
+        self.limite_por_chat = limite_por_chat
+        self.rajada_por_chat = rajada_por_chat
+        self.latencia = latencia
+
+        self.arquivos: Dict[str, bytes] = {}  # file_id -> conteudo
+        self.mensagens = []  # mensagens enviadas (dicionarios da Bot API)
+        self.entregas: Dict[int, list] = {}  # chat_id -> horarios de entrega
+        self.edicoes = 0
+        self.edicoes_por_mensagem: Dict[Tuple[int, int], List[float]] = {}  # (chat_id, message_id) -> horarios
+        self.respostas_callback = 0
+        self.recusas_flood = 0
+        self.recusas_markdown = 0
+        self.recusas_tamanho = 0
+
+        self._trava = threading.Lock()
+        self._balde_global = BaldeDeFichas(limite_global, limite_global)
+        self._baldes_chat: Dict[int, BaldeDeFichas] = {}
+        self._proximo_id = 1
+
+        ThreadingHTTPServer.request_queue_size = 1024  # aguenta rajadas de conexoes
+        self._servidor = ThreadingHTTPServer(('127.0.0.1', porta), self._criar_handler())
+        self._servidor.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    # ============== CONTROLE ==============
+
+    @property
+    def porta(self) -> int:
+        return self._servidor.server_address[1]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.porta}/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        return f"http://127.0.0.1:{self.porta}/file/bot"
+
+    def iniciar(self):
+        """Sobe o servidor em uma thread separada."""
+        self._thread = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        """Desliga o servidor."""
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def adicionar_arquivo(self, file_id: str, conteudo: bytes):
+        """Disponibiliza um arquivo para getFile/download."""
+        self.arquivos[file_id] = conteudo
+
+    # ============== LIMITES DE FLOOD ==============
+
+    def _verificar_flood(self, chat_id: int) -> int:
+        """
+        Aplica os limites global e por chat.
+
+        Returns:
+            0 se pode enviar, ou o retry_after em segundos
+        """
+        with self._trava:
+            balde_chat = self._baldes_chat.get(chat_id)
+            if balde_chat is None:
+                balde_chat = BaldeDeFichas(self.limite_por_chat, self.rajada_por_chat)
+                self._baldes_chat[chat_id] = balde_chat
+
+            espera = max(self._balde_global.espera(), balde_chat.espera())
+            if espera:
+                self.recusas_flood += 1
+                return max(1, math.ceil(espera))
+
+            self._balde_global.gastar()
+            balde_chat.gastar()
+            return 0
+
+    # ============== METODOS DA BOT API ==============
+
+    def _nova_mensagem(self, chat_id: int, parametros: dict, texto: str, entidades: List[dict]) -> dict:
+        # A edicao devolve a mesma mensagem; o envio cria uma nova
+        mensagem_id = int(parametros.get("message_id") or 0)
+        if not mensagem_id:
+            with self._trava:
+                mensagem_id = self._proximo_id
+                self._proximo_id += 1
+
+        mensagem = {
+            "message_id": mensagem_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"},
+            "text": texto,
+        }
+        if entidades:
+            mensagem["entities"] = entidades
+        if parametros.get("reply_markup"):
+            mensagem["reply_markup"] = parametros["reply_markup"]
+        return mensagem
+
+    def executar(self, metodo: str, parametros: dict):
+        """
+        Executa um metodo da Bot API.
+
+        Returns:
+            Tupla (status_http, corpo_json)
+        """
+        if metodo == "getMe":
+            return 200, {"ok": True, "result": {
+                "id": 1, "is_bot": True, "first_name": "Simulador", "username": "simulador_bot"
+            }}
+
+        if metodo == "getFile":
+            file_id = parametros.get("file_id")
+            if file_id not in self.arquivos:
+                return 400, {"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"}
+            return 200, {"ok": True, "result": {
+                "file_id": file_id, "file_unique_id": file_id,
+                "file_size": len(self.arquivos[file_id]), "file_path": f"documents/{file_id}"
+            }}
+
+        if metodo in ("sendMessage", "editMessageText"):
+            chat_id = int(parametros.get("chat_id", 0))
+            texto, entidades = str(parametros.get("text", "")), []
+            if parametros.get("parse_mode") == "Markdown":
+                try:
+                    texto, entidades = interpretar_markdown(texto)
+                except ValueError as e:
+                    with self._trava:
+                        self.recusas_markdown += 1
+                    return 400, {"ok": False, "error_code": 400,
+                                 "description": f"Bad Request: can't parse entities: {e}"}
+            if len(texto.encode('utf-16-le')) // 2 > LIMITE_TEXTO:
+                with self._trava:
+                    self.recusas_tamanho += 1
+                return 400, {"ok": False, "error_code": 400, "description": "Bad Request: message is too long"}
+
+            espera = self._verificar_flood(chat_id)
+            if espera:
+                return 429, {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {espera}",
+                    "parameters": {"retry_after": espera}
+                }
+
+            mensagem = self._nova_mensagem(chat_id, parametros, texto, entidades)
+            with self._trava:
+                if metodo == "sendMessage":
+                    self.mensagens.append(mensagem)
+                    self.entregas.setdefault(chat_id, []).append(time.perf_counter())
+                else:
+                    self.edicoes += 1
+                    self.edicoes_por_mensagem.setdefault(
+                        (chat_id, mensagem["message_id"]), []
+                    ).append(time.perf_counter())
+            return 200, {"ok": True, "result": mensagem}
+
+        if metodo == "answerCallbackQuery":
+            with self._trava:
+                self.respostas_callback += 1
+            return 200, {"ok": True, "result": True}
+
+        # Qualquer outro metodo eh aceito sem efeito
+        return 200, {"ok": True, "result": True}
+
+    def _criar_handler(self):
+        simulador = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Mantem a conexao aberta entre requisicoes, como o Telegram
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, formato, *args):
+                pass  # Silencia o log de cada requisicao
+
+            def _responder(self, status: int, corpo, tipo: str = "application/json"):
+                if isinstance(corpo, dict):
+                    corpo = json.dumps(corpo).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def _ler_parametros(self) -> dict:
+                tamanho = int(self.headers.get("Content-Length") or 0)
+                corpo = self.rfile.read(tamanho).decode('utf-8') if tamanho else ""
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    return json.loads(corpo or "{}")
+
+                # O python-telegram-bot envia os campos como formulario,
+                # com os valores complexos codificados em JSON
+                parametros = {}
+                for chave, valor in parse_qsl(corpo):
+                    try:
+                        parametros[chave] = json.loads(valor)
+                    except ValueError:
+                        parametros[chave] = valor
+                return parametros
+
+            def do_GET(self):
+                # Download: /file/bot<TOKEN>/documents/<file_id>
+                if self.path.startswith("/file/"):
+                    file_id = self.path.rsplit("/", 1)[-1]
+                    conteudo = simulador.arquivos.get(file_id)
+                    if conteudo is None:
+                        self._responder(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                    else:
+                        self._responder(200, conteudo, "application/octet-stream")
+                    return
+                self.do_POST()
+
+            def do_POST(self):
+                # Metodo: /bot<TOKEN>/<metodo>
+                metodo = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+                if simulador.latencia:
+                    time.sleep(simulador.latencia)
+                status, corpo = simulador.executar(metodo, self._ler_parametros())
+                self._responder(status, corpo)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    simulador = SimuladorTelegram(porta=8081)
+    print(f"Simulador da Bot API em {simulador.base_url}<TOKEN>/<metodo>")
+    simulador.iniciar()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulador.parar()
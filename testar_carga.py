@@ -0,0 +1,393 @@
+"""
+TESTE DE CARGA - Envio de Escala e Confirmacoes
+===============================================
+Roda o bot.py de verdade contra o simulador local da Bot API
+(simulador_telegram.py), sem falar com o Telegram.
+
+Para cada tamanho de escala (N policiais):
+1. Cadastra N policiais em um banco temporario
+2. Gera um PDF sintetico com os N nomes e "posta" no canal
+3. Espera todas as notificacoes chegarem no simulador
+4. Dispara uma rajada de N cliques em "CONFIRMAR CIENCIA"
+
+Mostra a vazao, a latencia p50/p99 de ponta a ponta
+e o atraso do event loop durante o teste.
+
+Cada clique precisa terminar com a sua mensagem editada no
+simulador: se algum ficar sem edicao, o teste falha.
+
+Como usar:
+    python testar_carga.py                 (100, 1000 e 5000 policiais)
+    python testar_carga.py 100 500 2000
+    python testar_carga.py 5000 --sem-flood
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+from simulador_telegram import SimuladorTelegram
+
+# Configuracao do bot ANTES de importar o bot.py
+TOKEN_TESTE = "123456:TESTE-DE-CARGA"
+CANAL_TESTE = -1001234567890
+PASTA_TEMP = tempfile.mkdtemp(prefix="carga_bot_")
+
+os.environ["BOT_TOKEN"] = TOKEN_TESTE
+os.environ["CANAL_ESCALA_ID"] = str(CANAL_TESTE)
+os.environ["ARQUIVO_DB"] = os.path.join(PASTA_TEMP, "database.json")
+os.environ.setdefault("JANELA_AGRUPAMENTO", "0.5")
+
+import bot  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import Application, TypeHandler  # noqa: E402
+
+# O bot cria o parser no main() (importar o bot.py nao cria nada)
+bot.pdf_parser = bot.PDFParser(motor_ocr=bot.OCR_MOTOR)
+
+# Primeiro chat_id dos policiais ficticios
+CHAT_BASE = 10_000_000
+
+
+# ============== DADOS SINTETICOS ==============
+
+def gerar_nome(indice: int) -> str:
+    """
+    Gera um nome unico so com consoantes
+    (assim nunca forma palavras filtradas como DATA ou HORA).
+    """
+    letras = "BCDFGJKMNPRSTVXZ"
+    codigo = ""
+    for _ in range(4):
+        indice, resto = divmod(indice, len(letras))
+        codigo += letras[resto]
+    return f"SD {codigo}"
+
+
+def _escapar_pdf(texto: str) -> bytes:
+    texto = texto.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return texto.encode('latin-1')
+
+
+def gerar_pdf_texto(linhas: List[str], linhas_por_pagina: int = 60) -> bytes:
+    """
+    Gera um PDF digital minimo (texto selecionavel) com as linhas dadas.
+    Nao depende de nenhuma biblioteca externa.
+    """
+    paginas = [linhas[i:i + linhas_por_pagina] for i in range(0, len(linhas), linhas_por_pagina)] or [[]]
+
+    objetos = []  # conteudo de cada objeto (o numero eh a posicao + 1)
+    objetos.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objetos.append(b"")  # /Pages, preenchido depois
+    objetos.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+
+    ids_paginas = []
+    for linhas_pagina in paginas:
+        fluxo = b"BT /F1 10 Tf 12 TL 40 800 Td\n"
+        for linha in linhas_pagina:
+            fluxo += b"(" + _escapar_pdf(linha) + b") Tj T*\n"
+        fluxo += b"ET"
+        objetos.append(b"<< /Length %d >>\nstream\n" % len(fluxo) + fluxo + b"\nendstream")
+        id_conteudo = len(objetos)
+        objetos.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % id_conteudo
+        )
+        ids_paginas.append(len(objetos))
+
+    kids = b" ".join(b"%d 0 R" % i for i in ids_paginas)
+    objetos[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(ids_paginas)
+
+    pdf = b"%PDF-1.4\n"
+    posicoes = []
+    for numero, conteudo in enumerate(objetos, 1):
+        posicoes.append(len(pdf))
+        pdf += b"%d 0 obj\n" % numero + conteudo + b"\nendobj\n"
+
+    inicio_xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+    for posicao in posicoes:
+        pdf += b"%010d 00000 n \n" % posicao
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, inicio_xref)
+    return pdf
+
+
+def gerar_pdf_escala(nomes: List[str], data: str = "15/01/2024") -> bytes:
+    """Monta uma escala sintetica no formato do exemplo_escala.txt."""
+    linhas = [f"ESCALA DE SERVICO - DIA {data}", ""]
+    for inicio in range(0, len(nomes), 5):
+        if inicio % 50 == 0:
+            linhas.append(f"EQUIPE {inicio // 50 + 1}:")
+        # Termina a linha com ";" para o nome nao grudar na linha seguinte
+        linhas.append("; ".join(nomes[inicio:inicio + 5]) + ";")
+    return gerar_pdf_texto(linhas)
+
+
+def cadastrar_policiais(nomes: List[str]):
+    """Cadastra os policiais direto no banco temporario (uma gravacao so)."""
+    # Banco novo a cada cenario (senao a escala vira "retificacao" da anterior)
+    if os.path.exists(os.environ["ARQUIVO_DB"]):
+        os.remove(os.environ["ARQUIVO_DB"])
+    bot.db = bot.BancoDeDados(os.environ["ARQUIVO_DB"])
+    for indice, nome in enumerate(nomes):
+        bot.db.policiais.adicionar(nome, CHAT_BASE + indice)
+    bot.db.salvar()
+
+
+# ============== MEDICOES ==============
+
+def percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+async def monitorar_loop(amostras: List[float], parar: asyncio.Event, intervalo: float = 0.01):
+    """Mede quanto o event loop atrasa para acordar um sleep curto."""
+    while not parar.is_set():
+        inicio = time.perf_counter()
+        await asyncio.sleep(intervalo)
+        amostras.append(time.perf_counter() - inicio - intervalo)
+
+
+def montar_update_canal(update_id: int, mensagem_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "channel_post": {
+            "message_id": mensagem_id,
+            "date": int(time.time()),
+            "chat": {"id": CANAL_TESTE, "type": "channel", "title": "Escala"},
+            "document": {
+                "file_id": "escala_carga",
+                "file_unique_id": "escala_carga",
+                "file_name": "escala_carga.pdf",
+                "mime_type": "application/pdf"
+            }
+        }
+    }
+
+
+def montar_update_clique(update_id: int, mensagem: dict, callback_data: str) -> dict:
+    chat_id = mensagem["chat"]["id"]
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Policial"},
+            "chat_instance": str(chat_id),
+            "data": callback_data,
+            "message": mensagem
+        }
+    }
+
+
+# ============== CENARIO ==============
+
+async def executar_cenario(quantidade: int, sem_flood: bool) -> dict:
+    """Roda um envio de escala + rajada de cliques com N policiais."""
+    limite = 1_000_000.0 if sem_flood else 30.0
+    simulador = SimuladorTelegram(limite_global=limite, limite_por_chat=limite if sem_flood else 1.0)
+    simulador.iniciar()
+
+    nomes = [gerar_nome(i) for i in range(quantidade)]
+    cadastrar_policiais(nomes)
+    simulador.adicionar_arquivo("escala_carga", gerar_pdf_escala(nomes))
+
+    application = (
+        Application.builder()
+        .token(TOKEN_TESTE)
+        .base_url(simulador.base_url)
+        .base_file_url(simulador.base_file_url)
+        .concurrent_updates(True)
+        .build()
+    )
+    bot.registrar_handlers(application)
+
+    # Conta os erros dos handlers (ex: RetryAfter ao editar a mensagem)
+    erros = []
+
+    async def contar_erro(update, context):
+        erros.append(context.error)
+
+    application.add_error_handler(contar_erro)
+
+    # Ultimo grupo: marca quando cada clique terminou de ser tratado
+    pendentes_clique = set()
+    tratados_clique = 0
+    todos_tratados = asyncio.Event()
+
+    async def marcar_fim(update, context):
+        nonlocal tratados_clique
+        if update.update_id not in pendentes_clique:
+            return
+        pendentes_clique.discard(update.update_id)
+        tratados_clique += 1
+        if not pendentes_clique:
+            todos_tratados.set()
+
+    application.add_handler(TypeHandler(Update, marcar_fim), group=99)
+    await application.initialize()
+    # Os cliques entram pela update_queue, como em producao: o limite
+    # de updates simultaneos do concurrent_updates continua valendo
+    await application.start()
+
+    atrasos: List[float] = []
+    parar = asyncio.Event()
+    monitor = asyncio.create_task(monitorar_loop(atrasos, parar))
+
+    try:
+        # --- Envio da escala ---
+        inicio_envio = time.perf_counter()
+        update = Update.de_json(montar_update_canal(1, 500_000 + quantidade), application.bot)
+        await application.process_update(update)
+
+        limite_espera = time.perf_counter() + quantidade / (limite if not sem_flood else 1000) * 3 + 60
+        while time.perf_counter() < limite_espera:
+            entregues = sum(1 for chat_id in simulador.entregas if chat_id >= CHAT_BASE)
+            if entregues >= quantidade:
+                break
+            await asyncio.sleep(0.05)
+
+        latencias_envio = [
+            horarios[0] - inicio_envio
+            for chat_id, horarios in simulador.entregas.items() if chat_id >= CHAT_BASE
+        ]
+        fim_envio = inicio_envio + max(latencias_envio, default=0.0)
+
+        # --- Rajada de cliques ---
+        cliques = []
+        for mensagem in list(simulador.mensagens):
+            if mensagem["chat"]["id"] < CHAT_BASE or "reply_markup" not in mensagem:
+                continue
+            for linha in mensagem["reply_markup"]["inline_keyboard"]:
+                # update_id unico por clique (a mensagem pode ter varios botoes)
+                cliques.append(Update.de_json(
+                    montar_update_clique(len(cliques) + 2, mensagem, linha[0]["callback_data"]), application.bot
+                ))
+
+        pendentes_clique.update(update_clique.update_id for update_clique in cliques)
+        if not cliques:
+            todos_tratados.set()
+
+        # Inicio de cada clique, pela mensagem que ele edita
+        inicios_por_mensagem = {}
+        inicio_cliques = time.perf_counter()
+        for update_clique in cliques:
+            mensagem = update_clique.callback_query.message
+            inicios_por_mensagem.setdefault((mensagem.chat_id, mensagem.message_id), []).append(time.perf_counter())
+            await application.update_queue.put(update_clique)
+        # Espera todos; so desiste se ficar um minuto sem nenhum clique tratado
+        tratados = -1
+        while not todos_tratados.is_set():
+            if tratados_clique == tratados:
+                raise RuntimeError(f"{len(pendentes_clique)} clique(s) sem resposta ha 60s")
+            tratados = tratados_clique
+            try:
+                await asyncio.wait_for(todos_tratados.wait(), timeout=60)
+            except asyncio.TimeoutError:
+                pass
+        duracao_cliques = time.perf_counter() - inicio_cliques
+
+        # Latencia ate a edicao de verdade: o n-esimo clique de uma
+        # mensagem corresponde a n-esima edicao dela no simulador
+        latencias_clique: List[float] = []
+        sem_edicao = 0
+        for chave, inicios in inicios_por_mensagem.items():
+            edicoes = simulador.edicoes_por_mensagem.get(chave, [])
+            latencias_clique.extend(fim - inicio for inicio, fim in zip(inicios, edicoes))
+            sem_edicao += max(0, len(inicios) - len(edicoes))
+    finally:
+        parar.set()
+        await monitor
+        if application.running:
+            await application.stop()
+        # Grava o banco antes do proximo cenario apagar o arquivo
+        await bot.encerrar_notificacoes(application)
+        await application.shutdown()
+        simulador.parar()
+
+    return {
+        "policiais": quantidade,
+        "entregues": len(latencias_envio),
+        "envio_por_s": len(latencias_envio) / max(fim_envio - inicio_envio, 1e-9),
+        "envio_p50": percentil(latencias_envio, 50),
+        "envio_p99": percentil(latencias_envio, 99),
+        "cliques": len(cliques),
+        "edicoes": simulador.edicoes,
+        "sem_edicao": sem_edicao,
+        "cliques_por_s": len(cliques) / max(duracao_cliques, 1e-9),
+        "clique_p50": percentil(latencias_clique, 50),
+        "clique_p99": percentil(latencias_clique, 99),
+        "loop_p99": percentil(atrasos, 99),
+        "loop_max": max(atrasos, default=0.0),
+        "recusas_flood": simulador.recusas_flood,
+        "erros": len(erros),
+    }
+
+
+def imprimir_relatorio(resultados: List[dict]):
+    cabecalho = (f"{'N':>6} | {'entregues':>9} | {'envio/s':>8} | {'p50':>7} | {'p99':>7} | "
+                 f"{'cliques/s':>9} | {'p50':>7} | {'p99':>7} | {'sem edicao':>10} | "
+                 f"{'loop p99':>8} | {'loop max':>8} | {'429':>5} | {'erros':>5}")
+    print("\n" + "=" * len(cabecalho))
+    print("RESULTADO DO TESTE DE CARGA")
+    print("=" * len(cabecalho))
+    print(cabecalho)
+    print("-" * len(cabecalho))
+    for r in resultados:
+        print(f"{r['policiais']:>6} | {r['entregues']:>9} | {r['envio_por_s']:>8.1f} | "
+              f"{r['envio_p50']:>6.2f}s | {r['envio_p99']:>6.2f}s | {r['cliques_por_s']:>9.1f} | "
+              f"{r['clique_p50'] * 1000:>5.0f}ms | {r['clique_p99'] * 1000:>5.0f}ms | {r['sem_edicao']:>10} | "
+              f"{r['loop_p99'] * 1000:>6.0f}ms | {r['loop_max'] * 1000:>6.0f}ms | {r['recusas_flood']:>5} | {r['erros']:>5}")
+    print("=" * len(cabecalho))
+    print("envio: do post no canal ate a notificacao chegar | clique: do clique ate a edicao da sua mensagem")
+    print("sem edicao: cliques cuja mensagem nao foi editada | 429: recusas de flood do simulador")
+    print("erros: excecoes nos handlers do bot")
+
+
+async def executar(tamanhos: List[int], sem_flood: bool) -> List[dict]:
+    resultados = []
+    for quantidade in tamanhos:
+        print(f"Rodando cenario com {quantidade} policiais...")
+        resultados.append(await executar_cenario(quantidade, sem_flood))
+    imprimir_relatorio(resultados)
+    return resultados
+
+
+def main():
+    argumentos = argparse.ArgumentParser(description="Teste de carga do bot de escala")
+    argumentos.add_argument("tamanhos", nargs="*", type=int, default=[100, 1000, 5000],
+                            help="quantidades de policiais na escala")
+    argumentos.add_argument("--sem-flood", action="store_true",
+                            help="desliga os limites de flood do simulador")
+    opcoes = argumentos.parse_args()
+
+    # O bot registra cada envio em INFO: durante a carga isso so atrapalha
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    resultados = asyncio.run(executar(opcoes.tamanhos, opcoes.sem_flood))
+
+    # Excecao em handler ou clique sem edicao eh falha: o policial fica sem resposta
+    falhou = False
+    erros = sum(r["erros"] for r in resultados)
+    if erros:
+        print(f"❌ {erros} erro(s) nos handlers do bot")
+        falhou = True
+    for r in resultados:
+        if r["edicoes"] != r["cliques"] or r["sem_edicao"]:
+            print(f"❌ {r['policiais']} policiais: {r['cliques']} cliques, {r['edicoes']} mensagens editadas "
+                  f"({r['sem_edicao']} clique(s) sem edicao)")
+            falhou = True
+    return 1 if falhou else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
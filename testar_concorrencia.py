@@ -0,0 +1,305 @@
+"""
+TESTE DE CONCORRENCIA - Updates em Paralelo
+===========================================
+Roda o bot.py com concurrent_updates ligado contra o simulador
+local da Bot API e confere que nada se perde quando muitos
+updates chegam ao mesmo tempo.
+
+Etapas:
+1. Rajada de /configurar (alguns nomes disputados por dois chats)
+2. Duas escalas da MESMA data postadas juntas, com uma rajada
+   de /status chegando enquanto os PDFs sao processados
+3. Rajada de cliques em "CONFIRMAR", cada botao clicado duas vezes
+4. Outra data: uma escala, a mesma equipe com todos os nomes trocados
+   (retificacao) e uma escala de outro setor (escala nova); depois
+   retificacoes que so mexem em turnos: o segundo turno de um policial
+   muda de dia, e dois policiais trocam de dia numa escala sem cabecalho
+
+No fim confere, na memoria e relendo o banco do disco (gravado
+so no desligamento, como um bot desligado no meio do intervalo):
+- Cada nome cadastrado uma vez so, nenhum cadastro perdido
+- Uma escala nova e uma retificacao (nunca duas escalas "novas")
+- Na outra data, quem decide a retificacao sao os cabecalhos, nao os nomes
+- Confirmados == notificados, sem pendentes, sem clique contado duas vezes
+
+Como usar:
+    python testar_concorrencia.py                 (500 policiais, 50 nomes disputados)
+    python testar_concorrencia.py --policiais 2000 --disputados 200
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from typing import Callable, List
+
+# Sem limite global de comandos: a rajada do teste eh proposital
+os.environ["COMANDOS_POR_SEGUNDO_GLOBAL"] = "1000000"
+# O banco so vai para o disco no desligamento: a conferencia do disco
+# pega qualquer alteracao que o desligamento deixaria de gravar
+os.environ["INTERVALO_GRAVACAO"] = "3600"
+
+from testar_carga import (  # noqa: E402  (configura o ambiente e importa o bot)
+    CANAL_TESTE, CHAT_BASE, TOKEN_TESTE, bot, gerar_nome, gerar_pdf_escala,
+    gerar_pdf_texto, montar_update_clique, percentil
+)
+from simulador_telegram import SimuladorTelegram  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+DATA_ESCALA = "20/02/2024"
+DATA_EQUIPES = "21/02/2024"
+
+
+# ============== UPDATES ==============
+
+def montar_update_comando(update_id: int, chat_id: int, texto: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Policial"},
+            "text": texto,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(texto.split()[0])}]
+        }
+    }
+
+
+def montar_update_pdf(update_id: int, mensagem_id: int, file_id: str) -> dict:
+    return {
+        "update_id": update_id,
+        "channel_post": {
+            "message_id": mensagem_id,
+            "date": int(time.time()),
+            "chat": {"id": CANAL_TESTE, "type": "channel", "title": "Escala"},
+            "document": {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_name": f"{file_id}.pdf",
+                "mime_type": "application/pdf"
+            }
+        }
+    }
+
+
+async def esperar(condicao: Callable[[], bool], limite: float, descricao: str):
+    """Espera a condicao ficar verdadeira (ou falha apos 'limite' segundos)."""
+    fim = time.perf_counter() + limite
+    while not condicao():
+        if time.perf_counter() > fim:
+            raise TimeoutError(f"Tempo esgotado esperando: {descricao}")
+        await asyncio.sleep(0.02)
+
+
+# ============== CENARIO ==============
+
+async def executar(quantidade: int, disputados: int) -> List[str]:
+    """
+    Roda as tres etapas e confere o resultado.
+
+    Returns:
+        Lista de falhas (vazia se tudo certo)
+    """
+    if os.path.exists(os.environ["ARQUIVO_DB"]):
+        os.remove(os.environ["ARQUIVO_DB"])
+    bot.db = bot.BancoDeDados(os.environ["ARQUIVO_DB"])
+
+    simulador = SimuladorTelegram(limite_global=1_000_000, limite_por_chat=1_000_000, rajada_por_chat=1_000_000)
+    simulador.iniciar()
+
+    nomes = [gerar_nome(i) for i in range(quantidade)]
+    simulador.adicionar_arquivo("escala_a", gerar_pdf_escala(nomes, DATA_ESCALA))
+    simulador.adicionar_arquivo("escala_b", gerar_pdf_escala(nomes[:-10], DATA_ESCALA))
+    # Etapa 4: policiais sem cadastro (so o resumo no canal importa)
+    outros = [gerar_nome(quantidade + i) for i in range(50)]
+    simulador.adicionar_arquivo("equipe_1", gerar_pdf_escala(outros[:20], DATA_EQUIPES))
+    simulador.adicionar_arquivo("equipe_1_trocada", gerar_pdf_escala(outros[20:40], DATA_EQUIPES))
+    for file_id, segundo_dia in (("setor_norte", "22/02/2024"), ("setor_norte_movido", "25/02/2024")):
+        simulador.adicionar_arquivo(file_id, gerar_pdf_texto([
+            f"ESCALA DE SERVICO - DIA {DATA_EQUIPES}", "SETOR NORTE:", "; ".join(outros[40:45]) + ";",
+            f"DIA {segundo_dia}", "SETOR NORTE:", f"{outros[40]};"
+        ]))
+    for file_id, (primeiro, segundo) in (("sem_cabecalho", (45, 47)), ("sem_cabecalho_trocado", (47, 45))):
+        simulador.adicionar_arquivo(file_id, gerar_pdf_texto([
+            "ESCALA DE SERVICO - DIA 23/02/2024", f"{outros[primeiro]}; {outros[46]};",
+            "DIA 24/02/2024", f"{outros[segundo]}; {outros[48]};"
+        ]))
+
+    application = (
+        Application.builder()
+        .token(TOKEN_TESTE)
+        .base_url(simulador.base_url)
+        .base_file_url(simulador.base_file_url)
+        .concurrent_updates(True)
+        .build()
+    )
+    bot.registrar_handlers(application)
+
+    erros = []
+
+    async def contar_erro(update, context):
+        erros.append(context.error)
+
+    application.add_error_handler(contar_erro)
+    await application.initialize()
+    await application.start()  # consome a update_queue com updates concorrentes
+
+    falhas = []
+    numero = 0
+
+    def proximo() -> int:
+        nonlocal numero
+        numero += 1
+        return numero
+
+    def entregues(chats) -> int:
+        return sum(len(simulador.entregas.get(chat_id, [])) for chat_id in chats)
+
+    try:
+        # --- 1. Rajada de cadastros ---
+        chats = [CHAT_BASE + i for i in range(quantidade)]
+        disputantes = [CHAT_BASE + quantidade + i for i in range(disputados)]
+        pedidos = [(chat_id, nome) for chat_id, nome in zip(chats, nomes)]
+        pedidos += [(chat_id, nomes[i]) for i, chat_id in enumerate(disputantes)]
+        # Intercala os disputantes com os donos dos nomes
+        pedidos.sort(key=lambda pedido: pedido[1])
+
+        inicio = time.perf_counter()
+        for chat_id, nome in pedidos:
+            await application.update_queue.put(
+                Update.de_json(montar_update_comando(proximo(), chat_id, f"/configurar {nome}"), application.bot)
+            )
+        await esperar(lambda: entregues(chats + disputantes) >= len(pedidos), 120, "respostas do /configurar")
+        print(f"1. {len(pedidos)} cadastros concorrentes em {time.perf_counter() - inicio:.2f}s")
+
+        if len(bot.db.policiais) != quantidade:
+            falhas.append(f"cadastros: esperado {quantidade}, no banco {len(bot.db.policiais)}")
+        for nome in nomes:
+            if bot.db.policiais.buscar_exato(nome) is None:
+                falhas.append(f"cadastro perdido: {nome}")
+
+        # --- 2. Duas escalas da mesma data + rajada de /status ---
+        antes_status = {chat_id: len(simulador.entregas.get(chat_id, [])) for chat_id in disputantes}
+        inicio = time.perf_counter()
+        await application.update_queue.put(Update.de_json(montar_update_pdf(proximo(), 900_001, "escala_a"), application.bot))
+        await application.update_queue.put(Update.de_json(montar_update_pdf(proximo(), 900_002, "escala_b"), application.bot))
+        for chat_id in disputantes:
+            await application.update_queue.put(
+                Update.de_json(montar_update_comando(proximo(), chat_id, "/status"), application.bot)
+            )
+
+        await esperar(lambda: all(len(simulador.entregas.get(c, [])) > antes_status[c] for c in disputantes),
+                      120, "respostas do /status")
+        latencias_status = [simulador.entregas[c][antes_status[c]] - inicio for c in disputantes]
+
+        await esperar(lambda: len(simulador.entregas.get(CANAL_TESTE, [])) >= 2, 300, "resumos das escalas no canal")
+        duracao_escalas = max(simulador.entregas[CANAL_TESTE][:2]) - inicio
+        print(f"2. Duas escalas processadas em {duracao_escalas:.2f}s; "
+              f"/status durante o processamento: p50 {percentil(latencias_status, 50) * 1000:.0f}ms, "
+              f"p99 {percentil(latencias_status, 99) * 1000:.0f}ms")
+
+        resumos = [m["text"] for m in simulador.mensagens if m["chat"]["id"] == CANAL_TESTE]
+        retificacoes = sum(1 for texto in resumos if "Retificacao processada" in texto)
+        if retificacoes != 1:
+            falhas.append(f"escalas da mesma data: esperada 1 retificacao, houve {retificacoes}")
+
+        # Espera a fila de notificacoes (janela de agrupamento) esvaziar
+        await esperar(lambda: entregues(chats) >= 2 * quantidade, 120, "notificacoes dos policiais")
+        await asyncio.sleep(bot.JANELA_AGRUPAMENTO * 2)
+
+        # --- 3. Rajada de cliques (cada botao duas vezes) ---
+        cliques = []
+        for mensagem in list(simulador.mensagens):
+            if mensagem["chat"]["id"] not in bot.db.policiais._por_chat or "reply_markup" not in mensagem:
+                continue
+            for linha in mensagem["reply_markup"]["inline_keyboard"]:
+                for _ in range(2):
+                    cliques.append(montar_update_clique(proximo(), mensagem, linha[0]["callback_data"]))
+
+        respostas_antes = simulador.respostas_callback
+        inicio = time.perf_counter()
+        for clique in cliques:
+            await application.update_queue.put(Update.de_json(clique, application.bot))
+        await esperar(lambda: simulador.respostas_callback - respostas_antes >= len(cliques), 120,
+                      "respostas dos cliques")
+        print(f"3. {len(cliques)} cliques ({len(cliques) // 2} botoes, cada um duas vezes) "
+              f"em {time.perf_counter() - inicio:.2f}s")
+
+        # --- 4. Retificacao pelos cabecalhos e pelos turnos (uma escala por vez) ---
+        # (arquivo, se eh retificacao, alterados esperados no resumo)
+        esperados = [
+            ("equipe_1", False, None), ("equipe_1_trocada", True, 0), ("setor_norte", False, None),
+            ("setor_norte_movido", True, 1), ("sem_cabecalho", False, None), ("sem_cabecalho_trocado", True, 2),
+        ]
+        for indice, (file_id, retificacao, alterados) in enumerate(esperados):
+            resumos_antes = len(simulador.entregas.get(CANAL_TESTE, []))
+            await application.update_queue.put(
+                Update.de_json(montar_update_pdf(proximo(), 900_101 + indice, file_id), application.bot)
+            )
+            await esperar(lambda: len(simulador.entregas.get(CANAL_TESTE, [])) > resumos_antes, 60,
+                          f"resumo da escala {file_id}")
+            resumo = [m["text"] for m in simulador.mensagens if m["chat"]["id"] == CANAL_TESTE][-1]
+            if ("Retificacao processada" in resumo) != retificacao:
+                falhas.append(f"{file_id}: esperada {'retificacao' if retificacao else 'escala nova'}, "
+                              f"resumo: {resumo.splitlines()[0]!r}")
+            elif alterados is not None and f"Alterados: {alterados}\n" not in resumo:
+                falhas.append(f"{file_id}: esperados {alterados} alterado(s), resumo: {resumo!r}")
+        print(f"4. {len(esperados)} escalas conferidas pelos cabecalhos e pelos turnos")
+    finally:
+        await application.stop()
+        # Como o post_stop do bot: grava o que o banco ainda nao gravou
+        await bot.encerrar_notificacoes(application)
+        await application.shutdown()
+        simulador.parar()
+
+    # --- Conferencia final (memoria e disco) ---
+    for origem, banco in (("memoria", bot.db), ("disco", bot.BancoDeDados(os.environ["ARQUIVO_DB"]))):
+        if len(banco.policiais) != quantidade:
+            falhas.append(f"{origem}: {len(banco.policiais)} cadastros (esperado {quantidade})")
+        for mensagem_id, totais in banco.dados["totais"].items():
+            if totais["confirmados"] != totais["notificados"]:
+                falhas.append(f"{origem}: escala {mensagem_id} com {totais['confirmados']} confirmados "
+                              f"de {totais['notificados']} notificados")
+            confirmacoes = len(banco.dados["confirmacoes"].get(mensagem_id, {}))
+            if confirmacoes != totais["confirmados"]:
+                falhas.append(f"{origem}: escala {mensagem_id} tem {confirmacoes} confirmacoes "
+                              f"e total {totais['confirmados']}")
+            if banco.listar_pendentes(int(mensagem_id)):
+                falhas.append(f"{origem}: escala {mensagem_id} ainda tem pendentes")
+        if not banco.dados["totais"]:
+            falhas.append(f"{origem}: nenhuma escala notificada")
+
+    for erro in erros:
+        falhas.append(f"erro em handler: {erro!r}")
+
+    return falhas
+
+
+def main():
+    argumentos = argparse.ArgumentParser(description="Teste de concorrencia do bot de escala")
+    argumentos.add_argument("--policiais", type=int, default=500, help="policiais cadastrados")
+    argumentos.add_argument("--disputados", type=int, default=50,
+                            help="nomes que um segundo chat tenta cadastrar ao mesmo tempo")
+    opcoes = argumentos.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    falhas = asyncio.run(executar(opcoes.policiais, min(opcoes.disputados, opcoes.policiais)))
+
+    print("=" * 60)
+    if falhas:
+        print(f"❌ FALHAS ({len(falhas)}):")
+        for falha in falhas[:30]:
+            print(f"  - {falha}")
+        return 1
+    print("✅ Nenhum cadastro ou confirmacao perdido")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""
+TESTE DE MENSAGENS - Escalas em Foto ate a Confirmacao
+======================================================
+Roda o bot.py contra o simulador local da Bot API, que recusa
+o Markdown invalido ("can't parse entities") e os textos com mais
+de 4096 caracteres ("message is too long") como o Telegram, e
+confere que as mensagens geradas sao aceitas.
+
+Etapas:
+1. Posta no canal uma foto, um album de duas fotos e uma imagem
+   enviada como arquivo ("escala_turno_b.png")
+2. Espera as notificacoes e o resumo de cada escala
+3. Clica em todos os botoes e espera as mensagens editadas
+4. Junta 10 avisos longos para o mesmo chat: o agrupamento precisa
+   dividi-los em mensagens que caibam no limite, sem perder nenhum
+
+O OCR eh substituido: o "arquivo de imagem" do simulador ja eh o
+texto da escala (o teste confere o envio, nao a leitura da foto).
+
+Como usar:
+    python testar_mensagens.py
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import time
+from typing import List
+
+# O album eh lido assim que a ultima foto chega (o padrao espera 2s)
+os.environ.setdefault("ESPERA_ALBUM", "0.3")
+
+from testar_carga import CANAL_TESTE, CHAT_BASE, TOKEN_TESTE, bot, montar_update_clique  # noqa: E402
+from testar_concorrencia import esperar  # noqa: E402
+from notificacoes import FilaNotificacoes  # noqa: E402
+from simulador_telegram import SimuladorTelegram  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+POLICIAIS = ["SD JOAO VICTOR", "CB PEDRO ALVES", "3º SGT MARCIA LOPES"]
+
+# Chat que recebe os avisos longos (fora dos cadastrados)
+CHAT_AVISOS_LONGOS = CHAT_BASE + 999
+
+
+# ============== UPDATES ==============
+
+def montar_update_foto(update_id: int, mensagem_id: int, file_id: str, album: str = None) -> dict:
+    """Foto no canal: o Telegram manda varios tamanhos, so o maior existe no simulador."""
+    post = {
+        "message_id": mensagem_id,
+        "date": int(time.time()),
+        "chat": {"id": CANAL_TESTE, "type": "channel", "title": "Escala"},
+        "photo": [
+            {"file_id": f"{file_id}_miniatura", "file_unique_id": f"{file_id}_miniatura", "width": 90, "height": 68},
+            {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}
+        ]
+    }
+    if album:
+        post["media_group_id"] = album
+    return {"update_id": update_id, "channel_post": post}
+
+
+def montar_update_imagem(update_id: int, mensagem_id: int, file_id: str, nome_arquivo: str) -> dict:
+    return {
+        "update_id": update_id,
+        "channel_post": {
+            "message_id": mensagem_id,
+            "date": int(time.time()),
+            "chat": {"id": CANAL_TESTE, "type": "channel", "title": "Escala"},
+            "document": {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_name": nome_arquivo,
+                "mime_type": "image/png"
+            }
+        }
+    }
+
+
+def montar_aviso_longo(indice: int) -> dict:
+    """Aviso com muitos turnos (cerca de 900 caracteres, com emojis e negrito)."""
+    texto = f"📋 *ESCALA {indice}*\n\n"
+    texto += "\n".join(
+        f"📅 {dia:02d}/03/2024 • *EQUIPE {indice}-{dia}* • Local: POSTO AVANCADO DO SETOR NORTE"
+        for dia in range(1, 11)
+    )
+    return {'texto': texto, 'botao': f"✅ CONFIRMAR - escala {indice}", 'callback_data': f"c:longo{indice}"}
+
+
+def ler_texto_das_imagens(caminhos: List[str]) -> str:
+    """Substitui o OCR: cada arquivo baixado ja eh o texto da pagina."""
+    paginas = []
+    for caminho in caminhos:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            paginas.append(f.read())
+    return "\n".join(paginas)
+
+
+# ============== CENARIO ==============
+
+async def executar() -> List[str]:
+    """
+    Posta as escalas em imagem, clica nos botoes e confere as entregas.
+
+    Returns:
+        Lista de falhas (vazia se tudo certo)
+    """
+    if os.path.exists(os.environ["ARQUIVO_DB"]):
+        os.remove(os.environ["ARQUIVO_DB"])
+    bot.db = bot.BancoDeDados(os.environ["ARQUIVO_DB"])
+    chats = {}
+    for indice, nome in enumerate(POLICIAIS):
+        bot.db.policiais.adicionar(nome, CHAT_BASE + indice)
+        chats[nome] = CHAT_BASE + indice
+    bot.db.salvar()
+    bot.pdf_parser.extrair_texto_imagens = ler_texto_das_imagens
+
+    simulador = SimuladorTelegram(limite_global=1_000_000, limite_por_chat=1_000_000, rajada_por_chat=1_000_000)
+    simulador.adicionar_arquivo("foto_unica", "ESCALA DE SERVICO - DIA 10/03/2024\nEQUIPE ALFA:\n"
+                                              "SD JOAO VICTOR; CB PEDRO ALVES;".encode('utf-8'))
+    simulador.adicionar_arquivo("album_1", "ESCALA DE SERVICO - DIA 11/03/2024\nEQUIPE BRAVO:\n"
+                                           "CB PEDRO ALVES;".encode('utf-8'))
+    simulador.adicionar_arquivo("album_2", "3º SGT MARCIA LOPES;".encode('utf-8'))
+    simulador.adicionar_arquivo("imagem_b", "ESCALA DE SERVICO - DIA 12/03/2024\nSETOR NORTE_1:\n"
+                                            "SD JOAO VICTOR; 3º SGT MARCIA LOPES;".encode('utf-8'))
+    simulador.iniciar()
+
+    application = (
+        Application.builder()
+        .token(TOKEN_TESTE)
+        .base_url(simulador.base_url)
+        .base_file_url(simulador.base_file_url)
+        .concurrent_updates(True)
+        .build()
+    )
+    bot.registrar_handlers(application)
+
+    erros = []
+
+    async def contar_erro(update, context):
+        erros.append(context.error)
+
+    application.add_error_handler(contar_erro)
+    await application.initialize()
+    await application.start()  # o album precisa dos updates concorrentes
+
+    falhas = []
+    # Arquivos com "_" no nome, como o Telegram mostra (sem o escape do Markdown)
+    esperados = {
+        "SD JOAO VICTOR": ["foto_700001.jpg", "escala_turno_b.png"],
+        "CB PEDRO ALVES": ["foto_700001.jpg", "album_700002 (2 fotos)"],
+        "3º SGT MARCIA LOPES": ["album_700002 (2 fotos)", "escala_turno_b.png"],
+    }
+
+    def recebidas(chat_id: int) -> List[dict]:
+        return [m for m in simulador.mensagens if m["chat"]["id"] == chat_id]
+
+    try:
+        # --- 1. Escalas em imagem ---
+        for update in (
+            montar_update_foto(1, 700_001, "foto_unica"),
+            montar_update_foto(2, 700_002, "album_1", album="album"),
+            montar_update_foto(3, 700_003, "album_2", album="album"),
+            montar_update_imagem(4, 700_004, "imagem_b", "escala_turno_b.png"),
+        ):
+            await application.update_queue.put(Update.de_json(update, application.bot))
+
+        # --- 2. Resumos no canal e notificacoes ---
+        await esperar(lambda: len(simulador.entregas.get(CANAL_TESTE, [])) >= 3, 60, "resumos das escalas no canal")
+        await esperar(lambda: all(chat_id in simulador.entregas for chat_id in chats.values())
+                      or simulador.recusas_markdown > 0, 60, "notificacoes dos policiais")
+        await asyncio.sleep(bot.JANELA_AGRUPAMENTO * 2)
+
+        for nome, arquivos in esperados.items():
+            textos = "\n".join(m["text"] for m in recebidas(chats[nome]))
+            for arquivo in arquivos:
+                if f"Escala: {arquivo}" not in textos:
+                    falhas.append(f"{nome}: sem notificacao da escala {arquivo}")
+
+        for mensagem_id, totais in bot.db.dados["totais"].items():
+            if totais.get("falhas"):
+                falhas.append(f"escala {mensagem_id}: {totais['falhas']} notificacao(oes) nao entregue(s)")
+        print(f"1. {len(simulador.entregas.get(CANAL_TESTE, []))} escalas em imagem processadas, "
+              f"{sum(len(recebidas(c)) for c in chats.values())} notificacoes entregues")
+
+        # --- 3. Cliques e mensagens editadas ---
+        cliques = []
+        for chat_id in chats.values():
+            for mensagem in recebidas(chat_id):
+                for linha in mensagem.get("reply_markup", {}).get("inline_keyboard", []):
+                    cliques.append(montar_update_clique(100 + len(cliques), mensagem, linha[0]["callback_data"]))
+
+        # Um clique de cada vez: os botoes de uma mensagem agrupada editam a mesma mensagem
+        for clique in cliques:
+            edicoes = simulador.edicoes
+            await application.process_update(Update.de_json(clique, application.bot))
+            if simulador.edicoes == edicoes:
+                falhas.append(f"clique sem mensagem editada: {clique['callback_query']['message']['text'][:40]!r}")
+        print(f"2. {len(cliques)} cliques, {simulador.edicoes} mensagens editadas")
+
+        confirmados = sum(totais["confirmados"] for totais in bot.db.dados["totais"].values())
+        if confirmados != len(cliques):
+            falhas.append(f"{len(cliques)} cliques e {confirmados} confirmacoes registradas")
+
+        # --- 4. Avisos longos agrupados ---
+        fila = FilaNotificacoes(janela=0.1)
+        for indice in range(FilaNotificacoes.MAX_AVISOS_POR_MENSAGEM):
+            await fila.enfileirar(application.bot, CHAT_AVISOS_LONGOS, montar_aviso_longo(indice))
+        await fila.esvaziar()
+        longas = recebidas(CHAT_AVISOS_LONGOS)
+        botoes = [linha[0]["callback_data"] for m in longas for linha in m.get("reply_markup", {}).get("inline_keyboard", [])]
+        for indice in range(FilaNotificacoes.MAX_AVISOS_POR_MENSAGEM):
+            if not any(f"ESCALA {indice}\n" in m["text"] for m in longas):
+                falhas.append(f"aviso longo {indice} nao entregue")
+        if sorted(botoes) != sorted(f"c:longo{i}" for i in range(FilaNotificacoes.MAX_AVISOS_POR_MENSAGEM)):
+            falhas.append(f"avisos longos: {len(botoes)} botoes entregues")
+        if len(longas) < 2:
+            falhas.append("avisos longos: esperava mais de uma mensagem")
+        print(f"3. {FilaNotificacoes.MAX_AVISOS_POR_MENSAGEM} avisos longos em {len(longas)} mensagens "
+              f"(maior: {max((len(m['text']) for m in longas), default=0)} caracteres)")
+    finally:
+        await application.stop()
+        await bot.encerrar_notificacoes(application)
+        await application.shutdown()
+        simulador.parar()
+
+    if simulador.recusas_markdown:
+        falhas.append(f"{simulador.recusas_markdown} mensagem(ns) recusada(s) pelo Markdown")
+    if simulador.recusas_tamanho:
+        falhas.append(f"{simulador.recusas_tamanho} mensagem(ns) recusada(s) por passar de 4096 caracteres")
+    for erro in erros:
+        falhas.append(f"erro em handler: {erro!r}")
+
+    return falhas
+
+
+def main():
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    falhas = asyncio.run(executar())
+
+    print("=" * 60)
+    if falhas:
+        print(f"❌ FALHAS ({len(falhas)}):")
+        for falha in falhas[:30]:
+            print(f"  - {falha}")
+        return 1
+    print("✅ Todas as mensagens foram aceitas e entregues")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,25 +7,47 @@ os nomes corretamente antes de colocar o bot online.
 Como usar:
 1. Coloque seu PDF de escala na mesma pasta
 2. Execute: python testar_parser.py escala.pdf
+
+Teste de regressao (corpus de escalas anonimizadas):
+    python testar_parser.py --corpus                  (compara com o baseline)
+    python testar_parser.py --corpus --gravar-baseline
+
+Cada PDF do corpus tem ao lado um .json com os policiais esperados.
+O teste mostra precisao/recall por documento e o tempo de cada etapa
+(extracao do texto e identificacao dos nomes), e FALHA se a precisao
+ou o recall cairem, ou se o tempo passar da tolerancia do baseline.
+
+O baseline nao guarda tempos absolutos: cada etapa eh gravada em
+relacao a uma carga de calibracao medida na mesma execucao, e assim
+vale em qualquer maquina. So as etapas acima de PISO_TEMPO entram na
+comparacao de tempo (abaixo disso a medida eh ruido do relogio).
 """
 
+import argparse
+import gc
+import json
+import logging
+import math
+import os
+import re
 import sys
+import time
+
 from pdf_parser import PDFParser
 
-def main():
-    # Verifica se o usuario passou o nome do arquivo
-    if len(sys.argv) < 2:
-        print("="*60)
-        print("TESTADOR DE PARSER DE ESCALA")
-        print("="*60)
-        print("\nUso: python testar_parser.py <arquivo.pdf>")
-        print("\nExemplo:")
-        print("  python testar_parser.py escala_janeiro.pdf")
-        print("\n" + "="*60)
-        sys.exit(1)
-    
-    caminho_pdf = sys.argv[1]
-    
+PASTA_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+ARQUIVO_BASELINE = "baseline.json"
+
+# Cada medida roda a etapa varias vezes, ate somar pelo menos isto (segundos):
+# etapas de fracao de milissegundo medidas uma vez so ficariam no ruido do relogio
+TEMPO_MINIMO = 0.05
+
+# Etapas mais rapidas que isto (segundos, nesta maquina) nao sao comparadas por tempo
+PISO_TEMPO = 0.001
+
+
+def testar_arquivo(caminho_pdf: str):
+    """Processa um PDF e mostra os policiais encontrados."""
     print("="*60)
     print("TESTANDO PARSER DE ESCALA MILITAR")
     print("="*60)
@@ -71,5 +93,256 @@ def main():
         import traceback
         traceback.print_exc()
 
+
+# ============== TESTE DE REGRESSAO ==============
+
+def normalizar(nome: str) -> str:
+    """Compara nomes sem diferenca de caixa ou de espacos."""
+    return ' '.join(nome.upper().split())
+
+
+def carga_de_calibracao() -> int:
+    """
+    Trabalho fixo, parecido com o do parser (regex e texto) mas sem
+    usar o parser: mede a velocidade da maquina nesta execucao.
+    """
+    linhas = [f"EQUIPE {i}: SD NOME {i:04d} SOBRENOME; CB OUTRO {i:04d}." for i in range(400)]
+    regex = re.compile(r'(SD|CB)\s+([A-Z0-9\s]+?)(?:;|\.|$)')
+    return sum(len(regex.findall(' '.join(linha.upper().split()))) for linha in linhas)
+
+
+def _tamanho_lote(funcao) -> int:
+    """Chamadas seguidas da funcao que somam pelo menos TEMPO_MINIMO."""
+    inicio = time.perf_counter()
+    funcao()
+    return max(1, math.ceil(TEMPO_MINIMO / max(time.perf_counter() - inicio, 1e-6)))
+
+
+def _medir_lote(funcao, lote: int) -> float:
+    """Segundos por chamada, rodando a funcao 'lote' vezes seguidas."""
+    inicio = time.perf_counter()
+    for _ in range(lote):
+        funcao()
+    return (time.perf_counter() - inicio) / lote
+
+
+def cronometrar(funcao, repeticoes: int) -> tuple:
+    """
+    Mede o tempo de uma chamada da funcao, em segundos e em relacao
+    a carga de calibracao.
+
+    Cada repeticao mede um lote da calibracao, um lote da funcao e outro
+    da calibracao, e divide o tempo da funcao pela calibracao mais rapida
+    das duas: uma fase lenta da maquina atinge as medidas vizinhas e se
+    cancela na razao. Vale a menor razao (o ruido so aumenta o tempo).
+    O coletor de lixo fica desligado durante as medidas, como no timeit.
+
+    Returns:
+        Tupla (retorno da funcao, segundos por chamada, tempo relativo)
+    """
+    resultado = funcao()
+    lote = _tamanho_lote(funcao)
+    lote_calibracao = _tamanho_lote(carga_de_calibracao)
+
+    segundos, relativos = [], []
+    coletor_ligado = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeticoes):
+            antes = _medir_lote(carga_de_calibracao, lote_calibracao)
+            tempo = _medir_lote(funcao, lote)
+            depois = _medir_lote(carga_de_calibracao, lote_calibracao)
+            segundos.append(tempo)
+            relativos.append(tempo / min(antes, depois))
+    finally:
+        if coletor_ligado:
+            gc.enable()
+    return resultado, min(segundos), min(relativos)
+
+
+def medir_documento(parser: PDFParser, caminho_pdf: str, esperados: list, repeticoes: int) -> dict:
+    """
+    Roda o parser no documento e mede acerto e tempo de cada etapa.
+    """
+    texto, tempo_extracao, relativo_extracao = cronometrar(
+        lambda: parser.extrair_texto(caminho_pdf), repeticoes
+    )
+    policiais, tempo_identificacao, relativo_identificacao = cronometrar(
+        lambda: parser.identificar_nomes(texto), repeticoes
+    )
+
+    encontrados = {normalizar(p['nome_completo']) for p in policiais}
+    esperados = {normalizar(nome) for nome in esperados}
+    acertos = len(encontrados & esperados)
+
+    return {
+        "precisao": acertos / len(encontrados) if encontrados else 1.0,
+        "recall": acertos / len(esperados) if esperados else 1.0,
+        "faltando": sorted(esperados - encontrados),
+        "sobrando": sorted(encontrados - esperados),
+        "tempos": {
+            "extracao": tempo_extracao,
+            "identificacao": tempo_identificacao
+        },
+        "tempos_relativos": {
+            "extracao": relativo_extracao,
+            "identificacao": relativo_identificacao
+        }
+    }
+
+
+def comparar_com_baseline(nome: str, atual: dict, anterior: dict, tolerancia: float) -> list:
+    """
+    Compara o resultado de um documento com o baseline.
+    Precisao e recall nunca podem cair. O tempo de cada etapa eh comparado
+    em unidades de calibracao, so se a etapa passar de PISO_TEMPO.
+
+    Returns:
+        Lista com a descricao de cada regressao encontrada
+    """
+    falhas = []
+
+    for metrica in ("precisao", "recall"):
+        if atual[metrica] < anterior[metrica] - 1e-9:
+            falhas.append(f"{nome}: {metrica} caiu de {anterior[metrica]:.3f} para {atual[metrica]:.3f}")
+
+    # Baselines antigos guardavam tempos absolutos: so a precisao e o recall valem
+    for etapa, relativo_anterior in anterior.get("tempos_relativos", {}).items():
+        if atual["tempos"][etapa] < PISO_TEMPO:
+            continue
+        relativo = atual["tempos_relativos"][etapa]
+        limite = relativo_anterior * (1 + tolerancia)
+        if relativo > limite:
+            falhas.append(
+                f"{nome}: etapa '{etapa}' levou {relativo:.2f}x a calibracao "
+                f"(baseline {relativo_anterior:.2f}x, limite {limite:.2f}x)"
+            )
+
+    return falhas
+
+
+def testar_corpus(pasta: str, gravar_baseline: bool, tolerancia: float, repeticoes: int) -> int:
+    """
+    Roda o teste de regressao em todos os documentos do corpus.
+
+    Returns:
+        Codigo de saida (0 = ok, 1 = regressao)
+    """
+    documentos = sorted(
+        arquivo[:-4] for arquivo in os.listdir(pasta)
+        if arquivo.lower().endswith('.pdf') and os.path.exists(os.path.join(pasta, arquivo[:-4] + '.json'))
+    )
+    if not documentos:
+        print(f"❌ Nenhum documento no corpus: {pasta}")
+        return 1
+
+    caminho_baseline = os.path.join(pasta, ARQUIVO_BASELINE)
+    baseline = {}
+    if os.path.exists(caminho_baseline):
+        with open(caminho_baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    # O parser registra cada nome em INFO: aqui so interessa o relatorio
+    logging.getLogger().setLevel(logging.WARNING)
+
+    parser = PDFParser()
+    resultados = {}
+
+    print("="*96)
+    print("TESTE DE REGRESSAO DO PARSER")
+    print("="*96)
+    print(f"{'Documento':<34} | {'Precisao':>8} | {'Recall':>6} | {'Extracao':>9} | {'Identif.':>9} | {'Baseline':>14}")
+    print("-"*96)
+
+    for nome in documentos:
+        with open(os.path.join(pasta, nome + '.json'), 'r', encoding='utf-8') as f:
+            esperados = json.load(f)["policiais"]
+
+        r = medir_documento(parser, os.path.join(pasta, nome + '.pdf'), esperados, repeticoes)
+        resultados[nome] = r
+
+        anterior = baseline.get(nome)
+        referencia = f"{anterior['precisao']:.3f}/{anterior['recall']:.3f}" if anterior else "-"
+        print(f"{nome[:34]:<34} | {r['precisao']:>8.3f} | {r['recall']:>6.3f} | "
+              f"{r['tempos']['extracao'] * 1000:>7.2f}ms | {r['tempos']['identificacao'] * 1000:>7.2f}ms | "
+              f"{referencia:>14}")
+
+    print("-"*96)
+
+    # Detalha os erros de leitura (ajuda a entender uma queda de recall)
+    for nome, r in resultados.items():
+        if r["faltando"]:
+            print(f"{nome} - faltando: {', '.join(r['faltando'][:8])}"
+                  + (f" ... (+{len(r['faltando']) - 8})" if len(r['faltando']) > 8 else ""))
+        if r["sobrando"]:
+            print(f"{nome} - sobrando: {', '.join(r['sobrando'][:8])}"
+                  + (f" ... (+{len(r['sobrando']) - 8})" if len(r['sobrando']) > 8 else ""))
+
+    if gravar_baseline:
+        novo_baseline = {
+            nome: {
+                "precisao": r["precisao"],
+                "recall": r["recall"],
+                "tempos_relativos": {etapa: round(relativo, 3) for etapa, relativo in r["tempos_relativos"].items()}
+            }
+            for nome, r in resultados.items()
+        }
+        with open(caminho_baseline, 'w', encoding='utf-8') as f:
+            json.dump(novo_baseline, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Baseline gravado em {caminho_baseline}")
+        return 0
+
+    if not baseline:
+        print("\n⚠️  Sem baseline. Rode com --gravar-baseline para criar.")
+        return 0
+
+    falhas = []
+    for nome, r in resultados.items():
+        if nome in baseline:
+            falhas.extend(comparar_com_baseline(nome, r, baseline[nome], tolerancia))
+        else:
+            print(f"ℹ️  {nome} nao esta no baseline (documento novo)")
+
+    if falhas:
+        print(f"\n❌ REGRESSAO ({len(falhas)}):")
+        for falha in falhas:
+            print(f"  - {falha}")
+        return 1
+
+    print(f"\n✅ Sem regressao (tolerancia de tempo: {tolerancia:.0%}, "
+          f"etapas acima de {PISO_TEMPO * 1000:.0f}ms)")
+    return 0
+
+
+def main():
+    argumentos = argparse.ArgumentParser(description="Testador do parser de escala")
+    argumentos.add_argument("arquivo", nargs="?", help="PDF da escala para testar")
+    argumentos.add_argument("--corpus", nargs="?", const=PASTA_CORPUS,
+                            help="roda o teste de regressao na pasta do corpus")
+    argumentos.add_argument("--gravar-baseline", action="store_true",
+                            help="grava o resultado atual como novo baseline")
+    argumentos.add_argument("--tolerancia", type=float, default=0.5,
+                            help="aumento de tempo aceito por etapa (0.5 = 50%%)")
+    argumentos.add_argument("--repeticoes", type=int, default=5,
+                            help="medidas de cada etapa por documento (usa a menor)")
+    opcoes = argumentos.parse_args()
+
+    if opcoes.corpus:
+        sys.exit(testar_corpus(opcoes.corpus, opcoes.gravar_baseline, opcoes.tolerancia, opcoes.repeticoes))
+
+    # Verifica se o usuario passou o nome do arquivo
+    if not opcoes.arquivo:
+        print("="*60)
+        print("TESTADOR DE PARSER DE ESCALA")
+        print("="*60)
+        print("\nUso: python testar_parser.py <arquivo.pdf>")
+        print("     python testar_parser.py --corpus [pasta] [--gravar-baseline]")
+        print("\nExemplo:")
+        print("  python testar_parser.py escala_janeiro.pdf")
+        print("\n" + "="*60)
+        sys.exit(1)
+
+    testar_arquivo(opcoes.arquivo)
+
 if __name__ == "__main__":
     main()
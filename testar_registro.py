@@ -0,0 +1,135 @@
+"""
+SCRIPT DE TESTE - Cadastro de Policiais em Escala Estadual
+==========================================================
+Mede a memoria por policial e o tempo de carga do disco,
+comparando o formato antigo (dicionario por nome) com o
+registro compacto (registro_policiais.py).
+
+Como usar:
+    python testar_registro.py              (50 mil policiais)
+    python testar_registro.py --total 200000
+"""
+
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from registro_policiais import RegistroPoliciais
+
+POSTOS = ["SD", "CB", "3º SGT", "2º SGT", "1º SGT", "SUB TEN", "TEN", "CAP", "MAJ"]
+LETRAS = "BCDFGHJKLMNPRSTVXZ"
+
+
+def gerar_nome(i: int) -> str:
+    """Nome unico e deterministico, sem posto (ex: "BCDF GHJK")."""
+    partes = []
+    for _ in range(2):
+        palavra = ""
+        for _ in range(4):
+            palavra += LETRAS[i % len(LETRAS)]
+            i //= len(LETRAS)
+        partes.append(palavra)
+    return ' '.join(partes)
+
+
+def gerar_formato_antigo(total: int) -> dict:
+    """Policiais como eram gravados antes: nome -> {chat_id, data_cadastro, nome_completo}."""
+    agora = datetime.now().isoformat()
+    policiais = {}
+    for i in range(total):
+        nome = f"{POSTOS[i % len(POSTOS)]} {gerar_nome(i)}"
+        policiais[nome] = {"chat_id": 100000000 + i, "data_cadastro": agora, "nome_completo": nome}
+    return policiais
+
+
+def medir_carga(caminho: str, montar) -> tuple:
+    """
+    Carrega o arquivo e monta a estrutura em memoria.
+    O tempo eh medido sem o tracemalloc (que deixa tudo mais lento).
+
+    Returns:
+        Tupla (estrutura, segundos, bytes alocados)
+    """
+    gc.collect()
+    inicio = time.perf_counter()
+    with open(caminho, 'r', encoding='utf-8') as f:
+        montar(json.load(f))
+    duracao = time.perf_counter() - inicio
+
+    gc.collect()
+    tracemalloc.start()
+    with open(caminho, 'r', encoding='utf-8') as f:
+        estrutura = montar(json.load(f))
+    gc.collect()
+    memoria = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return estrutura, duracao, memoria
+
+
+def montar_antigo(policiais: dict) -> tuple:
+    """Como o banco fazia antes: o dicionario mais o indice chat_id -> nome."""
+    return policiais, {dados["chat_id"]: nome for nome, dados in policiais.items()}
+
+
+def montar_registro(linhas) -> RegistroPoliciais:
+    registro = RegistroPoliciais()
+    registro.carregar(linhas)
+    return registro
+
+
+def main():
+    argumentos = argparse.ArgumentParser(description="Mede o cadastro de policiais em escala estadual")
+    argumentos.add_argument("--total", type=int, default=50000, help="quantidade de policiais")
+    opcoes = argumentos.parse_args()
+
+    pasta = tempfile.mkdtemp(prefix="registro_")
+    arquivo_antigo = os.path.join(pasta, "antigo.json")
+    arquivo_compacto = os.path.join(pasta, "compacto.json")
+
+    antigo = gerar_formato_antigo(opcoes.total)
+    with open(arquivo_antigo, 'w', encoding='utf-8') as f:
+        json.dump(antigo, f, ensure_ascii=False, indent=2)
+
+    # Migracao: o registro le o formato antigo e grava o compacto
+    registro = montar_registro(antigo)
+    assert len(registro) == opcoes.total, "cadastros perdidos na migracao"
+    with open(arquivo_compacto, 'w', encoding='utf-8') as f:
+        json.dump(registro.exportar(), f, ensure_ascii=False, indent=2)
+    del antigo, registro
+
+    _, tempo_antigo, memoria_antiga = medir_carga(arquivo_antigo, montar_antigo)
+    registro, tempo_compacto, memoria_compacta = medir_carga(arquivo_compacto, montar_registro)
+
+    # Confere as buscas no registro carregado
+    amostra = f"{POSTOS[7 % len(POSTOS)]} {gerar_nome(7)}"
+    assert registro.buscar(amostra).chat_id == 100000007
+    assert registro.buscar("SD " + gerar_nome(7)).chat_id == 100000007  # posto diferente
+    assert registro.buscar_por_chat(100000007).nome_completo == amostra
+
+    total = opcoes.total
+    print("="*72)
+    print(f"CADASTRO DE {total} POLICIAIS")
+    print("="*72)
+    print(f"{'Formato':<22} | {'Arquivo':>10} | {'Carga':>9} | {'Memoria':>10} | {'Por policial':>12}")
+    print("-"*72)
+    for nome, arquivo, tempo, memoria in (
+        ("antigo (dicionario)", arquivo_antigo, tempo_antigo, memoria_antiga),
+        ("registro compacto", arquivo_compacto, tempo_compacto, memoria_compacta),
+    ):
+        print(f"{nome:<22} | {os.path.getsize(arquivo) / 1e6:>8.1f}MB | {tempo * 1000:>7.0f}ms | "
+              f"{memoria / 1e6:>8.1f}MB | {memoria / total:>10.0f} B")
+    print("-"*72)
+    print("Os dois formatos incluem o indice por chat_id usado pelo bot.")
+
+    os.remove(arquivo_antigo)
+    os.remove(arquivo_compacto)
+    os.rmdir(pasta)
+
+
+if __name__ == "__main__":
+    main()
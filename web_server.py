@@ -8,15 +8,36 @@ No plano gratuito, o bot "dorme" apos 15 minutos de inatividade.
 Este servidor cria uma pagina que pode ser acessada para manter
 o servico ativo.
 
+Tambem exporta o historico de escalas, rosters e confirmacoes
+(CSV ou JSON-lines) para planilhas, com paginacao por cursor.
+Veja a rota /exportar/<tipo> mais abaixo.
+
 Autor: Bot Escala Militar
 """
 
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request, stream_with_context
 from datetime import datetime
+import csv
+import hmac
+import io
+import json
 import os
 
+from historico import COLUNAS, Historico, dia_iso
+
 app = Flask(__name__)
 
+# Mesma pasta usada pelo bot.py
+ARQUIVO_DB = os.environ.get("ARQUIVO_DB", "database.json")
+PASTA_HISTORICO = os.environ.get("PASTA_HISTORICO", os.path.join(os.path.dirname(ARQUIVO_DB), "historico"))
+
+# Senha da exportacao (sem ela configurada, a exportacao fica desligada)
+TOKEN_EXPORTACAO = os.environ.get("TOKEN_EXPORTACAO", "")
+
+# Linhas por pagina (padrao e maximo); limite=0 exporta tudo de uma vez
+LIMITE_PADRAO = 1000
+LIMITE_MAXIMO = 50000
+
 @app.route('/')
 def home():
     """Pagina principal com informacoes do bot."""
@@ -89,6 +110,124 @@ def health():
     """Endpoint de health check."""
     return jsonify({'status': 'healthy'})
 
+# ============== EXPORTACAO ==============
+
+def _token_recebido():
+    """
+    Token do cabecalho "Authorization: Bearer ...".
+    Nao vem na URL: a URL fica nos logs de acesso e no historico do navegador.
+    """
+    cabecalho = request.headers.get('Authorization', '')
+    if cabecalho.startswith('Bearer '):
+        return cabecalho[len('Bearer '):].strip()
+    return ''
+
+
+def _ler_data(nome):
+    """Le um filtro de data (AAAA-MM-DD ou DD/MM/AAAA) da URL."""
+    valor = request.args.get(nome)
+    if not valor:
+        return None
+    # Volta sempre com zeros (5/3/2024 -> 2024-03-05): o filtro compara texto
+    return datetime.strptime(dia_iso(valor), '%Y-%m-%d').strftime('%Y-%m-%d')
+
+
+def _agrupar(pedacos, tamanho=64 * 1024):
+    """Junta pedacos pequenos em blocos de ~64KB (menos chamadas de escrita na rede)."""
+    bloco = []
+    acumulado = 0
+    for pedaco in pedacos:
+        bloco.append(pedaco)
+        acumulado += len(pedaco)
+        if acumulado >= tamanho:
+            yield type(pedaco)().join(bloco)
+            bloco = []
+            acumulado = 0
+    if bloco:
+        yield type(bloco[0])().join(bloco)
+
+
+def _linhas_csv(tipo, linhas):
+    """Converte as linhas JSON em CSV, uma de cada vez."""
+    colunas = COLUNAS[tipo]
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    
+    escritor.writerow(colunas)
+    yield buffer.getvalue()
+    
+    for linha in linhas:
+        buffer.seek(0)
+        buffer.truncate()
+        registro = json.loads(linha)
+        escritor.writerow(["" if registro.get(coluna) is None else registro.get(coluna) for coluna in colunas])
+        yield buffer.getvalue()
+
+
+@app.route('/exportar/<tipo>')
+def exportar(tipo):
+    """
+    Exporta o historico em paginas.
+    
+    Uso: /exportar/confirmacoes?formato=csv&desde=2024-01-01&ate=2024-12-31
+    
+    Parametros:
+        tipo: escalas, rosters ou confirmacoes
+        formato: jsonl (padrao) ou csv
+        desde, ate: filtro pelo dia (AAAA-MM-DD ou DD/MM/AAAA)
+        cursor: valor do cabecalho X-Proximo-Cursor da pagina anterior
+        limite: linhas por pagina (0 = tudo ate o fim)
+    
+    A resposta sai aos poucos (streaming): a memoria usada nao cresce
+    com o tamanho do historico.
+    """
+    if not TOKEN_EXPORTACAO:
+        return jsonify({'erro': 'Exportacao desativada (configure TOKEN_EXPORTACAO)'}), 503
+    if not hmac.compare_digest(_token_recebido().encode(), TOKEN_EXPORTACAO.encode()):
+        return jsonify({'erro': 'Token invalido'}), 401
+    if tipo not in COLUNAS:
+        return jsonify({'erro': f"Tipo invalido. Use: {', '.join(COLUNAS)}"}), 404
+    
+    formato = request.args.get('formato', 'jsonl')
+    if formato not in ('jsonl', 'csv'):
+        return jsonify({'erro': 'Formato invalido. Use: jsonl ou csv'}), 400
+    
+    try:
+        desde = _ler_data('desde')
+        ate = _ler_data('ate')
+        cursor = request.args.get('cursor', '0')
+        Historico.ler_cursor(cursor)
+        limite = int(request.args.get('limite', LIMITE_PADRAO))
+    except ValueError:
+        return jsonify({'erro': 'Parametro invalido (datas AAAA-MM-DD, cursor do X-Proximo-Cursor e limite inteiro)'}), 400
+    if not 0 <= limite <= LIMITE_MAXIMO:
+        return jsonify({'erro': f'Limite deve estar entre 0 e {LIMITE_MAXIMO}'}), 400
+    
+    # So leitura: quem cria as pastas e migra os arquivos eh o bot
+    historico = Historico(PASTA_HISTORICO)
+    
+    # Primeiro acha o fim da pagina (para o cursor ir no cabecalho),
+    # depois envia as linhas lendo os arquivos de novo
+    if limite:
+        fim, tem_mais = historico.paginar(tipo, cursor, limite, desde, ate)
+    else:
+        fim, tem_mais = historico.fim(tipo), False
+    
+    linhas = historico.ler(tipo, cursor, fim, desde, ate)
+    if formato == 'csv':
+        corpo = _linhas_csv(tipo, linhas)
+        tipo_conteudo = 'text/csv; charset=utf-8'
+    else:
+        corpo = linhas
+        tipo_conteudo = 'application/x-ndjson; charset=utf-8'
+    
+    resposta = Response(stream_with_context(_agrupar(corpo)), content_type=tipo_conteudo)
+    resposta.headers['X-Proximo-Cursor'] = fim
+    resposta.headers['X-Tem-Mais'] = 'true' if tem_mais else 'false'
+    if formato == 'csv':
+        resposta.headers['Content-Disposition'] = f'attachment; filename="{tipo}.csv"'
+    return resposta
+
 if __name__ == '__main__':
     # Pega a porta do ambiente (Render define automaticamente)
     porta = int(os.environ.get('PORT', 5000))